@@ -0,0 +1,225 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+import asyncio
+import contextlib
+import json
+from typing import AsyncIterator, Iterable, List
+
+import aiohttp
+import backoff
+
+import metrics
+import mirror
+import ratelimit
+from pywiki import MAXLAG, MAXLAG_RETRIES, READ_ACTIONS, EditConflictException, NoSuchEntityException, \
+    get_retry_after
+from version import __version__
+
+# Maximum number of connections opened at the same time to a host by a client
+MAX_CONNECTIONS_PER_HOST = 4
+# Maximum number of seconds a request may take, response included
+REQUEST_TIMEOUT = 120
+
+
+class AsyncPywiki:
+    """
+    Same client as Pywiki, but whose requests can be sent while others are in flight.
+    Many reads may be sent at the same time, while the writes are sent one after the other.
+    It shares the request rates of its host with Pywiki.
+    """
+
+    def __init__(self, username: str, password: str, api_endpoint, user_type: str, dry_run: bool,
+                 connections: int = MAX_CONNECTIONS_PER_HOST):
+        self.username = username
+        self.password = password
+        self.dry_run = dry_run
+        self.api_endpoint = api_endpoint
+        self.user_type = user_type
+        self.connections = connections
+        # Whether the account has the apihighlimits right; None until checked after the login
+        self.high_limits = None
+        self.csrf_token = None
+        self.host = mirror.host(api_endpoint)
+        self.limiter = ratelimit.get(self.host)
+        # Kept from one connection to the next, so that the login is not lost
+        self.cookie_jar = None
+        self.session = None
+        self.write_lock = None
+
+    @contextlib.asynccontextmanager
+    async def connect(self) -> AsyncIterator["AsyncPywiki"]:
+        """
+        Open the connections to the wiki, for the time of the current event loop,
+        and log in if it has not been done yet.
+        """
+        if self.cookie_jar is None:
+            self.cookie_jar = aiohttp.CookieJar()
+
+        async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=self.connections),
+            cookie_jar=self.cookie_jar,
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+            headers={
+                'User-Agent': f'Lingua Libre Bot/{__version__}'
+                              + ' (https://github.com/lingua-libre/Lingua-Libre-Bot)'
+            },
+        ) as session:
+            self.session = session
+            self.write_lock = asyncio.Lock()
+            try:
+                if self.high_limits is None:
+                    await self.login()
+                yield self
+            finally:
+                self.session = None
+                self.write_lock = None
+
+    @backoff.on_exception(backoff.expo,
+                          (aiohttp.ClientConnectionError,
+                           aiohttp.ClientPayloadError,
+                           asyncio.TimeoutError,
+                           json.decoder.JSONDecodeError),
+                          max_tries=8,
+                          on_backoff=metrics.backoff_handler(
+                              "asyncpywiki", lambda api, data, files=None: {"host": api.host, "action": data["action"]}))
+    async def request(self, data, files=None):
+        """
+        Perform a given request with the same error management as Pywiki.request
+        @param data:
+        @param files: the files to upload, by name of field
+        @return:
+        """
+        if self.dry_run and data["action"] != "query":
+            print(data)
+            return {"dryrun": True}
+
+        if data["action"] in READ_ACTIONS:
+            return await self.__send(data, files, False)
+
+        async with self.write_lock:
+            return await self.__send(data, files, True)
+
+    async def __send(self, data, files, write: bool):
+        action = data["action"]
+        bucket = self.limiter.bucket(write)
+        data.setdefault("maxlag", MAXLAG)
+
+        relogin = 3
+        badtoken = 1
+        slowdowns = MAXLAG_RETRIES
+        while relogin:
+            wait = bucket.reserve()
+            if wait > 0:
+                metrics.count("http_wait_seconds_total", wait, host=self.host, reason="ratelimit")
+                await asyncio.sleep(wait)
+
+            with metrics.timer("http_request_seconds", host=self.host, action=action):
+                async with self.session.post(self.api_endpoint, data=self.__form(data, files)) as r:
+                    if r.status in (429, 503) and "Retry-After" in r.headers and slowdowns:
+                        # The server is overloaded: wait for as long as it asks, then go on more slowly
+                        metrics.count("http_retries_total", host=self.host, action=action, reason=str(r.status))
+                        bucket.slow_down(get_retry_after(r))
+                        slowdowns -= 1
+                        continue
+                    response = json.loads(await r.text())
+
+            if "error" in response:
+                if response["error"]["code"] == "maxlag" and slowdowns:
+                    metrics.count("http_retries_total", host=self.host, action=action, reason="maxlag")
+                    bucket.slow_down(get_retry_after(r, response["error"].get("lag", MAXLAG)))
+                    slowdowns -= 1
+                    continue
+                if response["error"]["code"] == "assertuserfailed":
+                    metrics.count("http_retries_total", host=self.host, action=action, reason="assertuserfailed")
+                    await self.login()
+                    relogin -= 1
+                    continue
+                if response["error"]["code"] == "badtoken" and "token" in data and badtoken:
+                    # The cached token has expired, fetch a fresh one and try again
+                    metrics.count("http_retries_total", host=self.host, action=action, reason="badtoken")
+                    self.csrf_token = None
+                    data["token"] = await self.get_csrf_token()
+                    badtoken -= 1
+                    continue
+                if response["error"]["code"] == "no-such-entity":
+                    raise NoSuchEntityException()
+                if response["error"]["code"] == "editconflict":
+                    raise EditConflictException()
+                metrics.count("http_errors_total", host=self.host, action=action, code=response["error"]["code"])
+                break
+            bucket.speed_up()
+            return response
+
+        raise Exception("API error", response["error"])
+
+    @staticmethod
+    def __form(data, files):
+        if files is None:
+            return data
+
+        form = aiohttp.FormData()
+        for name, value in data.items():
+            form.add_field(name, str(value))
+        for name, file in files.items():
+            form.add_field(name, file)
+        return form
+
+    async def gather(self, requests: Iterable[dict]) -> List[dict]:
+        """
+        Send the given requests at the same time.
+        @param requests: the parameters of each request
+        @return: the responses, in the same order as the requests
+        """
+        return list(await asyncio.gather(*(self.request(data) for data in requests)))
+
+    async def login(self) -> int:
+        """
+        Login into the wiki
+        :returns:
+        """
+        # Tokens are bound to the session, a new login invalidates them
+        self.csrf_token = None
+        data = {
+            "action": "login",
+            "lgname": self.username,
+            "lgpassword": self.password,
+            "format": "json",
+        }
+        async with self.session.post(self.api_endpoint, data=data) as r:
+            token = json.loads(await r.text())["login"]["token"]
+        async with self.session.post(self.api_endpoint, data={**data, "lgtoken": token}) as r:
+            result = -1 if json.loads(await r.text())["login"]["result"] != "Success" else 0
+
+        r = await self.request(
+            {
+                "action": "query",
+                "meta": "userinfo",
+                "uiprop": "rights",
+                "format": "json",
+            }
+        )
+        self.high_limits = "apihighlimits" in r["query"]["userinfo"].get("rights", [])
+        return result
+
+    async def get_csrf_token(self):
+        """
+          Get a crsf token to be able to edit a page.
+          The token is cached for the whole session and only fetched again
+          after a new login or when the API answers with a badtoken error.
+        """
+        if self.csrf_token is not None:
+            return self.csrf_token
+
+        r = await self.request(
+            {
+                "action": "query",
+                "meta": "tokens",
+                "type": "csrf",
+                "assert": self.user_type,
+                "format": "json",
+            }
+        )
+        self.csrf_token = r["query"]["tokens"]["csrftoken"]
+        return self.csrf_token
@@ -0,0 +1,52 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+import json
+import os
+import time
+from typing import Optional
+
+# Directory in which the data kept between two runs of the bot are stored
+# (or in the one given by the LLBOT_CACHE environment variable, e.g. to keep test runs apart)
+CACHE_DIRECTORY = os.environ.get("LLBOT_CACHE", f"{os.path.dirname(os.path.realpath(__file__))}/cache")
+
+
+def get_path(name: str) -> str:
+    """
+    @param name: the name of a cache file
+    @return: the path of the file, the cache directory being created if needed
+    """
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    return f"{CACHE_DIRECTORY}/{name}"
+
+
+def load(name: str, ttl: Optional[float] = None) -> Optional[dict]:
+    """
+    Read the data stored in the given cache file.
+    @param name: the name of the cache file
+    @param ttl: the number of seconds after which the data are outdated; None if they never are
+    @return: the stored data; None if there are none or if they are outdated
+    """
+    try:
+        with open(get_path(name), encoding="utf-8") as file:
+            content = json.load(file)
+    except (OSError, json.decoder.JSONDecodeError):
+        return None
+
+    if ttl is not None and time.time() - content["timestamp"] > ttl:
+        return None
+
+    return content["data"]
+
+
+def save(name: str, data: dict) -> None:
+    """
+    Store the given data in the given cache file, replacing its former content.
+    @param name: the name of the cache file
+    @param data: the data to store, which must be serializable in JSON
+    """
+    path = get_path(name)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        json.dump({"timestamp": time.time(), "data": data}, file, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
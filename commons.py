@@ -0,0 +1,139 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import mirror
+import pywiki
+
+COMMONS_API = mirror.url("https://commons.wikimedia.org/w/api.php")
+
+
+def strip_namespace(title: str) -> str:
+    return title.split(":", 1)[1] if ":" in title else title
+
+
+class Commons:
+    """
+    Client of Wikimedia Commons shared by all the wikis, which checks whether the files
+    of the records still exist, and under which name since some of them have been renamed.
+    """
+
+    def __init__(self, username: str, password: str) -> None:
+        """
+        Constructor.
+        @param username: Username to login to Commons
+        @param password: Password to log into the account
+        """
+        # Only reads are sent to Commons
+        self.api = pywiki.Pywiki(username, password, COMMONS_API, "user", False)
+        self.lock = threading.Lock()
+        # Current name of each file looked for; None if it no longer exists
+        self.names: Dict[str, Optional[str]] = {}
+
+    def resolve(self, filenames: Iterable[str]) -> None:
+        """
+        Check at once whether the given files exist, following their renamings,
+        as many files per request as the account is allowed to.
+        @param filenames: the names of the files, without namespace
+        """
+        with self.lock:
+            filenames = sorted({filename for filename in filenames if filename not in self.names})
+            if filenames:
+                self.api.check_rights()
+            for i in range(0, len(filenames), self.api.batch_size):
+                self.__resolve_batch(filenames[i:i + self.api.batch_size])
+
+    def current_name(self, filename: str) -> Optional[str]:
+        """
+        @param filename: the name of a file, without namespace
+        @return: the name of the file on Commons, which may differ after a renaming; None if it does not exist
+        """
+        self.resolve([filename])
+        return self.names[filename]
+
+    def __resolve_batch(self, filenames: List[str]) -> None:
+        response = self.api.request(
+            {
+                "action": "query",
+                "format": "json",
+                "formatversion": "2",
+                "titles": "|".join(f"File:{filename}" for filename in filenames),
+                # The files renamed with a redirect are followed at once
+                "redirects": 1,
+            }
+        )
+
+        query = response["query"]
+        targets = {}
+        for item in query.get("normalized", []) + query.get("redirects", []):
+            targets[item["from"]] = item["to"]
+
+        pages = {page["title"]: page for page in query["pages"]}
+        for filename in filenames:
+            title = f"File:{filename}"
+            # Normalized first, then redirected
+            for _ in range(2):
+                if title in targets and title not in pages:
+                    title = targets[title]
+
+            page = pages.get(title)
+            if page is not None and "missing" not in page and "invalid" not in page:
+                self.names[filename] = strip_namespace(title)
+            else:
+                # Renamed without redirect, or deleted: only the log tells
+                self.names[filename] = self.__find_renaming(filename)
+
+            # The records are then known under the new name
+            if self.names[filename] is not None:
+                self.names.setdefault(self.names[filename], self.names[filename])
+
+    def __find_renaming(self, filename: str) -> Optional[str]:
+        response = self.api.request(
+            {
+                "action": "query",
+                "format": "json",
+                "formatversion": "2",
+                "letitle": f"File:{filename}",
+                "list": "logevents",
+                "letype": "move",
+            }
+        )
+
+        for event in response["query"]["logevents"]:
+            if "params" not in event:
+                continue
+            target = strip_namespace(event["params"]["target_title"])
+            response = self.api.request(
+                {
+                    "action": "query",
+                    "format": "json",
+                    "formatversion": "2",
+                    "titles": f"File:{target}",
+                }
+            )
+            if "missing" not in response["query"]["pages"][0]:
+                return target
+            break
+
+        return None
+
+
+_commons: Optional[Commons] = None
+_commons_lock = threading.Lock()
+
+
+def get(username: str, password: str) -> Commons:
+    """
+    @param username: Username to login to Commons
+    @param password: Password to log into the account
+    @return: the client of Commons shared by all the wikis
+    """
+    global _commons
+
+    with _commons_lock:
+        if _commons is None:
+            _commons = Commons(username, password)
+        return _commons
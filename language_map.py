@@ -0,0 +1,117 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+from typing import Dict, Iterable, Optional, Sequence
+
+import cache
+import sparql
+from sparql import SPARQL_ENDPOINT
+
+CACHE_NAME = "language_map.json"
+# The language codes barely change, a week old map is still good enough
+CACHE_TTL = 7 * 24 * 3600
+
+LANGUAGE_QUERY = """
+SELECT ?item ?code ?label
+WHERE {
+  ?item wdt:P305 ?code.
+  OPTIONAL { ?item rdfs:label ?label. FILTER( LANG(?label) IN ($1) ) }
+}
+"""
+
+
+class LanguageMap:
+    """
+    Map the Wikidata items of the languages to their BCP 47 code (P305)
+    and to their labels in the languages needed by the wikis.
+    """
+
+    def __init__(self, codes: Dict[str, str], labels: Dict[str, Dict[str, str]], languages: Iterable[str]) -> None:
+        self.codes = codes
+        self.labels = labels
+        self.languages = set(languages)
+
+    def label(self, qid: str, languages: Sequence[str]) -> str:
+        """
+        Get the label of the given item, with the same fallbacks as the SPARQL label service.
+        @param qid: the id of the item
+        @param languages: the languages in which the label is searched, by order of preference
+        @return: the first label found; the id of the item if there is none
+        """
+        labels = self.labels.get(qid, {})
+        for language in languages:
+            if language in labels:
+                return labels[language]
+        return qid
+
+
+_required_languages = set()
+_language_map: Optional[LanguageMap] = None
+
+
+def require_labels(languages: Iterable[str]) -> None:
+    """
+    Declare languages in which the labels of the items are needed,
+    so that all of them are fetched at once.
+    @param languages: the codes of the languages
+    """
+    _required_languages.update(languages)
+
+
+def get() -> LanguageMap:
+    """
+    Get the language map shared by all the wikis, from the disk if it is recent enough.
+    @return: the language map
+    """
+    global _language_map
+
+    if _language_map is not None and _required_languages <= _language_map.languages:
+        return _language_map
+
+    data = cache.load(CACHE_NAME, CACHE_TTL)
+    if data is not None and _required_languages <= set(data["languages"]):
+        _language_map = LanguageMap(data["codes"], data["labels"], data["languages"])
+        return _language_map
+
+    return refresh()
+
+
+def refresh() -> LanguageMap:
+    """
+    Fetch the language map from Wikidata and store it on the disk.
+    @return: the language map
+    """
+    global _language_map
+
+    # Keep the labels of the languages needed by the wikis not run this time
+    data = cache.load(CACHE_NAME)
+    if data is not None:
+        _required_languages.update(data["languages"])
+
+    languages = sorted(_required_languages)
+    raw_language_map = sparql.request(
+        SPARQL_ENDPOINT,
+        LANGUAGE_QUERY.replace("$1", ", ".join(f'"{language}"' for language in languages) or '""')
+    )
+
+    if not raw_language_map:
+        # Better use outdated data than none at all
+        if data is not None:
+            print("Could not refresh the language map, using the cached one")
+            _language_map = LanguageMap(data["codes"], data["labels"], data["languages"])
+            return _language_map
+
+    codes = {}
+    labels = {}
+    for line in raw_language_map:
+        item = sparql.format_value(line, "item")
+        codes[item] = sparql.format_value(line, "code")
+        if "label" in line:
+            labels.setdefault(item, {})[line["label"]["xml:lang"]] = line["label"]["value"]
+
+    if codes:
+        cache.save(CACHE_NAME, {"languages": languages, "codes": codes, "labels": labels})
+
+    _language_map = LanguageMap(codes, labels, languages)
+    return _language_map
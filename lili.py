@@ -1,16 +1,44 @@
+import concurrent.futures
 import datetime
+import itertools
 import json
+import os
+import queue
+import threading
 import time
-from typing import List
+from typing import List, Iterator, Iterable, Optional, Tuple
 
+import backoff
 import requests
 
+import cache
+import language_map
+import location_map
+import metrics
+import mirror
+import profiling
 import sparql
 
-from record import Record
+from record import Record, intern
 
-ENDPOINT = "https://lingualibre.org/bigdata/namespace/wdq/sparql"
-API = "https://lingualibre.org/api.php"
+ENDPOINT = mirror.url("https://lingualibre.org/bigdata/namespace/wdq/sparql")
+API = mirror.url("https://lingualibre.org/api.php")
+# Where the live mode remembers the last recent change it has read
+CHECKPOINT_NAME = "live_checkpoint.json"
+# Number of seconds during which an item found in the recent changes is looked for in the SPARQL endpoint
+PENDING_ITEM_TTL = 3600
+# Number of records executed between two prefetches of the wikis
+PREFETCH_WINDOW = 500
+# Queries timing out are split by date: they start no earlier than the first records,
+# and stop being split below one hour
+FIRST_RECORD_DATE = datetime.datetime(2017, 1, 1, tzinfo=datetime.timezone.utc)
+MIN_DATE_RANGE = datetime.timedelta(hours=1)
+# Number of parts of a split query sent at the same time to the SPARQL endpoint
+DEFAULT_SPARQL_WORKERS = 3
+# Languages on which the backfill mode runs, one Lingua Libre QID per line
+LANGUAGES_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "list_languages.txt")
+# Number of languages whose records are fetched at the same time by the backfill mode
+DEFAULT_BACKFILL_WORKERS = 4
 BASEQUERY = """
 SELECT DISTINCT
     ?record ?file ?transcription
@@ -44,96 +72,277 @@ WHERE {
   }
 
   #filters
+  #dates
 }"""
 
+# Start date (None if unbounded), end date (None if unbounded), whether the start date is included
+DateRange = Tuple[Optional[str], Optional[str], bool]
 
-def get_records(query: str) -> List[Record]:
+
+def get_records(query: str, startdate: Optional[str] = None, enddate: Optional[str] = None,
+                workers: int = DEFAULT_SPARQL_WORKERS) -> List[Record]:
+    """
+    Get the records matching the given query between the given dates.
+    If the query times out, it is split by date until each part succeeds;
+    up to `workers` parts are sent at the same time.
+    The parts still failing with an error once sent again make the whole query fail.
+    @param query: the SPARQL query, with a #dates placeholder
+    @param startdate: the date after which the records were made
+    @param enddate: the date before which the records were made
+    @param workers: the maximum number of queries sent at the same time
+    @return: the records
+    """
     print("Requesting data")
-    raw_records = sparql.request(ENDPOINT, query)
-    print("Request done")
-    records = [Record(
-        id=sparql.format_value(record, "record"),
-        file=sparql.format_value(record, "file"),
-        transcription=sparql.format_value(record, "transcription"),
-        speaker_residence=sparql.format_value(record, "residence"),
-        links={
-            "wikidata": sparql.format_value(record, "wikidataId"),
-            "lexeme": sparql.format_value(record, "lexemeId"),
-            "wikipedia": sparql.format_value(record, "wikipediaTitle"),
-            "wiktionary": sparql.format_value(record, "wiktionaryEntry"),
-        },
-        language={
-            "qid": sparql.format_value(record, "languageQid"),
-            "learning": sparql.format_value(record, "learningPlace"),
-            "level": sparql.format_value(record, "languageLevel"),
-        })
-        for record in raw_records]
+    results = {}
+    skipped = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        date_range = (startdate, enddate, False)
+        futures = {executor.submit(fetch_records, query, date_range): date_range}
+        while futures:
+            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                date_range = futures.pop(future)
+                try:
+                    results[date_range] = future.result()
+                except sparql.QueryTimeoutException:
+                    metrics.count("sparql_timeouts_total")
+                    halves = split_date_range(date_range)
+                    if not halves:
+                        skipped.append(date_range)
+                    for half in halves:
+                        futures[executor.submit(fetch_records, query, half)] = half
+
+    records = [record for date_range in sorted(results, key=get_start_date) for record in results[date_range]]
     print(f"Found {len(records)} records.")
+    print_skipped_ranges(skipped)
     return records
 
 
-def live_mode(args, supported_wikis):
-    delay = args.delay
-    time_delta = datetime.datetime.utcnow() - datetime.timedelta(seconds=args.backcheck)
-    prev_timestamp = f'{time_delta.replace(microsecond=0).isoformat()}Z'
-    prev_items = set()
-    items = set()
-    while True:
-        start_time = time.time()
+def iter_partitioned_records(query: str, startdate: Optional[str] = None,
+                             enddate: Optional[str] = None) -> Iterator[Record]:
+    """
+    Same as get_records, but the records are yielded while they are being downloaded
+    and the parts of a split query are sent one after the other.
+    """
+    # Each date range comes with the ids of the records already yielded from the range it is part of:
+    # Blazegraph only reports a timeout after the results it has already sent
+    pending = [((startdate, enddate, False), set())]
+    skipped = []
+    while pending:
+        date_range, already_yielded = pending.pop(0)
+        yielded = set()
+        try:
+            for record in iter_records(add_date_filter(query, date_range), raise_on_timeout=True):
+                if record.id not in already_yielded:
+                    yielded.add(record.id)
+                    yield record
+        except sparql.QueryTimeoutException:
+            metrics.count("sparql_timeouts_total")
+            halves = split_date_range(date_range)
+            if not halves:
+                skipped.append(date_range)
+            pending[:0] = [(half, already_yielded | yielded) for half in halves]
+    print_skipped_ranges(skipped)
+
+
+def fetch_records(query: str, date_range: DateRange) -> List[Record]:
+    return list(iter_records(add_date_filter(query, date_range), raise_on_timeout=True))
+
+
+def add_date_filter(query: str, date_range: DateRange) -> str:
+    startdate, enddate, include_start = date_range
+    filters = ""
+    if startdate or enddate:
+        filters += ' ?record prop:P6 ?date .'
+        if startdate is not None:
+            operator = ">=" if include_start else ">"
+            filters += f'FILTER( ?date {operator} "' + startdate + '"^^xsd:dateTime ).'
+        if enddate is not None:
+            filters += 'FILTER( ?date < "' + enddate + '"^^xsd:dateTime ).'
+    return query.replace("#dates", filters)
+
+
+def parse_date(date: str) -> datetime.datetime:
+    parsed = datetime.datetime.fromisoformat(date.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+def get_start_date(date_range: DateRange) -> datetime.datetime:
+    return parse_date(date_range[0]) if date_range[0] is not None else FIRST_RECORD_DATE
+
+
+def split_date_range(date_range: DateRange) -> List[DateRange]:
+    """
+    Split a date range in two halves, unless it is already too short.
+    @param date_range: the date range of a query that timed out
+    @return: the two halves; an empty list if the range is too short to be split
+    """
+    startdate, enddate, include_start = date_range
+    start = get_start_date(date_range)
+    end = parse_date(enddate) if enddate is not None else datetime.datetime.now(datetime.timezone.utc)
+
+    if end - start < 2 * MIN_DATE_RANGE:
+        metrics.count("sparql_ranges_skipped_total")
+        print(f"Query still timing out between {start.isoformat()} and {end.isoformat()}, "
+              "the records of this period are skipped")
+        return []
+
+    middle = (start + (end - start) / 2).replace(microsecond=0).isoformat()
+    print(f"Query timed out between {start.isoformat()} and {end.isoformat()}, splitting it at {middle}")
+    return [(startdate, middle, include_start), (middle, enddate, True)]
+
+
+def print_skipped_ranges(skipped: List[DateRange]) -> None:
+    if skipped:
+        print(f"Error: the records of {len(skipped)} periods are missing, the query timing out on them: "
+              + ", ".join(f"{get_start_date(date_range).isoformat()} - {date_range[1] or 'now'}"
+                          for date_range in sorted(skipped, key=get_start_date)))
+
 
-        r = requests.get(
-            API,
-            {
-                "action": "query",
-                "format": "json",
-                "list": "recentchanges",
-                "rcstart": prev_timestamp,
-                "rcdir": "newer",
-                "rcnamespace": "0",
-                "rcprop": "title|ids",
-                "rclimit": "500",
-                "rctype": "new|edit",
-            },
+def iter_records(query: str, raise_on_timeout: bool = False) -> Iterator[Record]:
+    """
+    Build the records while the results of the query are being downloaded.
+    @param query: the SPARQL query
+    @param raise_on_timeout: whether to raise a QueryTimeoutException if the query times out
+    @return: an iterator over the records
+    """
+    for record in sparql.stream_request(ENDPOINT, query, raise_on_timeout):
+        # The languages, levels and places are shared by many records: they are stored once for all of them
+        yield Record(
+            id=sparql.format_value(record, "record"),
+            file=sparql.format_value(record, "file"),
+            transcription=sparql.format_value(record, "transcription"),
+            speaker_residence=intern(sparql.format_value(record, "residence")),
+            wikidata_id=sparql.format_value(record, "wikidataId"),
+            lexeme_id=sparql.format_value(record, "lexemeId"),
+            wikipedia_title=sparql.format_value(record, "wikipediaTitle"),
+            wiktionary_entry=sparql.format_value(record, "wiktionaryEntry"),
+            language_qid=intern(sparql.format_value(record, "languageQid")),
+            learning_place=intern(sparql.format_value(record, "learningPlace")),
+            language_level=intern(sparql.format_value(record, "languageLevel")),
         )
-        data = json.loads(r.text)["query"]["recentchanges"]
 
-        prev_timestamp = f"{datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0).isoformat()}Z"
 
-        print("Current time:", prev_timestamp)
+def split_in_windows(records: Iterable[Record], size: int) -> Iterator[List[Record]]:
+    window = []
+    for record in records:
+        window.append(record)
+        if len(window) == size:
+            yield window
+            window = []
+    if window:
+        yield window
 
-        for rc in data:
-            items.add(rc["title"])
+
+def live_mode(args, supported_wikis):
+    delay = args.delay
+    checkpoint = cache.load(CHECKPOINT_NAME)
+    if checkpoint is None or args.backcheck is not None:
+        time_delta = datetime.datetime.utcnow() - datetime.timedelta(seconds=args.backcheck or 0)
+        checkpoint = {
+            "timestamp": f'{time_delta.replace(microsecond=0).isoformat()}Z',
+            "rcid": 0,
+            "pending": {},
+        }
+    else:
+        print(f"Resuming from {checkpoint['timestamp']} (rcid {checkpoint['rcid']})")
+
+    # Items found in the recent changes but not executed yet, along with the time they were first found
+    items = checkpoint["pending"]
+    while True:
+        start_time = time.time()
+
+        for rc in iter_recent_changes(checkpoint["timestamp"], checkpoint["rcid"]):
+            items.setdefault(rc["title"], start_time)
+            checkpoint["timestamp"] = rc["timestamp"]
+            checkpoint["rcid"] = rc["rcid"]
             print("found:", rc["title"])
 
-        if len(items.difference(prev_items)) > 0:
-            args.item = ",".join(items.difference(prev_items))
-            prev_items = set(simple_mode(args, supported_wikis))
-            print(len(prev_items))
+        print("Current time:", f"{datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0).isoformat()}Z")
 
-        items = items.difference(prev_items)
+        if len(items) > 0:
+            args.item = ",".join(items)
+            for item in simple_mode(args, supported_wikis):
+                items.pop(item, None)
+
+        # The SPARQL endpoint lags behind the wiki: the items it does not know yet are tried again
+        # on the next loops, until they are considered as not being records
+        for item, found_time in list(items.items()):
+            if start_time - found_time > PENDING_ITEM_TTL:
+                print(f"{item}: still not found, given up")
+                del items[item]
 
         if len(items) > 0:
             print("Remaining items: " + ",".join(items))
 
+        # Saved once the items have been executed, so that a crash never loses any of them
+        cache.save(CHECKPOINT_NAME, checkpoint)
+        if getattr(args, "prometheus", None) is not None:
+            metrics.write_prometheus(args.prometheus)
+
         # Pause the bot if we've not already spend too much time
         time_to_wait = delay - (time.time() - start_time)
         if time_to_wait > 0:
             time.sleep(time_to_wait)
 
 
+def iter_recent_changes(timestamp: str, rcid: int) -> Iterator[dict]:
+    """
+    Iterate over all the recent changes of the items on Lingua Libre, however many they are.
+    @param timestamp: the timestamp from which to start, included
+    @param rcid: the id of the last change already seen; the changes up to it are skipped
+    @return: an iterator over the recent changes, from the oldest to the newest
+    """
+    continuation = {}
+    while True:
+        response = _get_recent_changes({
+            "action": "query",
+            "format": "json",
+            "list": "recentchanges",
+            "rcstart": timestamp,
+            "rcdir": "newer",
+            "rcnamespace": "0",
+            "rcprop": "title|ids|timestamp",
+            "rclimit": "max",
+            "rctype": "new|edit",
+            **continuation,
+        })
+
+        for rc in response["query"]["recentchanges"]:
+            # The changes made at the timestamp of the checkpoint are listed again
+            if rc["rcid"] > rcid:
+                yield rc
+
+        if "continue" not in response:
+            return
+        continuation = response["continue"]
+
+
+@backoff.on_exception(backoff.expo,
+                      exception=(requests.exceptions.Timeout,
+                                 requests.exceptions.ConnectionError,
+                                 json.decoder.JSONDecodeError),
+                      max_tries=5,
+                      on_backoff=metrics.backoff_handler(
+                          "recentchanges", lambda params: {"host": mirror.host(API), "action": params["action"]}))
+def _get_recent_changes(params: dict) -> dict:
+    with metrics.timer("http_request_seconds", host=mirror.host(API), action="query"):
+        return json.loads(requests.get(API, params, timeout=60).text)
+
+
 def simple_mode(args, supported_wikis):
     # Add some filters depending on the fetched arguments
     filters = ""
+    startdate = None
+    enddate = None
     if args.item is not None:
         filters = "VALUES ?record {entity:" + " entity:".join(args.item.split(",")) + "}."
 
     else:
-        if args.startdate or args.enddate:
-            filters += ' ?record prop:P6 ?date .'
-            if args.startdate is not None:
-                filters += 'FILTER( ?date > "' + args.startdate + '"^^xsd:dateTime ).'
-            if args.enddate is not None:
-                filters += 'FILTER( ?date < "' + args.enddate + '"^^xsd:dateTime ).'
+        startdate = args.startdate
+        enddate = args.enddate
         if args.user is not None:
             filters += '?speaker prop:P11 ?linkeduser. FILTER( ?linkeduser = "' + args.user + '" ).'
         if args.lang is not None:
@@ -143,22 +352,231 @@ def simple_mode(args, supported_wikis):
         elif args.langwm is not None:
             filters += 'OPTIONAL { ?language prop:P17 ?languageWMCode.} FILTER( ?languageWMCode="' + args.langwm + '").'
 
-            # Get the informations of all the records
-    records = get_records(BASEQUERY.replace("#filters", filters))
+    query = BASEQUERY.replace("#filters", filters)
+    record_ids = []
 
-    # Prepare the records (fetch extra infos, clean some datas,...)
-    for dbname in supported_wikis:
-        records = supported_wikis[dbname].prepare(records)
+    if getattr(args, "stream", False):
+        # Prepare and execute the records window by window, while they are being downloaded
+        print("Requesting data")
+        records = iter_partitioned_records(query, startdate, enddate)
+        windows = prepare_windows(split_in_windows(records, PREFETCH_WINDOW), supported_wikis, record_ids)
+        total = None
+    else:
+        # Get the informations of all the records
+        with metrics.timer("stage_seconds", stage="records", wiki=""):
+            records = get_records(query, startdate, enddate, getattr(args, "sparql_workers", DEFAULT_SPARQL_WORKERS))
 
-    total = len(records)
-    for counter, record in enumerate(records, start=1):
+        # Prepare the records (fetch extra infos, clean some datas,...)
         for dbname in supported_wikis:
-            if supported_wikis[dbname].execute(record):
-                time.sleep(1)
-        if counter % 10 == 0:
-            print(f"[{counter}/{total}]")
+            with metrics.timer("stage_seconds", stage="prepare", wiki=dbname), profiling.profile(dbname):
+                records = supported_wikis[dbname].prepare(records)
+
+        record_ids = [record.id for record in records]
+        total = len(records)
+        windows = split_in_windows(records, PREFETCH_WINDOW)
+
+    if getattr(args, "concurrent", False):
+        execute_concurrently(windows, total, supported_wikis)
+    else:
+        execute_sequentially(windows, total, supported_wikis)
+    print_statistics(supported_wikis)
+
     # TODO: better handling of the KeyboardInterrupt
     # TODO: rapport on LinguaLibre:Bot/Reports avec exécution, dates début/fin,
     #  nombre d'enregistrements traités, combien ajoutés, combien déjà présents...
 
-    return [record.id for record in records]
+    return record_ids
+
+
+def backfill_mode(args, supported_wikis):
+    # All the languages are run in the same process, so that the logins, the language maps
+    # and the request rates of each wiki are shared by all of them
+    languages = read_languages(args.languages)
+    print(f"{len(languages)} languages to run on")
+
+    record_ids = []
+    records = iter_language_records(languages, args.workers, args.sparql_workers)
+    windows = prepare_windows(split_in_windows(records, PREFETCH_WINDOW), supported_wikis, record_ids)
+    if getattr(args, "concurrent", False):
+        execute_concurrently(windows, None, supported_wikis)
+    else:
+        execute_sequentially(windows, None, supported_wikis)
+    print_statistics(supported_wikis)
+
+    return record_ids
+
+
+def read_languages(path: str) -> List[str]:
+    with open(path, encoding="utf-8") as file:
+        return [line.strip() for line in file if line.strip() and not line.startswith("#")]
+
+
+def iter_language_records(languages: List[str], workers: int, sparql_workers: int) -> Iterator[Record]:
+    """
+    Fetch the records of each of the given languages, several languages at the same time,
+    and yield the records of each language as soon as they have all been fetched.
+    @param languages: the Lingua Libre QIDs of the languages
+    @param workers: the number of languages whose records are fetched at the same time
+    @param sparql_workers: the maximum number of parts of a split query sent at the same time
+    @return: an iterator over the records, language after language
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    remaining = iter(languages)
+    futures = {executor.submit(get_language_records, language, sparql_workers): language
+               for language in itertools.islice(remaining, workers)}
+    done_languages = 0
+    failed = []
+    try:
+        while futures:
+            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                language = futures.pop(future)
+                # The next language is fetched while the records of this one are being executed
+                for next_language in itertools.islice(remaining, 1):
+                    futures[executor.submit(get_language_records, next_language, sparql_workers)] = next_language
+
+                done_languages += 1
+                try:
+                    records = future.result()
+                except Exception as e:
+                    print(f"[{done_languages}/{len(languages)} languages] {language}: failed with {e!r}, skipped")
+                    failed.append(language)
+                    continue
+                print(f"[{done_languages}/{len(languages)} languages] {language}: {len(records)} records")
+                yield from records
+    finally:
+        # Do not wait for the queries still running when the bot is stopped
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+    if failed:
+        print("Languages skipped after an error: " + ",".join(failed))
+
+
+def get_language_records(language: str, sparql_workers: int) -> List[Record]:
+    query = BASEQUERY.replace("#filters", f"BIND( entity:{language} as ?language ).")
+    with metrics.timer("stage_seconds", stage="records", wiki=""):
+        return get_records(query, workers=sparql_workers)
+
+
+def print_statistics(supported_wikis) -> None:
+    for dbname in supported_wikis:
+        api = supported_wikis[dbname].api
+        if api.token_fetches_avoided > 0:
+            print(f"{dbname}: {api.token_fetches_avoided} CSRF token fetches avoided "
+                  f"({api.token_fetches} done)")
+        if supported_wikis[dbname].refused > 0:
+            print(f"{dbname}: {supported_wikis[dbname].refused} records not sent, "
+                  f"this wiki being unable to accept them")
+        if supported_wikis[dbname].skipped > 0:
+            print(f"{dbname}: {supported_wikis[dbname].skipped} records skipped, "
+                  f"their outcome being already known")
+        if supported_wikis[dbname].edit_conflicts > 0:
+            print(f"{dbname}: {supported_wikis[dbname].edit_conflicts} edits retried after an edit conflict")
+
+
+def prepare_windows(windows: Iterable[List[Record]], supported_wikis, record_ids: List[str]) -> Iterator[List[Record]]:
+    for window in windows:
+        for dbname in supported_wikis:
+            with metrics.timer("stage_seconds", stage="prepare", wiki=dbname), profiling.profile(dbname):
+                window = supported_wikis[dbname].prepare(window)
+        record_ids.extend(record.id for record in window)
+        yield window
+
+
+def refresh_mode(args, supported_wikis):
+    # Fetch again the data which are cached on the disk between two runs
+    languages = language_map.refresh()
+    print(f"Language map refreshed: {len(languages.codes)} language codes")
+    # The places are fetched again on demand by the next runs
+    location_map.clear()
+    # Such as the titles of the pages of the wiktionaries, which are otherwise all fetched
+    for dbname in supported_wikis:
+        supported_wikis[dbname].refresh()
+    return list(languages.codes)
+
+
+def execute_sequentially(windows: Iterable[List[Record]], total: Optional[int], supported_wikis) -> None:
+    counter = 0
+    for window in windows:
+        for dbname in supported_wikis:
+            with profiling.profile(dbname):
+                execute_window(supported_wikis[dbname], window)
+
+        counter += len(window)
+        print(f"[{counter}/{total or '?'}]")
+
+
+def execute_window(wiki, window: List[Record]) -> None:
+    # Leave out the records which cannot be added to the wiki, and those whose outcome is already known on it
+    with metrics.timer("stage_seconds", stage="pending", wiki=wiki.dbname):
+        records = wiki.pending(wiki.accepted(window))
+    with metrics.timer("stage_seconds", stage="prefetch", wiki=wiki.dbname):
+        wiki.prefetch(records)
+
+    # The records added on the same page are added at once
+    with metrics.timer("stage_seconds", stage="execute", wiki=wiki.dbname):
+        for group in wiki.group(records):
+            wiki.execute_group(group)
+
+
+def execute_concurrently(windows: Iterable[List[Record]], total: Optional[int], supported_wikis) -> None:
+    """
+    Execute the records on each wiki in its own thread, fed by its own queue,
+    so that a slow wiki does not hold the others back.
+    The records are still executed in order on each wiki.
+    """
+    errors = []
+    workers = []
+    for dbname in supported_wikis:
+        # Bounded, so that windows are not downloaded much faster than they are executed
+        windows_queue = queue.Queue(maxsize=2)
+        worker = threading.Thread(
+            target=wiki_worker,
+            args=(dbname, supported_wikis[dbname], windows_queue, total, errors),
+            name=dbname,
+            daemon=True,
+        )
+        worker.start()
+        workers.append((worker, windows_queue))
+
+    for window in windows:
+        for worker, windows_queue in workers:
+            put_while_alive(worker, windows_queue, window)
+    for worker, windows_queue in workers:
+        put_while_alive(worker, windows_queue, None)
+
+    for worker, _ in workers:
+        # Join with a timeout, so that a KeyboardInterrupt is not delayed
+        while worker.is_alive():
+            worker.join(1)
+
+    if errors:
+        raise errors[0]
+
+
+def put_while_alive(worker: threading.Thread, windows_queue: queue.Queue, window: Optional[List[Record]]) -> None:
+    # A worker stopped by an error no longer empties its queue
+    while worker.is_alive():
+        try:
+            windows_queue.put(window, timeout=1)
+            return
+        except queue.Full:
+            continue
+
+
+def wiki_worker(dbname: str, wiki, windows_queue: queue.Queue, total: Optional[int], errors: list) -> None:
+    counter = 0
+    try:
+        while True:
+            window = windows_queue.get()
+            if window is None:
+                return
+
+            execute_window(wiki, window)
+            counter += len(window)
+            print(f"[{dbname}: {counter}/{total or '?'}]")
+    except Exception as e:
+        print(f"{dbname}: stopped by {e!r}")
+        errors.append(e)
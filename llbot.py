@@ -8,7 +8,11 @@ import os
 import sys
 from typing import Iterable
 
+import cache
 import lili
+import metrics
+import outcomes
+import profiling
 from wikis.wikidata import Wikidata, Lexeme
 from wikis.wiktionaries.frwiktionary import FrWiktionary
 from wikis.wiktionaries.kuwiktionary import KuWiktionary
@@ -17,7 +21,8 @@ from wikis.wiktionaries.orwiktionary import OrWiktionary
 from wikis.wiktionaries.shywiktionary import ShyWiktionary
 
 config = configparser.ConfigParser()
-res = config.read(f"{os.path.dirname(os.path.realpath(__file__))}/config.ini")
+# Another configuration file may be given in the LLBOT_CONFIG environment variable
+res = config.read(os.environ.get("LLBOT_CONFIG", f"{os.path.dirname(os.path.realpath(__file__))}/config.ini"))
 if len(res) == 0:
     raise OSError("config.ini does not exist")
 
@@ -47,7 +52,45 @@ def main() -> None:
         for wiki_name, wiki_class in wiki_classes.items()
     }
 
-    items = args.func(args, wikis)
+    # Optional per wiki request rates, e.g. a [frwiktionary] section with read_rate and write_rate
+    for wiki_name, wiki in wikis.items():
+        if config.has_section(wiki_name):
+            wiki.api.limiter.configure(
+                config.getfloat(wiki_name, "read_rate", fallback=None),
+                config.getfloat(wiki_name, "write_rate", fallback=None),
+            )
+
+    # Log in at once, so that the batches are sized from the rights of each account
+    if args.mode != "refresh":
+        for wiki in wikis.values():
+            wiki.api.check_rights()
+
+    # Remember the outcome of each record on each wiki, to skip them on the next runs
+    if not args.ignore_outcomes:
+        # The records edited in live mode have changed: only the terminal outcomes still hold
+        retry_delay = 0 if args.mode == "live" else args.retry_after * 24 * 3600
+        store = outcomes.OutcomeStore(cache.get_path("outcomes.sqlite3"), retry_delay)
+        for wiki in wikis.values():
+            wiki.outcomes = store
+
+    if args.profile is not None:
+        if args.concurrent:
+            # cProfile follows a single profile at a time
+            print("--profile: the wikis are executed one after the other")
+            args.concurrent = False
+        profiling.start()
+
+    try:
+        with profiling.profile(profiling.RUN_PROFILE):
+            items = args.func(args, wikis)
+    finally:
+        if args.profile is not None:
+            profiling.write(args.profile)
+        # Also when the live mode is stopped
+        if args.metrics is not None:
+            metrics.write_json(args.metrics)
+        if args.prometheus is not None:
+            metrics.write_prometheus(args.prometheus)
     print(len(items))
 
 
@@ -65,6 +108,37 @@ def create_parser(supported_wikis: Iterable[str]) -> argparse.ArgumentParser:
         action='store_true',
         help="show the result without actually doing any edit"
     )
+    parser.add_argument(
+        "--concurrent",
+        action='store_true',
+        help="execute the records on each wiki in its own thread, instead of one wiki after the other"
+    )
+    parser.add_argument(
+        "--retry-after",
+        help="number of days after which a record which could not be added to a wiki is tried again (default: 30)",
+        type=float,
+        default=outcomes.DEFAULT_RETRY_DELAY / (24 * 3600),
+    )
+    parser.add_argument(
+        "--ignore-outcomes",
+        action='store_true',
+        help="execute all the records, even those whose outcome is known from a previous run"
+    )
+    parser.add_argument(
+        "--metrics",
+        help="write to this file a JSON summary of the time spent in each stage and of the requests sent",
+    )
+    parser.add_argument(
+        "--prometheus",
+        help="write the same metrics to this file in the text format of Prometheus, "
+             "at the end of the run and after each check of the recent changes in live mode",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIRECTORY",
+        help="profile the run and write to this directory a profile per wiki (e.g. frwiktionary.prof), "
+             "along with the pages of the wiktionaries on which the most time has been spent",
+    )
     subparsers = parser.add_subparsers(title="Execution modes", dest="mode")
     subparsers.required = True
     simpleparser = subparsers.add_parser(
@@ -75,6 +149,17 @@ def create_parser(supported_wikis: Iterable[str]) -> argparse.ArgumentParser:
     simpleparser.add_argument("--startdate", help="from which timestamp to start")
     simpleparser.add_argument("--enddate", help="at which timestamp to end")
     simpleparser.add_argument("--user", help="run only on records from the given user")
+    simpleparser.add_argument(
+        "--sparql-workers",
+        help="maximum number of parts of a query split by date sent at the same time (default: 3)",
+        type=int,
+        default=lili.DEFAULT_SPARQL_WORKERS,
+    )
+    simpleparser.add_argument(
+        "--stream",
+        action='store_true',
+        help="prepare and execute the records while they are being downloaded, with a constant memory usage",
+    )
     langgroup = simpleparser.add_mutually_exclusive_group()
     langgroup.add_argument(
         "--lang",
@@ -100,10 +185,36 @@ def create_parser(supported_wikis: Iterable[str]) -> argparse.ArgumentParser:
     )
     liveparser.add_argument(
         "--backcheck",
-        help="check at launch recent changes in the last BACKCHECK seconds (default: 0)",
+        help="check at launch recent changes in the last BACKCHECK seconds, instead of resuming "
+             "from where the previous run stopped (default: 0 if there is no previous run)",
         type=int,
-        default=0,
+        default=None,
+    )
+    backfillparser = subparsers.add_parser(
+        "backfill", help="Run llbot on all the records of each language of a list, in a single process"
+    )
+    backfillparser.set_defaults(func=lili.backfill_mode)
+    backfillparser.add_argument(
+        "--languages",
+        help="file listing the lingua libre qids of the languages, one per line (default: list_languages.txt)",
+        default=lili.LANGUAGES_FILE,
+    )
+    backfillparser.add_argument(
+        "--workers",
+        help="number of languages whose records are fetched at the same time (default: 4)",
+        type=int,
+        default=lili.DEFAULT_BACKFILL_WORKERS,
+    )
+    backfillparser.add_argument(
+        "--sparql-workers",
+        help="maximum number of parts of a query split by date sent at the same time (default: 3)",
+        type=int,
+        default=lili.DEFAULT_SPARQL_WORKERS,
+    )
+    refreshparser = subparsers.add_parser(
+        "refresh", help="Refresh the Wikidata data cached on the disk (language codes and labels)"
     )
+    refreshparser.set_defaults(func=lili.refresh_mode)
     return parser
 
 
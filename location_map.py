@@ -0,0 +1,159 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import cache
+import sparql
+from record import Record
+from sparql import SPARQL_ENDPOINT
+
+CACHE_NAME = "location_map.json"
+# Places are rarely renamed, but their labels get fixed from time to time
+CACHE_TTL = 30 * 24 * 3600
+
+# Keep the VALUES clause small enough for the query not to time out
+MAX_LOCATIONS_PER_QUERY = 200
+
+QID_REGEX = re.compile(r"^Q\d+$")
+
+LOCATION_QUERY = """
+SELECT ?location ?country ?label ?countryLabel
+WHERE {
+  VALUES ?location { $1 }
+  ?location wdt:P17 ?country.
+  OPTIONAL {
+    { ?location rdfs:label ?label. FILTER( LANG(?label) IN ($2) ) }
+    UNION
+    { ?country rdfs:label ?countryLabel. FILTER( LANG(?countryLabel) IN ($2) ) }
+  }
+}
+"""
+
+
+class LocationMap:
+    """
+    Map the Wikidata items of the places where the speakers live or learnt a language
+    to their country (P17), along with the labels of both in the languages needed by the wikis.
+    """
+
+    def __init__(self, countries: Dict[str, Optional[str]], labels: Dict[str, Dict[str, str]],
+                 languages: Iterable[str]) -> None:
+        self.countries = countries
+        self.labels = labels
+        self.languages = set(languages)
+
+    def country(self, location: str) -> Optional[str]:
+        """
+        @param location: the id of the place
+        @return: the id of the country of the place; None if it is unknown
+        """
+        return self.countries.get(location)
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        """
+        @return: an iterator over the places having a known country, along with this country
+        """
+        return ((location, country) for location, country in self.countries.items() if country is not None)
+
+    def label(self, qid: str, languages: Sequence[str]) -> str:
+        """
+        Get the label of the given item, with the same fallbacks as the SPARQL label service.
+        @param qid: the id of the item
+        @param languages: the languages in which the label is searched, by order of preference
+        @return: the first label found; the id of the item if there is none
+        """
+        labels = self.labels.get(qid, {})
+        for language in languages:
+            if language in labels:
+                return labels[language]
+        return qid
+
+
+_required_languages = set()
+_location_map: Optional[LocationMap] = None
+
+
+def require_labels(languages: Iterable[str]) -> None:
+    """
+    Declare languages in which the labels of the places are needed,
+    so that all of them are fetched at once.
+    @param languages: the codes of the languages
+    """
+    _required_languages.update(languages)
+
+
+def resolve(records: List[Record]) -> LocationMap:
+    """
+    Get the location map shared by all the wikis, completed with the places
+    of the given records which have never been looked for.
+    @param records: the records whose places must be in the map
+    @return: the location map
+    """
+    global _location_map
+
+    if _location_map is None or not _required_languages <= _location_map.languages:
+        data = cache.load(CACHE_NAME, CACHE_TTL)
+        if data is not None and _required_languages <= set(data["languages"]):
+            _location_map = LocationMap(data["countries"], data["labels"], data["languages"])
+        else:
+            _location_map = LocationMap({}, {}, _required_languages)
+
+    locations = set()
+    for record in records:
+        for location in (record.language["learning"], record.speaker_residence):
+            if location is not None and QID_REGEX.match(location) and location not in _location_map.countries:
+                locations.add(location)
+
+    if not locations:
+        return _location_map
+
+    locations = sorted(locations)
+    languages = ", ".join(f'"{language}"' for language in sorted(_location_map.languages)) or '""'
+    for i in range(0, len(locations), MAX_LOCATIONS_PER_QUERY):
+        _fetch_locations(locations[i:i + MAX_LOCATIONS_PER_QUERY], languages)
+
+    cache.save(CACHE_NAME, {
+        "languages": sorted(_location_map.languages),
+        "countries": _location_map.countries,
+        "labels": _location_map.labels,
+    })
+
+    return _location_map
+
+
+def _fetch_locations(locations: List[str], languages: str) -> None:
+    raw_location_map = sparql.request(
+        SPARQL_ENDPOINT,
+        LOCATION_QUERY.replace("$1", " ".join(f"wd:{location}" for location in locations)).replace("$2", languages)
+    )
+
+    # Do not remember the places of a failed query as places without country
+    if raw_location_map == "":
+        return
+
+    for location in locations:
+        _location_map.countries.setdefault(location, None)
+
+    for line in raw_location_map:
+        location = sparql.format_value(line, "location")
+        country = sparql.format_value(line, "country")
+        if _location_map.countries[location] is None:
+            _location_map.countries[location] = country
+        if "label" in line:
+            _location_map.labels.setdefault(location, {})[line["label"]["xml:lang"]] = line["label"]["value"]
+        if "countryLabel" in line:
+            _location_map.labels.setdefault(country, {})[line["countryLabel"]["xml:lang"]] = \
+                line["countryLabel"]["value"]
+
+
+def clear() -> None:
+    """
+    Forget all the places, so that they are all looked for again.
+    """
+    global _location_map
+
+    _location_map = None
+    cache.save(CACHE_NAME, {"languages": [], "countries": {}, "labels": {}})
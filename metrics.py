@@ -0,0 +1,204 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Prefix of the names of the metrics in the Prometheus export
+PREFIX = "llbot_"
+# Upper bounds of the buckets of the histograms, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    Distribution of durations, counted in buckets as Prometheus does.
+    """
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, share: float) -> float:
+        """
+        @param share: the share of the values below the quantile, e.g. 0.99
+        @return: the upper bound of the bucket holding the quantile; the largest value for the last one
+        """
+        rank = share * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+_counters: Dict[str, Dict[Labels, float]] = {}
+_histograms: Dict[str, Dict[Labels, Histogram]] = {}
+_lock = threading.Lock()
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def count(name: str, value: float = 1, **labels) -> None:
+    """
+    Add the given value to a counter.
+    @param name: the name of the counter, e.g. 'http_retries_total'
+    @param value: the value to add
+    @param labels: what the value is about, e.g. host='fr.wiktionary.org'
+    """
+    with _lock:
+        counters = _counters.setdefault(name, {})
+        key = _labels(labels)
+        counters[key] = counters.get(key, 0) + value
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    """
+    Add a duration to a histogram.
+    @param name: the name of the histogram, e.g. 'http_request_seconds'
+    @param seconds: the duration
+    @param labels: what the duration is about, e.g. host='fr.wiktionary.org'
+    """
+    with _lock:
+        histograms = _histograms.setdefault(name, {})
+        key = _labels(labels)
+        if key not in histograms:
+            histograms[key] = Histogram()
+        histograms[key].observe(seconds)
+
+
+@contextlib.contextmanager
+def timer(name: str, **labels) -> Iterator[None]:
+    """
+    Add the duration of the block to a histogram, even when it raises an exception.
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - start, **labels)
+
+
+def backoff_handler(name: str, describe: Optional[Callable[..., Dict[str, str]]] = None) -> Callable[[dict], None]:
+    """
+    @param name: what is retried, e.g. 'pywiki'
+    @param describe: a function called with the arguments of the retried call, which returns
+     the labels of the request, e.g. {'host': 'fr.wiktionary.org', 'action': 'query'}
+    @return: a handler for the on_backoff parameter of the backoff decorators,
+     which counts the retries and the time spent waiting for them
+    """
+    def handler(details: dict) -> None:
+        exception = type(details.get("exception")).__name__ if details.get("exception") else "value"
+        labels = describe(*details["args"], **details["kwargs"]) if describe is not None else {}
+        count("backoff_retries_total", client=name, reason=exception, **labels)
+        count("backoff_seconds_total", details["wait"], client=name, **labels)
+
+    return handler
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def summary() -> dict:
+    """
+    @return: the current value of all the metrics, serializable in JSON
+    """
+    with _lock:
+        return {
+            "counters": {
+                name: [{"labels": dict(labels), "value": value} for labels, value in sorted(counters.items())]
+                for name, counters in sorted(_counters.items())
+            },
+            "histograms": {
+                name: [
+                    {
+                        "labels": dict(labels),
+                        "count": histogram.count,
+                        "sum": round(histogram.sum, 6),
+                        "mean": round(histogram.sum / histogram.count, 6) if histogram.count else 0.0,
+                        "p50": round(histogram.quantile(0.5), 6),
+                        "p99": round(histogram.quantile(0.99), 6),
+                        "max": round(histogram.max, 6),
+                    }
+                    for labels, histogram in sorted(histograms.items())
+                ]
+                for name, histograms in sorted(_histograms.items())
+            },
+        }
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def prometheus() -> str:
+    """
+    @return: the current value of all the metrics, in the text format of Prometheus
+    """
+    lines: List[str] = []
+    with _lock:
+        for name, counters in sorted(_counters.items()):
+            lines.append(f"# TYPE {PREFIX}{name} counter")
+            for labels, value in sorted(counters.items()):
+                lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+
+        for name, histograms in sorted(_histograms.items()):
+            lines.append(f"# TYPE {PREFIX}{name} histogram")
+            for labels, histogram in sorted(histograms.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS + (float("inf"),), histogram.counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+def _write(path: str, content: str) -> None:
+    # Replaced at once, so that a reader never sees a partial file
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        file.write(content)
+    os.replace(f"{path}.tmp", path)
+
+
+def write_json(path: str) -> None:
+    """
+    Write the summary of the metrics to the given file.
+    """
+    _write(path, json.dumps(summary(), indent=2))
+
+
+def write_prometheus(path: str) -> None:
+    """
+    Write the metrics to the given file in the text format of Prometheus,
+    e.g. for the textfile collector of the node exporter.
+    """
+    _write(path, prometheus())
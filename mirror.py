@@ -0,0 +1,33 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+import os
+import urllib.parse
+
+# Base url of a stand-in of the Wikimedia and Lingua Libre servers (see scripts/fake_wikimedia.py),
+# to which all the requests are sent instead when it is set, e.g. http://127.0.0.1:8765
+MIRROR = os.environ.get("LLBOT_MIRROR")
+
+
+def url(address: str) -> str:
+    """
+    @param address: the url of an endpoint of the Wikimedia or Lingua Libre servers
+    @return: the same url, on the stand-in server if there is one (the original host being the first
+     part of the path, e.g. http://127.0.0.1:8765/fr.wiktionary.org/w/api.php); unchanged otherwise
+    """
+    if not MIRROR:
+        return address
+    parts = urllib.parse.urlsplit(address)
+    return f"{MIRROR.rstrip('/')}/{parts.netloc}{parts.path}"
+
+
+def host(address: str) -> str:
+    """
+    @param address: the url of an endpoint, as returned by url()
+    @return: the domain name of the server it stands for, so that each one keeps its own request rates
+    """
+    parts = urllib.parse.urlsplit(address)
+    if MIRROR and address.startswith(MIRROR.rstrip("/") + "/"):
+        return parts.path.split("/")[1]
+    return parts.netloc
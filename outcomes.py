@@ -0,0 +1,82 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+import sqlite3
+import threading
+import time
+
+# What happened to a record on a wiki
+ADDED = "added"
+ALREADY_PRESENT = "already present"
+NO_ENTRY = "no entry"
+NO_SECTION = "no language section"
+NO_ENTITY = "no entity"
+NO_FILE = "no file"
+UNSUPPORTED = "unsupported"
+
+# Records with these outcomes never need to be executed again on the same wiki
+TERMINAL_OUTCOMES = {ADDED, ALREADY_PRESENT}
+
+# The other outcomes may change when the wiki does: they are retried after 30 days by default
+DEFAULT_RETRY_DELAY = 30 * 24 * 3600
+
+
+class OutcomeStore:
+    """
+    Remember the outcome of each record on each wiki between two runs of the bot,
+    so that the records already handled can be skipped without any request.
+    """
+
+    def __init__(self, path: str, retry_delay: float = DEFAULT_RETRY_DELAY) -> None:
+        """
+        Constructor.
+        @param path: the path of the SQLite database
+        @param retry_delay: the number of seconds after which a non terminal outcome is outdated
+        """
+        self.retry_delay = retry_delay
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outcomes (
+                wiki TEXT NOT NULL,
+                record TEXT NOT NULL,
+                file TEXT NOT NULL,
+                outcome TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                PRIMARY KEY (wiki, record, file)
+            )
+            """
+        )
+        self.connection.commit()
+
+    def is_settled(self, wiki: str, record_id: str, filename: str) -> bool:
+        """
+        @return: True if the record does not need to be executed again on the wiki; False otherwise
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT outcome, timestamp FROM outcomes WHERE wiki = ? AND record = ? AND file = ?",
+                (wiki, record_id, filename),
+            ).fetchone()
+
+        if row is None:
+            return False
+
+        outcome, timestamp = row
+        return outcome in TERMINAL_OUTCOMES or time.time() - timestamp < self.retry_delay
+
+    def save(self, wiki: str, record_id: str, filename: str, outcome: str) -> None:
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO outcomes (wiki, record, file, outcome, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (wiki, record_id, filename, outcome, time.time()),
+            )
+            self.connection.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,134 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+import contextlib
+import cProfile
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Name of the profile of what is not done for a given wiki (SPARQL queries, recent changes, ...)
+RUN_PROFILE = "run"
+# Name of the file in which the slowest pages are listed
+PAGES_FILE_NAME = "slowest_pages.txt"
+# Number of pages listed
+PAGES_SHOWN = 30
+# Steps of the edition of a page, as timed by the wiktionaries
+PHASES = ("parse", "transform", "serialize")
+
+enabled = False
+_profiles: Dict[str, cProfile.Profile] = {}
+# Names of the profiles entered, the last one being the one enabled
+_stack: List[str] = []
+# Time spent on each page, by wiki and title: size of the page, number of records, and seconds per phase
+_pages: Dict[Tuple[str, str], dict] = {}
+_current = threading.local()
+
+
+def start() -> None:
+    """
+    Profile the rest of the run.
+    cProfile follows a single profile at a time, so the wikis must be executed one after the other.
+    """
+    global enabled
+    enabled = True
+
+
+@contextlib.contextmanager
+def profile(name: str) -> Iterator[None]:
+    """
+    Count the calls made in the block in the profile of the given name instead of the current one,
+    e.g. in the profile of a wiki while its records are being prepared or executed.
+    """
+    if not enabled:
+        yield
+        return
+
+    if _stack:
+        _profiles[_stack[-1]].disable()
+    _stack.append(name)
+    _profiles.setdefault(name, cProfile.Profile()).enable()
+    try:
+        yield
+    finally:
+        _profiles[_stack.pop()].disable()
+        if _stack:
+            _profiles[_stack[-1]].enable()
+
+
+@contextlib.contextmanager
+def page(wiki: str, title: str, text: str) -> Iterator[None]:
+    """
+    Time the edition of a page; the time which is not spent in a phase() block is counted as transform time.
+    @param wiki: the database name of the wiki
+    @param title: the title of the page
+    @param text: the content of the page before the edition
+    """
+    if not enabled:
+        yield
+        return
+
+    timings = _pages.setdefault((wiki, title), {"size": 0, "records": 0, **{phase: 0.0 for phase in PHASES}})
+    timings["size"] = max(timings["size"], len(text))
+    timings["records"] += 1
+    _current.timings = timings
+    timed = timings["parse"] + timings["serialize"]
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current.timings = None
+        elapsed = time.perf_counter() - start_time
+        timings["transform"] += elapsed - (timings["parse"] + timings["serialize"] - timed)
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    """
+    Count the time spent in the block as the given phase of the edition of the current page.
+    @param name: 'parse' or 'serialize'
+    """
+    timings: Optional[dict] = getattr(_current, "timings", None)
+    if timings is None:
+        yield
+        return
+
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] += time.perf_counter() - start_time
+
+
+def slowest_pages(count: int = PAGES_SHOWN) -> str:
+    """
+    @param count: the number of pages listed
+    @return: a table of the pages on which the most time has been spent, with the time spent in each phase
+    """
+    ranked = sorted(_pages.items(), key=lambda item: sum(item[1][phase] for phase in PHASES), reverse=True)
+    lines = [f"{'wiki':<16}{'size':>9}{'records':>9}{'parse ms':>11}{'transform ms':>14}{'serialize ms':>14}"
+             f"{'total ms':>11}  title"]
+    for (wiki, title), timings in ranked[:count]:
+        milliseconds = [timings[phase] * 1000 for phase in PHASES]
+        lines.append(f"{wiki:<16}{timings['size']:>9}{timings['records']:>9}{milliseconds[0]:>11.1f}"
+                     f"{milliseconds[1]:>14.1f}{milliseconds[2]:>14.1f}{sum(milliseconds):>11.1f}  {title}")
+    return "\n".join(lines) + "\n"
+
+
+def write(directory: str) -> None:
+    """
+    Write each profile to its own file, to be read with pstats or snakeviz (e.g. frwiktionary.prof),
+    and the table of the slowest pages.
+    @param directory: where the files are written
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name, profiler in _profiles.items():
+        profiler.dump_stats(os.path.join(directory, f"{name}.prof"))
+
+    table = slowest_pages()
+    with open(os.path.join(directory, PAGES_FILE_NAME), "w", encoding="utf-8") as file:
+        file.write(table)
+    print(f"Profiles written to {directory}, slowest pages:")
+    print(table, end="")
@@ -8,11 +8,38 @@ import time
 import backoff
 import requests
 
+import metrics
+import mirror
+import ratelimit
 from version import __version__
 
+# Ask the servers to refuse our requests when their replication lag exceeds 5 seconds
+MAXLAG = 5
+MAXLAG_RETRIES = 10
+READ_ACTIONS = {"query", "wbgetentities", "wbgetclaims", "parse"}
+
+
 class NoSuchEntityException(Exception):
     ...
 
+
+class EditConflictException(Exception):
+    ...
+
+
+def get_retry_after(response: requests.Response, default: float = 1) -> float:
+    """
+    @param response: a response of the API
+    @param default: the delay to use if the response does not give any
+    @return: the number of seconds the server asked to wait for before the next request
+    """
+    try:
+        return float(response.headers.get("Retry-After", default))
+    except ValueError:
+        # The header may also be an HTTP date, which is not worth parsing
+        return default
+
+
 class Pywiki:
     def __init__(self, username: str, password: str, api_endpoint, user_type: str, dry_run: bool):
         self.username = username
@@ -21,7 +48,13 @@ class Pywiki:
         self.dry_run = dry_run
         self.api_endpoint = api_endpoint
         self.user_type = user_type
-        self.limit = 5000 if user_type == "bot" else 500
+        # Whether the account has the apihighlimits right; None until checked after the login
+        self.high_limits = None
+        self.csrf_token = None
+        self.token_fetches = 0
+        self.token_fetches_avoided = 0
+        self.host = mirror.host(api_endpoint)
+        self.limiter = ratelimit.get(self.host)
         self.session = requests.Session()
         self.session.headers.update(
             {
@@ -30,12 +63,36 @@ class Pywiki:
             }
         )
 
+    @property
+    def limit(self) -> int:
+        """
+        Maximum number of results of a list query; the lower one until check_rights() has been called.
+        """
+        return 5000 if self.high_limits else 500
+
+    def check_rights(self) -> None:
+        """
+        Log in, unless it has already been done, so that the rights of the account
+        and thereby the limits of its requests are known.
+        """
+        if self.high_limits is None:
+            self.login()
+
+    @property
+    def batch_size(self) -> int:
+        """
+        Maximum number of titles or ids accepted in a single request.
+        """
+        return self.limit // 10
+
     @backoff.on_exception(backoff.expo,
                           (requests.exceptions.Timeout,
                            requests.exceptions.ConnectionError,
                            requests.exceptions.ChunkedEncodingError,
                            json.decoder.JSONDecodeError),
-                          max_tries=8)
+                          max_tries=8,
+                          on_backoff=metrics.backoff_handler(
+                              "pywiki", lambda api, data, files=None: {"host": api.host, "action": data["action"]}))
     def request(self, data, files=None):
         """
         Perform a given request with a simple but usefull error management
@@ -47,24 +104,60 @@ class Pywiki:
             print(data)
             return {"dryrun": True}
 
+        action = data["action"]
+        bucket = self.limiter.bucket(action not in READ_ACTIONS)
+        data.setdefault("maxlag", MAXLAG)
+
         relogin = 3
+        badtoken = 1
+        slowdowns = MAXLAG_RETRIES
         while relogin:
             try:
-                if files is None:
-                    r = self.session.post(self.api_endpoint, data=data)
-                else:
-                    r = self.session.post(self.api_endpoint, data=data, files=files)
+                wait = bucket.reserve()
+                if wait > 0:
+                    metrics.count("http_wait_seconds_total", wait, host=self.host, reason="ratelimit")
+                    time.sleep(wait)
+                with metrics.timer("http_request_seconds", host=self.host, action=action):
+                    if files is None:
+                        r = self.session.post(self.api_endpoint, data=data)
+                    else:
+                        r = self.session.post(self.api_endpoint, data=data, files=files)
+                if r.status_code in (429, 503) and "Retry-After" in r.headers and slowdowns:
+                    # The server is overloaded: wait for as long as it asks, then go on more slowly
+                    metrics.count("http_retries_total", host=self.host, action=action, reason=str(r.status_code))
+                    bucket.slow_down(get_retry_after(r))
+                    slowdowns -= 1
+                    continue
                 response = json.loads(r.text)
                 if "error" in response:
+                    if response["error"]["code"] == "maxlag" and slowdowns:
+                        metrics.count("http_retries_total", host=self.host, action=action, reason="maxlag")
+                        bucket.slow_down(get_retry_after(r, response["error"].get("lag", MAXLAG)))
+                        slowdowns -= 1
+                        continue
                     if response["error"]["code"] == "assertuserfailed":
+                        metrics.count("http_retries_total", host=self.host, action=action, reason="assertuserfailed")
                         self.login()
                         relogin -= 1
                         continue
+                    if response["error"]["code"] == "badtoken" and "token" in data and badtoken:
+                        # The cached token has expired, fetch a fresh one and try again
+                        metrics.count("http_retries_total", host=self.host, action=action, reason="badtoken")
+                        self.csrf_token = None
+                        data["token"] = self.get_csrf_token()
+                        badtoken -= 1
+                        continue
                     if response["error"]["code"] == "no-such-entity":
                         raise NoSuchEntityException()
+                    if response["error"]["code"] == "editconflict":
+                        raise EditConflictException()
+                    metrics.count("http_errors_total", host=self.host, action=action, code=response["error"]["code"])
                     break
+                bucket.speed_up()
                 return response
             except requests.exceptions.ConnectionError:
+                metrics.count("http_retries_total", host=self.host, action=action, reason="connection")
+                metrics.count("http_wait_seconds_total", 5, host=self.host, reason="connection")
                 time.sleep(5)
                 self.session = requests.Session()
                 self.login()
@@ -77,6 +170,8 @@ class Pywiki:
         Login into the wiki
         :returns:
         """
+        # Tokens are bound to the session, a new login invalidates them
+        self.csrf_token = None
         r = self.session.post(
             self.api_endpoint,
             data={
@@ -97,12 +192,34 @@ class Pywiki:
                 "format": "json",
             },
         )
-        return -1 if json.loads(r.text)["login"]["result"] != "Success" else 0
+        result = -1 if json.loads(r.text)["login"]["result"] != "Success" else 0
+        self.__fetch_rights()
+        return result
+
+    def __fetch_rights(self) -> None:
+        """
+        Check whether the account may use the higher limits of the API (bots, admins)
+        """
+        r = self.request(
+            {
+                "action": "query",
+                "meta": "userinfo",
+                "uiprop": "rights",
+                "format": "json",
+            }
+        )
+        self.high_limits = "apihighlimits" in r["query"]["userinfo"].get("rights", [])
 
     def get_csrf_token(self):
         """
-          Get a crsf token from frwiki to be able to edit a page
+          Get a crsf token from frwiki to be able to edit a page.
+          The token is cached for the whole session and only fetched again
+          after a new login or when the API answers with a badtoken error.
         """
+        if self.csrf_token is not None:
+            self.token_fetches_avoided += 1
+            return self.csrf_token
+
         r = self.request(
             {
                 "action": "query",
@@ -112,4 +229,6 @@ class Pywiki:
                 "format": "json",
             }
         )
-        return r["query"]["tokens"]["csrftoken"]
+        self.token_fetches += 1
+        self.csrf_token = r["query"]["tokens"]["csrftoken"]
+        return self.csrf_token
@@ -0,0 +1,110 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+import threading
+import time
+from typing import Dict, Optional
+
+# Default number of requests per second sent to a host
+DEFAULT_READ_RATE = 10.0
+DEFAULT_WRITE_RATE = 1.0
+
+# The rate never goes below one request every MIN_RATE seconds, however lagged the servers are
+MIN_RATE = 1 / 60
+# Share of the configured rate recovered after each successful request
+RECOVERY_STEP = 0.05
+
+
+class TokenBucket:
+    """
+    Let through at most `rate` requests per second, with bursts of at most `capacity` requests.
+    The rate is lowered when the servers ask to slow down, and raised back to its
+    configured value as the requests succeed again.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.lock = threading.Lock()
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def configure(self, rate: float) -> None:
+        with self.lock:
+            self.max_rate = rate
+            self.rate = rate
+            self.capacity = max(1.0, rate)
+
+    def reserve(self) -> float:
+        """
+        Take a token from the bucket.
+        @return: the number of seconds to wait before sending the request
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def acquire(self) -> None:
+        """
+        Wait until a request can be sent.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def slow_down(self, pause: float = 0.0) -> None:
+        """
+        Halve the rate, and stop letting requests through for the given duration.
+        @param pause: the number of seconds to wait before the next request
+        """
+        with self.lock:
+            self.rate = max(MIN_RATE, self.rate / 2)
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
+    def speed_up(self) -> None:
+        """
+        Raise the rate back towards its configured value.
+        """
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY_STEP)
+
+
+class HostLimiter:
+    """
+    Separate budgets for the reads and the writes sent to a host.
+    """
+
+    def __init__(self, read_rate: float = DEFAULT_READ_RATE, write_rate: float = DEFAULT_WRITE_RATE) -> None:
+        self.read = TokenBucket(read_rate)
+        self.write = TokenBucket(write_rate)
+
+    def configure(self, read_rate: Optional[float] = None, write_rate: Optional[float] = None) -> None:
+        if read_rate is not None:
+            self.read.configure(read_rate)
+        if write_rate is not None:
+            self.write.configure(write_rate)
+
+    def bucket(self, write: bool) -> TokenBucket:
+        return self.write if write else self.read
+
+
+_limiters: Dict[str, HostLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get(host: str) -> HostLimiter:
+    """
+    @param host: the domain name of a server
+    @return: the limiter shared by all the clients of this host
+    """
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = HostLimiter()
+        return _limiters[host]
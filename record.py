@@ -1,12 +1,76 @@
+import sys
+from collections.abc import Mapping
 from dataclasses import dataclass
-from typing import Dict
+from typing import Dict, Iterator, Optional
 
+# Names of the fields of a record behind each key of record.links and record.language
+LINK_FIELDS = {
+    "wikidata": "wikidata_id",
+    "lexeme": "lexeme_id",
+    "wikipedia": "wikipedia_title",
+    "wiktionary": "wiktionary_entry",
+}
+LANGUAGE_FIELDS = {
+    "qid": "language_qid",
+    "learning": "learning_place",
+    "level": "language_level",
+}
 
+
+def intern(value: Optional[str]) -> Optional[str]:
+    """
+    @param value: a value shared by many records, e.g. the QID of a language
+    @return: the same value, stored once for all the records
+    """
+    return sys.intern(value) if value is not None else None
+
+
+class Fields(Mapping):
+    """
+    Some fields of a record, read and written as a dictionary, e.g. record.links["wikidata"].
+    """
+    __slots__ = ("record", "names")
+
+    def __init__(self, record: "Record", names: Dict[str, str]) -> None:
+        self.record = record
+        self.names = names
+
+    def __getitem__(self, key: str) -> Optional[str]:
+        return getattr(self.record, self.names[key])
+
+    def __setitem__(self, key: str, value: Optional[str]) -> None:
+        setattr(self.record, self.names[key], value)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+# Slotted, without any dictionary of its own: a million records are kept in memory by a full run
 @dataclass
 class Record:
+    __slots__ = ("id", "file", "transcription", "speaker_residence", *LINK_FIELDS.values(), *LANGUAGE_FIELDS.values())
     id: str
     file: str
     transcription: str
-    speaker_residence: str
-    links: Dict[str, str]
-    language: Dict[str, str]
+    speaker_residence: Optional[str]
+    wikidata_id: Optional[str]
+    lexeme_id: Optional[str]
+    wikipedia_title: Optional[str]
+    wiktionary_entry: Optional[str]
+    language_qid: Optional[str]
+    learning_place: Optional[str]
+    language_level: Optional[str]
+
+    @property
+    def links(self) -> Fields:
+        return Fields(self, LINK_FIELDS)
+
+    @property
+    def language(self) -> Fields:
+        return Fields(self, LANGUAGE_FIELDS)
@@ -0,0 +1,734 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+"""
+Stand-in for the servers the bot talks to, to measure its throughput without sending
+a single request to Wikimedia or Lingua Libre.
+
+It answers the part of api.php used by the bot on Lingua Libre, Wikidata, Wikimedia Commons and
+the supported wiktionaries, the SPARQL endpoints of Lingua Libre and Wikidata, and the lists of
+titles of the dumps. Everything is generated from a synthetic corpus of records, the same for
+a given seed, and the edits are kept in memory.
+
+Each server is reached under its own domain name as the first part of the path,
+e.g. http://127.0.0.1:8765/fr.wiktionary.org/w/api.php, which is what the bot does
+when the LLBOT_MIRROR environment variable is set to http://127.0.0.1:8765.
+
+GET /_stats returns the number and the latency of the requests received by each server
+since the start, or since the last POST /_reset.
+"""
+
+import argparse
+import datetime
+import email.utils
+import gzip
+import hashlib
+import http.server
+import json
+import random
+import re
+import threading
+import time
+import traceback
+import urllib.parse
+from typing import Dict, List, Optional, Tuple
+
+LINGUALIBRE = "lingualibre.org"
+WIKIDATA = "www.wikidata.org"
+WDQS = "query.wikidata.org"
+COMMONS = "commons.wikimedia.org"
+DUMPS = "dumps.wikimedia.org"
+
+LINGUALIBRE_ENTITY = "https://lingualibre.org/entity/"
+WIKIDATA_ENTITY = "http://www.wikidata.org/entity/"
+COMMONS_FILEPATH = "http://commons.wikimedia.org/wiki/Special:FilePath/"
+
+# Languages of the records: Lingua Libre item, Wikidata item, BCP 47 code, ISO 639-3 code, share of the records
+LANGUAGES = [
+    ("Q21", "Q150", "fr", "fra", 40),
+    ("Q22", "Q1860", "en", "eng", 15),
+    ("Q24", "Q188", "de", "deu", 10),
+    ("Q25", "Q36368", "ku", "kur", 10),
+    ("Q26", "Q14185", "oc", "oci", 10),
+    ("Q27", "Q33810", "or", "ori", 10),
+    ("Q28", "Q33274", "shy", "shy", 5),
+]
+# Places where the speakers live or learnt their language: item, country, label
+PLACES = [
+    ("Q90", "Q142", "Paris"),
+    ("Q456", "Q142", "Lyon"),
+    ("Q84", "Q145", "London"),
+    ("Q64", "Q183", "Berlin"),
+    ("Q3616", "Q794", "Tehran"),
+    ("Q7686", "Q668", "Bhubaneswar"),
+    ("Q3551", "Q262", "Batna"),
+    ("Q142", "Q142", "France"),
+]
+COUNTRIES = {"Q142": "France", "Q145": "United Kingdom", "Q183": "Germany", "Q794": "Iran", "Q668": "India",
+             "Q262": "Algeria"}
+LEVELS = ["Q12", "Q13", "Q14", "Q15"]
+SYLLABLES = ["ba", "ko", "ri", "tu", "mel", "sa", "no", "vi", "del", "ra", "ku", "zen", "lo", "fi", "ta", "mor"]
+
+# Language of each supported wiktionary, and how it writes the heading of a language section
+WIKTIONARIES = {
+    "fr.wiktionary.org": ("frwiktionary", "fr", lambda language: f"== {{{{langue|{language[2]}}}}} =="),
+    "ku.wiktionary.org": ("kuwiktionary", "ku", lambda language: f"== {{{{ziman|{language[2]}}}}} =="),
+    "shy.wiktionary.org": ("shywiktionary", "shy", lambda language: f"== {{{{langue|{language[2]}}}}} =="),
+    "or.wiktionary.org": ("orwiktionary", "or", lambda language: f"== {label(language[1], 'or')} =="),
+    "oc.wiktionary.org": ("ocwiktionary", "oc", lambda language: f"{{{{={language[2]}=}}}}"),
+}
+HEADING_REGEX = re.compile(r"^(={1,6})[^\n]+?\1[ \t]*$", re.MULTILINE)
+TRAILING_WHITESPACE = " \t\n\r\0\x0b"
+MAX_RESULTS = 500
+
+
+def label(qid: str, language: str) -> str:
+    return f"{qid}-{language}"
+
+
+def chance(*keys) -> float:
+    """
+    @return: a number between 0 and 1, always the same for the same keys
+    """
+    digest = hashlib.blake2b("|".join(str(key) for key in keys).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") / 2 ** 64
+
+
+def format_timestamp(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def parse_timestamp(timestamp: str) -> float:
+    parsed = datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+def normalize_title(title: str) -> str:
+    return title.replace("_", " ").strip()
+
+
+class Corpus:
+    """
+    The records of Lingua Libre, and what the wikis already hold about them.
+    """
+
+    def __init__(self, size: int, live_rate: float, seed: int, coverage: float) -> None:
+        """
+        @param size: the number of records made before the start of the server
+        @param live_rate: the number of records made per second after the start of the server
+        @param seed: the seed of the corpus
+        @param coverage: the share of the words having an entry on each wiktionary
+        """
+        self.seed = seed
+        self.coverage = coverage
+        self.started = time.time()
+        self.live_rate = live_rate
+        rng = random.Random(seed)
+
+        # A few records per word, so that some entries receive several of them
+        self.words = []
+        weights = [language[4] for language in LANGUAGES]
+        for i in range(max(1, size // 3)):
+            word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+            if rng.random() < 0.02:
+                word = f"l'{word}"
+            self.words.append((f"{word}{i}", rng.choices(LANGUAGES, weights)[0]))
+        self.word_indexes = {word: i for i, (word, _) in enumerate(self.words)}
+
+        self.records = [self.__make_record(i, rng, self.started - (size - i) * 60) for i in range(size)]
+        self.live_records = []
+        self.by_id = {record["id"]: record for record in self.records}
+        self.files_by_word: Dict[str, List[str]] = {}
+        for record in self.records:
+            self.files_by_word.setdefault(record["word"], []).append(record["file"])
+        self.lock = threading.Lock()
+
+    def __make_record(self, i: int, rng: random.Random, date: float) -> dict:
+        word_index = rng.randrange(len(self.words))
+        word, language = self.words[word_index]
+        speaker = rng.randrange(50)
+        place = rng.choice(PLACES)
+        return {
+            "id": f"Q{100000 + i}",
+            "date": date,
+            "word": word,
+            "word_index": word_index,
+            "language": language,
+            "speaker": f"Speaker{speaker}",
+            "file": f"LL-{language[0]} ({language[3]})-Speaker{speaker}-{word}.wav",
+            "residence": place[0],
+            "learning": place[0] if rng.random() < 0.1 else None,
+            "level": rng.choice(LEVELS),
+            "wikidata": f"Q{200000 + word_index}" if rng.random() < 0.6 else None,
+            "lexeme": f"L{word_index + 1}-F1" if rng.random() < 0.3 else None,
+        }
+
+    def published(self) -> List[dict]:
+        """
+        @return: the records made since the start of the server, as many as the live rate allows
+        """
+        with self.lock:
+            expected = int((time.time() - self.started) * self.live_rate)
+            rng = random.Random(f"{self.seed}-live-{len(self.live_records)}")
+            while len(self.live_records) < expected:
+                i = len(self.records) + len(self.live_records)
+                record = self.__make_record(i, rng, self.started + len(self.live_records) / self.live_rate)
+                self.live_records.append(record)
+                self.by_id[record["id"]] = record
+                self.files_by_word.setdefault(record["word"], []).append(record["file"])
+            return self.live_records
+
+    def all_records(self) -> List[dict]:
+        return self.records + self.published()
+
+    def has_entry(self, host: str, title: str) -> bool:
+        # Some wiktionaries use typographic apostrophes in their titles, others do not
+        return chance(self.seed, host, title.replace("’", "'")) < self.coverage
+
+    def titles(self, host: str) -> List[str]:
+        """
+        @return: the titles of the entries of the given wiktionary, in both spellings when they have an apostrophe
+        """
+        titles = []
+        for word, _ in self.words:
+            if self.has_entry(host, word):
+                titles.append(word)
+                if "'" in word:
+                    titles.append(word.replace("'", "’"))
+        return titles
+
+    def entry(self, host: str, word: str) -> Optional[str]:
+        """
+        @return: the wikitext of the entry of the given word on the given wiktionary, as before any edit
+        """
+        if not self.has_entry(host, word):
+            return None
+
+        word_index = self.word_indexes.get(word.replace("’", "'"))
+        languages = []
+        if word_index is not None and chance(self.seed, host, word, "section") < 0.8:
+            languages.append(self.words[word_index][1])
+        other = LANGUAGES[int(chance(self.seed, host, word, "other") * len(LANGUAGES))]
+        if other not in languages:
+            languages.append(other)
+
+        heading = WIKTIONARIES[host][2]
+        sections = []
+        for language in languages:
+            lines = [heading(language), f"'''{word}'''", "# ...", ""]
+            # Some records are already there
+            files = self.files_by_word.get(word.replace("’", "'"), [])
+            if files and chance(self.seed, host, word, language[2], "audio") < 0.1:
+                lines[2:2] = [f"* [[File:{files[0]}]]"]
+            sections.append("\n".join(lines))
+        return "\n".join(sections) + "\n[[Category:...]]"
+
+    def entity(self, entity_id: str) -> Optional[dict]:
+        """
+        @return: the claims of the given item or lexeme form, as before any edit; None if it does not exist
+        """
+        if chance(self.seed, entity_id, "missing") < 0.05:
+            return None
+        files = set()
+        match = re.match(r"^(?:Q(\d+)|L(\d+)-F\d+)$", entity_id)
+        if match and chance(self.seed, entity_id, "audio") < 0.1:
+            word_index = int(match[1]) - 200000 if match[1] else int(match[2]) - 1
+            if 0 <= word_index < len(self.words):
+                files.update(self.files_by_word.get(self.words[word_index][0], [])[:1])
+        return {"P443": files}
+
+
+class State:
+    """
+    The pages and entities edited since the start of the server, and the statistics of the requests.
+    """
+
+    def __init__(self, corpus: Corpus, args) -> None:
+        self.corpus = corpus
+        self.args = args
+        self.lock = threading.Lock()
+        # Current text and timestamp of each page fetched or edited, by wiki; None if it does not exist
+        self.pages: Dict[str, Dict[str, Optional[Tuple[str, float]]]] = {host: {} for host in WIKTIONARIES}
+        self.entities: Dict[str, Optional[dict]] = {}
+        self.stats: Dict[str, dict] = {}
+
+    def page(self, host: str, title: str) -> Optional[Tuple[str, float]]:
+        pages = self.pages[host]
+        if title not in pages:
+            text = self.corpus.entry(host, title)
+            pages[title] = (text, self.corpus.started - 86400) if text is not None else None
+        return pages[title]
+
+    def entity(self, entity_id: str) -> Optional[dict]:
+        if entity_id not in self.entities:
+            self.entities[entity_id] = self.corpus.entity(entity_id)
+        return self.entities[entity_id]
+
+    def record(self, host: str, action: str, duration: float, error: Optional[str]) -> None:
+        with self.lock:
+            stats = self.stats.setdefault(host, {"requests": 0, "actions": {}, "errors": {}, "latencies": []})
+            stats["requests"] += 1
+            stats["actions"][action] = stats["actions"].get(action, 0) + 1
+            if error is not None:
+                stats["errors"][error] = stats["errors"].get(error, 0) + 1
+            stats["latencies"].append(round(duration * 1000, 1))
+
+    def reset(self) -> None:
+        with self.lock:
+            self.stats = {}
+
+
+class ApiError(Exception):
+    def __init__(self, code: str, info: str = "", status: int = 200, headers: Optional[dict] = None) -> None:
+        super().__init__(code)
+        self.code = code
+        self.info = info
+        self.status = status
+        self.headers = headers or {}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: State = None
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        self.__handle()
+
+    def do_POST(self) -> None:
+        self.__handle()
+
+    def __handle(self) -> None:
+        start = time.monotonic()
+        parts = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(parts.query))
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            params.update(urllib.parse.parse_qsl(self.rfile.read(length).decode("utf-8")))
+
+        if parts.path == "/_stats":
+            with self.state.lock:
+                return self.__send(200, json.dumps(self.state.stats))
+        if parts.path == "/_reset":
+            self.state.reset()
+            return self.__send(200, "{}")
+
+        host, _, path = parts.path.lstrip("/").partition("/")
+        args = self.state.args
+        action = params.get("action", path.rsplit("/", 1)[-1])
+        error = None
+        try:
+            if path.endswith("sparql"):
+                action = "sparql"
+                self.__wait(args.sparql_latency)
+                if random.random() < args.sparql_error_rate:
+                    raise ApiError("timeout", "java.util.concurrent.TimeoutException", 500)
+                body = json.dumps({"results": {"bindings": self.__sparql(host, params["query"])}})
+                return self.__send(200, body)
+
+            if host == DUMPS:
+                action = "dump"
+                return self.__send_dump(path)
+
+            self.__wait(args.latency)
+            if action != "login" and random.random() < args.error_rate:
+                # Only the requests asking for it are refused because of the replication lag
+                if "maxlag" in params and random.random() < 0.5:
+                    raise ApiError("maxlag", "Waiting for a database server", headers={"Retry-After": "1"})
+                raise ApiError("overloaded", "Service Unavailable", 503, {"Retry-After": "1"})
+            return self.__send(200, json.dumps(self.__api(host, params)))
+        except ApiError as e:
+            error = e.code
+            if e.status != 200:
+                return self.__send(e.status, e.info, e.headers)
+            return self.__send(200, json.dumps({"error": {"code": e.code, "info": e.info}}), e.headers)
+        except Exception as e:
+            # A request the stand-in does not understand: the bot sees an internal error
+            error = "internal"
+            traceback.print_exc()
+            return self.__send(500, repr(e))
+        finally:
+            self.state.record(host, action, time.monotonic() - start, error)
+
+    @staticmethod
+    def __wait(latency: float) -> None:
+        # Most requests take about the given number of milliseconds, a few of them much longer
+        if latency > 0:
+            time.sleep(latency / 1000 * random.lognormvariate(0, 0.5))
+
+    def __send(self, status: int, body, headers: Optional[dict] = None) -> None:
+        data = body if isinstance(body, bytes) else body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def __send_dump(self, path: str) -> None:
+        dbname = path.split("/")[0]
+        host = next((host for host, wiki in WIKTIONARIES.items() if wiki[0] == dbname), None)
+        if host is None:
+            return self.__send(404, "")
+
+        titles = self.state.corpus.titles(host)
+        data = gzip.compress(("page_title\n" + "".join(f"{title.replace(' ', '_')}\n" for title in titles))
+                             .encode("utf-8"))
+        self.__send(200, data, {"Last-Modified": email.utils.formatdate(self.state.corpus.started - 86400,
+                                                                          usegmt=True)})
+
+    def __api(self, host: str, params: dict) -> dict:
+        action = params.get("action")
+        if action == "login":
+            if "lgtoken" not in params:
+                return {"login": {"result": "NeedToken", "token": "logintoken+\\"}}
+            return {"login": {"result": "Success", "lgusername": params.get("lgname")}}
+
+        if action == "query":
+            return self.__query(host, params)
+
+        with self.state.lock:
+            if action == "edit" and host in WIKTIONARIES:
+                return self.__edit(host, params)
+            if action == "parse" and host in WIKTIONARIES:
+                return self.__sections(host, params)
+            if host == WIKIDATA:
+                if action == "wbgetentities":
+                    return self.__get_entities(params)
+                if action == "wbgetclaims":
+                    return self.__get_claims(params["entity"])
+                if action == "wbsetclaim":
+                    try:
+                        claim = json.loads(params["claim"])
+                    except ValueError:
+                        raise ApiError("invalid-claim", "Failed to get claim from claim Serialization.")
+                    return self.__set_claim(claim)
+        raise ApiError("badvalue", f"Unrecognized value for parameter \"action\": {action}.")
+
+    def __query(self, host: str, params: dict) -> dict:
+        if params.get("meta") == "userinfo":
+            rights = ["edit", "bot"] + ([] if self.state.args.no_high_limits else ["apihighlimits"])
+            return {"query": {"userinfo": {"id": 1, "name": "Bot", "rights": rights}}}
+        if params.get("meta") == "tokens":
+            return {"query": {"tokens": {"csrftoken": "csrftoken+\\"}}}
+        if params.get("meta") == "siteinfo":
+            return {"query": {"statistics": {"pages": len(self.state.corpus.words) * 2}}}
+
+        if host == LINGUALIBRE and params.get("list") == "recentchanges":
+            return self.__lingualibre_changes(params)
+        if params.get("list") == "recentchanges":
+            # The bot never creates pages
+            return {"query": {"recentchanges": []}}
+        if params.get("list") == "allpages":
+            return self.__all_pages(host, params)
+        if params.get("list") == "logevents":
+            return {"query": {"logevents": []}}
+
+        titles = [title for title in params.get("titles", "").split("|") if title]
+        with self.state.lock:
+            if host == COMMONS:
+                return self.__files(titles)
+            if host in WIKTIONARIES:
+                return self.__pages(host, titles, params)
+        raise ApiError("badvalue", "Unsupported query.")
+
+    def __lingualibre_changes(self, params: dict) -> dict:
+        start = parse_timestamp(params["rcstart"])
+        after = None
+        if "rccontinue" in params:
+            timestamp, rcid = params["rccontinue"].split("|")
+            start, after = parse_timestamp(timestamp), int(rcid)
+
+        changes = []
+        for record in self.state.corpus.published():
+            rcid = int(record["id"][1:])
+            if record["date"] < start or (after is not None and rcid < after):
+                continue
+            if len(changes) == MAX_RESULTS:
+                return {"continue": {"rccontinue": f"{format_timestamp(record['date'])}|{rcid}", "continue": "-||"},
+                        "query": {"recentchanges": changes}}
+            changes.append({"type": "new", "ns": 0, "title": record["id"], "rcid": rcid,
+                            "timestamp": format_timestamp(record["date"])})
+        return {"query": {"recentchanges": changes}}
+
+    def __all_pages(self, host: str, params: dict) -> dict:
+        titles = sorted(self.state.corpus.titles(host))
+        start = params.get("apcontinue", "")
+        titles = [title for title in titles if title >= start]
+        response = {"query": {"allpages": [{"ns": 0, "title": title} for title in titles[:MAX_RESULTS]]}}
+        if len(titles) > MAX_RESULTS:
+            response["continue"] = {"apcontinue": titles[MAX_RESULTS], "continue": "-||"}
+        return response
+
+    def __files(self, titles: List[str]) -> dict:
+        pages = []
+        for title in titles:
+            page = {"ns": 6, "title": title}
+            if chance(self.state.corpus.seed, title, "deleted") < self.state.args.missing_files:
+                page["missing"] = True
+            pages.append(page)
+        return {"query": {"pages": pages}}
+
+    def __pages(self, host: str, titles: List[str], params: dict) -> dict:
+        images = {image.split(":", 1)[1] for image in params.get("imimages", "").split("|") if ":" in image}
+        normalized = []
+        pages = []
+        for title in titles:
+            if normalize_title(title) != title:
+                normalized.append({"fromencoded": False, "from": title, "to": normalize_title(title)})
+                title = normalize_title(title)
+            page = self.state.page(host, title)
+            if page is None:
+                pages.append({"ns": 0, "title": title, "missing": True})
+                continue
+            text, timestamp = page
+            used = [{"ns": 6, "title": f"File:{image}"} for image in sorted(images)
+                    if image in text or image.replace(" ", "_") in text]
+            pages.append({"ns": 0, "title": title, "images": used,
+                          "revisions": [{"timestamp": format_timestamp(timestamp), "content": text}]})
+
+        query = {"pages": pages}
+        if normalized:
+            query["normalized"] = normalized
+        return {"query": query}
+
+    def __edit(self, host: str, params: dict) -> dict:
+        title = normalize_title(params["title"])
+        page = self.state.page(host, title)
+        if page is None:
+            raise ApiError("missingtitle", "The page you specified doesn't exist.")
+        text, timestamp = page
+
+        # Someone else edits the page at the same time
+        if random.random() < self.state.args.conflict_rate:
+            self.state.pages[host][title] = (text, max(time.time(), timestamp + 1))
+            raise ApiError("editconflict", "Edit conflict.")
+        if params.get("basetimestamp") != format_timestamp(timestamp):
+            raise ApiError("editconflict", "Edit conflict.")
+
+        new_text = params["text"]
+        if "section" in params:
+            headings = list(HEADING_REGEX.finditer(text))
+            number = int(params["section"])
+            if not 0 < number <= len(headings):
+                raise ApiError("nosuchsection", f"There is no section {number}.")
+            heading = headings[number - 1]
+            level = len(heading.group(1))
+            end = next((other.start() for other in headings[number:] if len(other.group(1)) <= level), len(text))
+            after = text[end:]
+            new_text = text[:heading.start()] + new_text.rstrip(TRAILING_WHITESPACE) + ("\n\n" + after if after else "")
+        new_text = new_text.rstrip(TRAILING_WHITESPACE)
+
+        new_timestamp = max(time.time(), timestamp + 1)
+        self.state.pages[host][title] = (new_text, new_timestamp)
+        return {"edit": {"result": "Success", "title": title, "newtimestamp": format_timestamp(new_timestamp)}}
+
+    def __sections(self, host: str, params: dict) -> dict:
+        title = normalize_title(params["page"])
+        page = self.state.page(host, title)
+        if page is None:
+            raise ApiError("missingtitle", "The page you specified doesn't exist.")
+        text = page[0]
+        sections = [{"level": str(len(heading.group(1))), "index": str(number),
+                     "byteoffset": len(text[:heading.start()].encode("utf-8"))}
+                    for number, heading in enumerate(HEADING_REGEX.finditer(text), 1)]
+        return {"parse": {"title": title, "sections": sections}}
+
+    def __get_entities(self, params: dict) -> dict:
+        entities = {}
+        if "sites" in params:
+            # No sitelink is known to the stand-in
+            for i, _ in enumerate(params["titles"].split("|")):
+                entities[str(-1 - i)] = {"missing": ""}
+            return {"entities": entities, "success": 1}
+
+        for entity_id in params["ids"].split("|"):
+            entity = self.state.entity(entity_id)
+            if entity is None:
+                entities[entity_id] = {"id": entity_id, "missing": ""}
+            elif params.get("props") == "info":
+                entities[entity_id] = {"id": entity_id, "type": "item"}
+            else:
+                entities[entity_id] = {"id": entity_id, "claims": self.__claims(entity)}
+        return {"entities": entities, "success": 1}
+
+    def __get_claims(self, entity_id: str) -> dict:
+        entity = self.state.entity(entity_id)
+        if entity is None:
+            raise ApiError("no-such-entity", f"Could not find an entity with the ID \"{entity_id}\".")
+        return {"claims": self.__claims(entity)}
+
+    def __set_claim(self, claim: dict) -> dict:
+        entity_id = claim["id"].split("$")[0]
+        entity = self.state.entity(entity_id)
+        if entity is None:
+            raise ApiError("no-such-entity", f"Could not find an entity with the ID \"{entity_id}\".")
+        entity["P443"].add(claim["mainsnak"]["datavalue"]["value"])
+        return {"pageinfo": {"lastrevid": 1}, "success": 1, "claim": claim}
+
+    @staticmethod
+    def __claims(entity: dict) -> dict:
+        return {"P443": [
+            {"mainsnak": {"snaktype": "value", "property": "P443",
+                          "datavalue": {"type": "string", "value": filename}}}
+            for filename in sorted(entity["P443"])
+        ]}
+
+    def __sparql(self, host: str, query: str) -> List[dict]:
+        if host == LINGUALIBRE:
+            return self.__records(query)
+        if "wdt:P305" in query:
+            return self.__languages(query)
+        if "wdt:P17" in query:
+            return self.__places(query)
+        return []
+
+    def __records(self, query: str) -> List[dict]:
+        records = self.state.corpus.all_records()
+
+        values = re.search(r"VALUES \?record \{([^}]*)\}", query)
+        if values is not None:
+            ids = {value.split(":", 1)[1] for value in values[1].split()}
+            records = [self.state.corpus.by_id[i] for i in ids if i in self.state.corpus.by_id]
+        language = re.search(r"BIND\( entity:(Q\d+) as \?language \)", query)
+        if language is not None:
+            records = [record for record in records if record["language"][0] == language[1]]
+        iso = re.search(r'\?languageIso = "([^"]*)"', query)
+        if iso is not None:
+            records = [record for record in records if record["language"][3] == iso[1]]
+        code = re.search(r'\?languageWMCode="([^"]*)"', query)
+        if code is not None:
+            records = [record for record in records if record["language"][2] == code[1]]
+        user = re.search(r'\?linkeduser = "([^"]*)"', query)
+        if user is not None:
+            records = [record for record in records if record["speaker"] == user[1]]
+        for operator, date in re.findall(r'FILTER\( \?date (>=|>|<) "([^"]*)"\^\^xsd:dateTime \)', query):
+            date = parse_timestamp(date)
+            if operator == ">=":
+                records = [record for record in records if record["date"] >= date]
+            elif operator == ">":
+                records = [record for record in records if record["date"] > date]
+            else:
+                records = [record for record in records if record["date"] < date]
+
+        if len(records) > self.state.args.sparql_max_results:
+            raise ApiError("timeout", "java.util.concurrent.TimeoutException", 500)
+
+        bindings = []
+        for record in records:
+            binding = {
+                "record": {"type": "uri", "value": LINGUALIBRE_ENTITY + record["id"]},
+                "file": {"type": "uri", "value": COMMONS_FILEPATH + urllib.parse.quote(record["file"])},
+                "transcription": {"type": "literal", "value": record["word"]},
+                "languageIso": {"type": "literal", "value": record["language"][3]},
+                "languageQid": {"type": "literal", "value": record["language"][1]},
+                "residence": {"type": "uri", "value": WIKIDATA_ENTITY + record["residence"]},
+                "languageLevel": {"type": "uri", "value": LINGUALIBRE_ENTITY + record["level"]},
+            }
+            if record["learning"] is not None:
+                binding["learningPlace"] = {"type": "uri", "value": WIKIDATA_ENTITY + record["learning"]}
+            if record["wikidata"] is not None:
+                binding["wikidataId"] = {"type": "literal", "value": record["wikidata"]}
+            if record["lexeme"] is not None:
+                binding["lexemeId"] = {"type": "literal", "value": record["lexeme"]}
+            bindings.append(binding)
+        return bindings
+
+    @staticmethod
+    def __label_languages(query: str) -> List[str]:
+        languages = re.search(r"IN \(([^)]*)\)", query)
+        return re.findall(r'"([^"]+)"', languages[1]) if languages else []
+
+    def __languages(self, query: str) -> List[dict]:
+        bindings = []
+        for language in LANGUAGES:
+            item = {"type": "uri", "value": WIKIDATA_ENTITY + language[1]}
+            code = {"type": "literal", "value": language[2]}
+            bindings.append({"item": item, "code": code})
+            for label_language in self.__label_languages(query):
+                value = {"xml:lang": label_language, "type": "literal", "value": label(language[1], label_language)}
+                bindings.append({"item": item, "code": code, "label": value})
+        return bindings
+
+    def __places(self, query: str) -> List[dict]:
+        values = re.search(r"VALUES \?location \{([^}]*)\}", query)
+        locations = {value.split(":", 1)[1] for value in values[1].split()} if values else set()
+        bindings = []
+        for place, country, name in PLACES:
+            if place not in locations:
+                continue
+            binding = {"location": {"type": "uri", "value": WIKIDATA_ENTITY + place},
+                       "country": {"type": "uri", "value": WIKIDATA_ENTITY + country}}
+            bindings.append(binding)
+            for label_language in self.__label_languages(query):
+                bindings.append({**binding, "label": {"xml:lang": label_language, "type": "literal", "value": name}})
+                bindings.append({**binding, "countryLabel": {"xml:lang": label_language, "type": "literal",
+                                                             "value": COUNTRIES[country]}})
+        return bindings
+
+
+def create_server(args, port: int = 0) -> http.server.ThreadingHTTPServer:
+    """
+    @param args: the options of the stand-in, as parsed by create_parser()
+    @param port: the port to listen on; 0 for any free one
+    @return: the server, which still has to be started
+    """
+    corpus = Corpus(args.records, args.live_rate, args.seed, args.coverage)
+    handler = type("BoundHandler", (Handler,), {"state": State(corpus, args)})
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.corpus = corpus
+    return server
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Stand-in for the Wikimedia and Lingua Libre servers.")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on (default: 8765)")
+    add_arguments(parser)
+    return parser
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--records", type=int, default=2000,
+                        help="number of records made before the start (default: 2000)")
+    parser.add_argument("--live-rate", type=float, default=1.0,
+                        help="number of records made per second after the start (default: 1)")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the synthetic corpus (default: 1)")
+    parser.add_argument("--coverage", type=float, default=0.3,
+                        help="share of the words having an entry on each wiktionary (default: 0.3)")
+    parser.add_argument("--latency", type=float, default=50,
+                        help="median number of milliseconds taken by a request to api.php (default: 50)")
+    parser.add_argument("--sparql-latency", type=float, default=500,
+                        help="median number of milliseconds taken by a SPARQL query (default: 500)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="share of the requests to api.php answered by maxlag or 503 errors (default: 0)")
+    parser.add_argument("--sparql-error-rate", type=float, default=0.0,
+                        help="share of the SPARQL queries timing out (default: 0)")
+    parser.add_argument("--sparql-max-results", type=int, default=100000,
+                        help="number of records above which a SPARQL query times out (default: 100000)")
+    parser.add_argument("--conflict-rate", type=float, default=0.0,
+                        help="share of the edits conflicting with another one (default: 0)")
+    parser.add_argument("--missing-files", type=float, default=0.02,
+                        help="share of the files deleted from Commons (default: 0.02)")
+    parser.add_argument("--no-high-limits", action="store_true",
+                        help="do not give the apihighlimits right to the account")
+
+
+def main() -> None:
+    args = create_parser().parse_args()
+    server = create_server(args, args.port)
+    print(f"Listening on http://127.0.0.1:{server.server_address[1]}, "
+          f"{args.records} records, {args.live_rate} more per second")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
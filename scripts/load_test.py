@@ -0,0 +1,200 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+"""
+Run the bot against the stand-in of scripts/fake_wikimedia.py, in simple mode and then in live mode,
+one wiki after the other, and report for each wiki the number of records executed per second,
+the number of requests sent per record and the latency of these requests.
+
+Example:
+    python3 scripts/load_test.py --records 5000 --latency 80 --error-rate 0.01 --live-duration 60
+"""
+
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from typing import List, Optional, Tuple
+
+import fake_wikimedia
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+WIKIS = ["wikidatawiki", "lexemes", "frwiktionary", "kuwiktionary", "ocwiktionary", "orwiktionary", "shywiktionary"]
+CONFIG = """[wiki]
+user = Load test@bot
+password = password
+"""
+
+
+def percentile(values: List[float], share: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+def get_stats(base_url: str, reset: bool = False) -> dict:
+    if reset:
+        request = urllib.request.Request(f"{base_url}/_reset", method="POST")
+    else:
+        request = urllib.request.Request(f"{base_url}/_stats")
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def run_bot(base_url: str, directory: str, wiki: str, options: List[str], mode_args: List[str],
+            duration: Optional[float] = None) -> Tuple[float, str]:
+    """
+    Run the bot on the given wiki, with an empty cache.
+    @param base_url: the url of the stand-in
+    @param directory: where the configuration, the cache and the output of the bot are stored
+    @param wiki: the database name of the wiki
+    @param options: the options given before the mode, e.g. ["--concurrent"]
+    @param mode_args: the arguments of the mode, e.g. ["simple"]
+    @param duration: the number of seconds after which the bot is interrupted; None to let it end
+    @return: the number of seconds the bot ran, and what it printed
+    """
+    cache_directory = tempfile.mkdtemp(prefix=f"cache-{wiki}-", dir=directory)
+    env = {
+        **os.environ,
+        "LLBOT_MIRROR": base_url,
+        "LLBOT_CONFIG": os.path.join(directory, "config.ini"),
+        "LLBOT_CACHE": cache_directory,
+        "PYTHONUNBUFFERED": "1",
+    }
+    log_path = os.path.join(directory, f"{wiki}-{mode_args[0]}.log")
+    with open(log_path, "w", encoding="utf-8") as log:
+        start = time.monotonic()
+        command = [sys.executable, os.path.join(ROOT, "llbot.py"), *options, "--wiki", wiki, *mode_args]
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, env=env, cwd=ROOT)
+        try:
+            process.wait(timeout=duration)
+        except subprocess.TimeoutExpired:
+            # Stopped the same way as from the terminal
+            process.send_signal(signal.SIGINT)
+            process.wait()
+        elapsed = time.monotonic() - start
+
+    with open(log_path, encoding="utf-8") as log:
+        output = log.read()
+    if process.returncode not in (0, -signal.SIGINT):
+        print(f"{wiki}: the bot exited with code {process.returncode}, see {log_path}")
+    return elapsed, output
+
+
+def count_records(mode: str, output: str) -> int:
+    lines = output.strip().splitlines()
+    if mode == "live":
+        # Each item found in the recent changes is printed once
+        return len({line for line in lines if line.startswith("found:")})
+    # The simple mode prints the number of records it executed at the end
+    return int(lines[-1]) if lines and lines[-1].isdigit() else 0
+
+
+def report(mode: str, wiki: str, elapsed: float, records: int, stats: dict) -> dict:
+    requests = sum(host["requests"] for host in stats.values())
+    latencies = [latency for host in stats.values() for latency in host["latencies"]]
+    errors = sum(sum(host["errors"].values()) for host in stats.values())
+    edits = sum(host["actions"].get("edit", 0) + host["actions"].get("wbsetclaim", 0) for host in stats.values())
+    return {
+        "mode": mode,
+        "wiki": wiki,
+        "records": records,
+        "seconds": round(elapsed, 1),
+        "records_per_second": round(records / elapsed, 2) if elapsed else 0.0,
+        "requests": requests,
+        "requests_per_record": round(requests / records, 2) if records else 0.0,
+        "edits": edits,
+        "errors": errors,
+        "p50_ms": percentile(latencies, 0.5),
+        "p99_ms": percentile(latencies, 0.99),
+        "hosts": {name: {"requests": host["requests"], "actions": host["actions"], "errors": host["errors"]}
+                  for name, host in stats.items()},
+    }
+
+
+def print_table(results: List[dict]) -> None:
+    columns = [("mode", 6), ("wiki", 14), ("records", 8), ("seconds", 8), ("records_per_second", 10),
+               ("requests", 9), ("requests_per_record", 12), ("edits", 6), ("errors", 7), ("p50_ms", 8),
+               ("p99_ms", 8)]
+    headers = {"records_per_second": "records/s", "requests_per_record": "req/record"}
+    print(" ".join(headers.get(name, name).rjust(width) for name, width in columns))
+    for result in results:
+        print(" ".join(str(result[name]).rjust(width) for name, width in columns))
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Measure the throughput of the bot against a local stand-in "
+                                                 "of the Wikimedia and Lingua Libre servers.")
+    parser.add_argument("--wikis", nargs="+", choices=WIKIS, default=WIKIS, help="wikis to run the bot on")
+    parser.add_argument("--modes", nargs="+", choices=["simple", "live"], default=["simple", "live"],
+                        help="modes to run the bot in (default: both)")
+    parser.add_argument("--live-duration", type=float, default=60,
+                        help="number of seconds the bot runs in live mode on each wiki (default: 60)")
+    parser.add_argument("--live-delay", type=int, default=5,
+                        help="delay of the live mode between two checks of the recent changes (default: 5)")
+    parser.add_argument("--concurrent", action="store_true", help="run the bot with --concurrent")
+    parser.add_argument("--stream", action="store_true", help="run the simple mode with --stream")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the configuration, caches and outputs of the runs instead of deleting them")
+    fake_wikimedia.add_arguments(parser)
+    return parser
+
+
+def main() -> None:
+    args = create_parser().parse_args()
+
+    server = fake_wikimedia.create_server(args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    print(f"Stand-in listening on {base_url}, {args.records} records, {args.live_rate} more per second")
+
+    directory = tempfile.mkdtemp(prefix="llbot-load-")
+    with open(os.path.join(directory, "config.ini"), "w", encoding="utf-8") as config:
+        config.write(CONFIG)
+
+    options = ["--concurrent"] if args.concurrent else []
+    results = []
+    for mode in args.modes:
+        for wiki in args.wikis:
+            if mode == "simple":
+                # Only the records made before the start, so that all the wikis get the same ones
+                mode_args = ["simple", "--enddate", fake_wikimedia.format_timestamp(server.corpus.started)]
+                if args.stream:
+                    mode_args.append("--stream")
+                duration = None
+            else:
+                mode_args = ["live", "--delay", str(args.live_delay), "--backcheck", "0"]
+                duration = args.live_duration
+
+            get_stats(base_url, reset=True)
+            elapsed, output = run_bot(base_url, directory, wiki, options, mode_args, duration)
+            result = report(mode, wiki, elapsed, count_records(mode, output), get_stats(base_url))
+            results.append(result)
+            print(f"{mode} {wiki}: {result['records']} records in {result['seconds']} s, "
+                  f"{result['requests_per_record']} requests per record")
+
+    print()
+    print_table(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    server.shutdown()
+    if args.keep:
+        print(f"Configuration, caches and outputs kept in {directory}")
+    else:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
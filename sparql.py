@@ -2,14 +2,19 @@
 # -*- coding: utf-8 -*-
 # License: GNU GPL v2+
 
+import codecs
 import json
 import re
 import time
 import urllib.parse
+from typing import Iterable, Iterator, Tuple
 
 import backoff
 import requests
 
+import metrics
+import mirror
+
 # Frequent paths root values
 LINGUALIBRE_ENTITY = u"https://lingualibre.org/entity/"
 # Keep both of these below as "http" : that's what's returned by the SPARQL requests
@@ -17,7 +22,48 @@ WIKIDATA_ENTITY = u"http://www.wikidata.org/entity/"
 COMMONS_FILEPATH = u"http://commons.wikimedia.org/wiki/Special:FilePath/"
 
 # SPARQL Service's endpointNextNext
-SPARQL_ENDPOINT = "https://query.wikidata.org/sparql"
+SPARQL_ENDPOINT = mirror.url("https://query.wikidata.org/sparql")
+
+# Beginning of the list of results in a SPARQL JSON response
+BINDINGS_REGEX = re.compile(r'"bindings"\s*:\s*\[')
+SEPARATORS_REGEX = re.compile(r"[\s,]*")
+STREAM_CHUNK_SIZE = 64 * 1024
+# Number of times a query is sent when its response keeps being cut off
+MAX_STREAM_TRIES = 5
+
+
+class QueryTimeoutException(Exception):
+    """
+    The SPARQL endpoint gave up on the query before its end.
+    """
+
+
+class ResponseException(Exception):
+    """
+    The SPARQL endpoint answered with an error instead of results.
+    """
+
+    def __init__(self, status: int) -> None:
+        super().__init__(f"Error {status}")
+        self.status = status
+        # Rate limits and server errors may be gone when the query is sent again
+        self.retryable = status in (403, 429) or status >= 500
+
+
+class TruncatedResponseException(Exception):
+    """
+    The response of the SPARQL endpoint stopped before the end of the results.
+    """
+
+    def __init__(self, tail: str) -> None:
+        super().__init__(tail.strip()[:200])
+        # What follows the last complete result, e.g. the error written by the endpoint
+        self.tail = tail
+
+
+def _describe_query(endpoint: str, *args, **kwargs) -> dict:
+    return {"host": mirror.host(endpoint), "action": "sparql"}
+
 
 # TODO better handle the exceptions coming from this
 @backoff.on_exception(backoff.expo,
@@ -25,19 +71,154 @@ SPARQL_ENDPOINT = "https://query.wikidata.org/sparql"
                                  requests.exceptions.ConnectionError,
                                  requests.exceptions.ChunkedEncodingError,
                                  json.decoder.JSONDecodeError),
-                      max_tries=5)
+                      max_tries=5,
+                      on_backoff=metrics.backoff_handler("sparql", _describe_query))
 # Handle errors
-def request(endpoint: str, query: str):
-    response = requests.post(endpoint, data={"format": "json", "query": query})
+def request(endpoint: str, query: str, raise_on_timeout: bool = False):
+    with metrics.timer("sparql_request_seconds", host=mirror.host(endpoint)):
+        response = requests.post(endpoint, data={"format": "json", "query": query})
+
+    if not check_response(response, raise_on_timeout):
+        metrics.count("sparql_errors_total", host=mirror.host(endpoint), status=response.status_code)
+        return ""
+
+    return json.loads(response.text)["results"]["bindings"]
+
+
+@backoff.on_exception(backoff.expo,
+                      exception=(requests.exceptions.Timeout,
+                                 requests.exceptions.ConnectionError,
+                                 requests.exceptions.ChunkedEncodingError),
+                      max_tries=5,
+                      on_backoff=metrics.backoff_handler("sparql", _describe_query))
+def _post_streamed(endpoint: str, query: str) -> requests.Response:
+    return requests.post(endpoint, data={"format": "json", "query": query}, stream=True)
+
+
+def stream_request(endpoint: str, query: str, raise_on_timeout: bool = False) -> Iterator[dict]:
+    """
+    Same as request, but the results are parsed one by one while the response
+    is being downloaded, so that the whole response is never held in memory.
+    @param endpoint: the url of the SPARQL endpoint
+    @param query: the SPARQL query
+    @param raise_on_timeout: whether to raise a QueryTimeoutException if the query times out
+    @return: an iterator over the results
+    @raise ResponseException: if the endpoint keeps answering with an error
+    @raise TruncatedResponseException: if the response keeps being cut off
+    """
+    # A response cut off is requested again from the start. The results come in no given order,
+    # and new ones may have appeared meanwhile: those already yielded are recognized by their values
+    yielded = set()
+    for attempt in range(1, MAX_STREAM_TRIES + 1):
+        try:
+            for binding in _stream_once(endpoint, query, raise_on_timeout):
+                key = hash(binding_values(binding))
+                if key not in yielded:
+                    yielded.add(key)
+                    yield binding
+            return
+        except (requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.ConnectionError,
+                TruncatedResponseException) as e:
+            metrics.count("sparql_errors_total", host=mirror.host(endpoint), status="truncated")
+            if attempt == MAX_STREAM_TRIES:
+                raise
+            print(f"SPARQL response cut off after {len(yielded)} results ({e!r}), sending the query again")
+        except ResponseException as e:
+            if not e.retryable or attempt == MAX_STREAM_TRIES:
+                raise
+            print(f"SPARQL {e} after {len(yielded)} results, sending the query again")
+        time.sleep(2 ** attempt)
+
+
+def binding_values(binding: dict) -> Tuple[Tuple[str, str], ...]:
+    """
+    @param binding: a result of a SPARQL query
+    @return: the values of the result, by variable name
+    """
+    return tuple(sorted((name, value["value"]) for name, value in binding.items()))
+
+
+def _stream_once(endpoint: str, query: str, raise_on_timeout: bool) -> Iterator[dict]:
+    # Only until the beginning of the response: the rest is read along with the execution of the records
+    with metrics.timer("sparql_request_seconds", host=mirror.host(endpoint)):
+        response = _post_streamed(endpoint, query)
+
+    with response:
+        # Errors come in small responses, there is no need to stream them
+        if response.status_code != 200:
+            metrics.count("sparql_errors_total", host=mirror.host(endpoint), status=response.status_code)
+            # Print the error, or raise a QueryTimeoutException if asked to
+            check_response(response, raise_on_timeout)
+            raise ResponseException(response.status_code)
+
+        decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")()
+        try:
+            yield from parse_bindings(decoder.decode(chunk) for chunk in response.iter_content(STREAM_CHUNK_SIZE))
+        except TruncatedResponseException as e:
+            # Blazegraph writes its timeouts after the results it has already sent
+            if "TimeoutException" not in e.tail:
+                raise
+            metrics.count("sparql_errors_total", host=mirror.host(endpoint), status="timeout")
+            if raise_on_timeout:
+                raise QueryTimeoutException(str(e)) from e
+            print(f"TimeoutException: {e}\nThe results are incomplete, try to use --startdate")
+
+
+def parse_bindings(chunks: Iterable[str]) -> Iterator[dict]:
+    """
+    Parse the results of a SPARQL JSON response given in successive pieces.
+    @param chunks: the successive pieces of the response
+    @return: an iterator over the results
+    @raise TruncatedResponseException: if the response ends before the end of the results
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = None
+    for chunk in chunks:
+        buffer += chunk
+        if position is None:
+            match = BINDINGS_REGEX.search(buffer)
+            if match is None:
+                continue
+            position = match.end()
 
+        while True:
+            position = SEPARATORS_REGEX.match(buffer, position).end()
+            if position >= len(buffer):
+                break
+            if buffer[position] == "]":
+                return
+            try:
+                binding, position = decoder.raw_decode(buffer, position)
+            except json.decoder.JSONDecodeError:
+                # The result is not complete yet, wait for the next chunk
+                break
+            yield binding
+
+        buffer = buffer[position:]
+        position = 0
+
+    raise TruncatedResponseException(buffer)
+
+
+def check_response(response: requests.Response, raise_on_timeout: bool = False) -> bool:
+    """
+    Print the error returned by the SPARQL endpoint, if any.
+    @param response: the response of the endpoint
+    @param raise_on_timeout: whether to raise a QueryTimeoutException if the query timed out
+    @return: True if the response holds results; False otherwise
+    """
     if response.status_code == 504:
+        if raise_on_timeout:
+            raise QueryTimeoutException("504 Gateway Time-out")
         print("504 Gateway Time-out\n"
               "Try to use --startdate")
-        return ""
+        return False
 
     if response.status_code == 429:
         print("Error 429 Too Many Requests")
-        return ""
+        return False
 
     if response.status_code == 403:
         retry_after = int(response.headers["Retry-After"])
@@ -46,7 +227,7 @@ def request(endpoint: str, query: str):
         print(f"Error 403; {error[1]}\nWait for {retry_after} seconds")
 
         time.sleep(retry_after)
-        return ""
+        return False
 
     exception_name = "MalformedQueryException"
     if response.text.find(exception_name) != -1:
@@ -55,7 +236,7 @@ def request(endpoint: str, query: str):
         pos2 = response.text.find("\n", pos1)
         error = error[pos1:pos2].strip()
         print(f"MalformedQueryException: {error}")
-        return ""
+        return False
 
     exception_name = "TimeoutException"
     if response.text.find(exception_name) != -1:
@@ -63,10 +244,12 @@ def request(endpoint: str, query: str):
         pos1 = response.text.find(f"java.util.concurrent.{exception_name}")
         pos2 = response.text.find("\n", pos1)
         error = error[pos1:pos2].strip()
+        if raise_on_timeout:
+            raise QueryTimeoutException(error)
         print(f"TimeoutException: {error}")
-        return ""
+        return False
 
-    return json.loads(response.text)["results"]["bindings"]
+    return True
 
 
 # Formating function : substitute paths, keeps value
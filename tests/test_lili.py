@@ -0,0 +1,120 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+import argparse
+import time
+import unittest
+from typing import Iterator
+from unittest import mock
+
+import lili
+import metrics
+import sparql
+from record import Record
+
+START = "2021-01-01T00:00:00+00:00"
+MIDDLE = "2021-01-01T12:00:00+00:00"
+END = "2021-01-02T00:00:00+00:00"
+
+
+def make_record(record_id: str) -> Record:
+    return Record(record_id, f"{record_id}.wav", "page", None, None, None, None, None, "Q1", None, None)
+
+
+class SplitDateRangeTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_split_in_halves(self):
+        self.assertEqual(lili.split_date_range((START, END, False)), [(START, MIDDLE, False), (MIDDLE, END, True)])
+
+    def test_short_range_is_skipped_and_counted(self):
+        self.assertEqual(lili.split_date_range((START, "2021-01-01T01:00:00+00:00", True)), [])
+        self.assertEqual(metrics.summary()["counters"]["sparql_ranges_skipped_total"], [{"labels": {}, "value": 1}])
+
+
+class GetRecordsTest(unittest.TestCase):
+
+    def test_halves_are_merged_by_date(self):
+        def fetch_records(query: str, date_range: lili.DateRange):
+            if date_range == (START, END, False):
+                raise sparql.QueryTimeoutException()
+            if date_range[0] == START:
+                # The first half ends after the second one
+                time.sleep(0.05)
+                return [make_record("Q1"), make_record("Q2")]
+            return [make_record("Q3")]
+
+        with mock.patch("lili.fetch_records", side_effect=fetch_records):
+            records = lili.get_records("query", START, END, workers=2)
+        self.assertEqual([record.id for record in records], ["Q1", "Q2", "Q3"])
+
+    def test_error_makes_the_query_fail(self):
+        with mock.patch("lili.fetch_records", side_effect=sparql.ResponseException(429)):
+            with self.assertRaises(sparql.ResponseException):
+                lili.get_records("query", START, END)
+
+
+class IterPartitionedRecordsTest(unittest.TestCase):
+
+    def test_records_sent_before_a_timeout_are_yielded_once(self):
+        def iter_records(query: str, raise_on_timeout: bool) -> Iterator[Record]:
+            if MIDDLE not in query:
+                yield make_record("Q1")
+                yield make_record("Q2")
+                raise sparql.QueryTimeoutException()
+            if f'< "{MIDDLE}"' in query:
+                yield from (make_record("Q1"), make_record("Q2"))
+            else:
+                yield make_record("Q3")
+
+        with mock.patch("lili.iter_records", side_effect=iter_records):
+            records = list(lili.iter_partitioned_records(lili.BASEQUERY, START, END))
+        self.assertEqual([record.id for record in records], ["Q1", "Q2", "Q3"])
+
+
+def recent_changes(*changes: tuple) -> dict:
+    return {"query": {"recentchanges": [{"rcid": rcid, "title": title, "timestamp": timestamp}
+                                        for rcid, title, timestamp in changes]}}
+
+
+class StopLoop(Exception):
+    pass
+
+
+class LiveModeTest(unittest.TestCase):
+
+    def test_changes_up_to_the_checkpoint_are_skipped(self):
+        pages = [
+            {**recent_changes((7, "Q1", START), (8, "Q2", START)), "continue": {"rccontinue": "x"}},
+            recent_changes((9, "Q3", END)),
+        ]
+        with mock.patch("lili._get_recent_changes", side_effect=pages) as get:
+            changes = list(lili.iter_recent_changes(START, 7))
+
+        self.assertEqual([change["rcid"] for change in changes], [8, 9])
+        self.assertEqual(get.call_args_list[1][0][0]["rccontinue"], "x")
+
+    def test_resume_from_the_checkpoint(self):
+        checkpoint = {"timestamp": START, "rcid": 7, "pending": {}}
+        args = argparse.Namespace(delay=10, backcheck=None, item=None)
+        saved = []
+
+        with mock.patch("cache.load", return_value=checkpoint), \
+                mock.patch("cache.save", side_effect=lambda name, data: saved.append(dict(data))), \
+                mock.patch("lili._get_recent_changes",
+                           return_value=recent_changes((7, "Q1", START), (8, "Q2", END))) as get, \
+                mock.patch("lili.simple_mode", return_value=["Q2"]) as simple_mode, \
+                mock.patch("time.sleep", side_effect=StopLoop):
+            with self.assertRaises(StopLoop):
+                lili.live_mode(args, {})
+
+        self.assertEqual(get.call_args[0][0]["rcstart"], START)
+        self.assertEqual(simple_mode.call_args[0][0].item, "Q2")
+        self.assertEqual(saved, [{"timestamp": END, "rcid": 8, "pending": {}}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+import unittest
+
+import metrics
+
+
+class BackoffHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_retries_are_labeled_with_the_request(self):
+        handler = metrics.backoff_handler("pywiki", lambda host, data: {"host": host, "action": data["action"]})
+        handler({"args": ("fr.wiktionary.org", {"action": "edit"}), "kwargs": {}, "wait": 1.5,
+                 "exception": TimeoutError()})
+
+        counters = metrics.summary()["counters"]
+        labels = {"client": "pywiki", "host": "fr.wiktionary.org", "action": "edit"}
+        self.assertEqual(counters["backoff_retries_total"], [{"labels": {**labels, "reason": "TimeoutError"},
+                                                              "value": 1}])
+        self.assertEqual(counters["backoff_seconds_total"], [{"labels": labels, "value": 1.5}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+import time
+import unittest
+from unittest import mock
+
+import outcomes
+from record import Record
+from wikis.wiki import Wiki
+
+DAY = 24 * 3600
+
+
+class FakeWiki(Wiki):
+    dbname = "testwiki"
+
+    def __init__(self) -> None:
+        super().__init__("Bot@test", "password", "wikipedia", "test", False)
+
+    def execute(self, record: Record) -> bool:
+        return False
+
+
+def make_record(record_id: str) -> Record:
+    return Record(record_id, f"{record_id}.wav", "page", None, None, None, None, None, "Q1", None, None)
+
+
+class OutcomeStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = outcomes.OutcomeStore(":memory:", retry_delay=30 * DAY)
+        self.addCleanup(self.store.close)
+
+    def test_unknown_record_is_not_settled(self):
+        self.assertFalse(self.store.is_settled("testwiki", "Q10", "A.wav"))
+
+    def test_terminal_outcome_is_settled_forever(self):
+        self.store.save("testwiki", "Q10", "A.wav", outcomes.ADDED)
+        with mock.patch("time.time", return_value=time.time() + 365 * DAY):
+            self.assertTrue(self.store.is_settled("testwiki", "Q10", "A.wav"))
+
+    def test_other_outcome_is_retried_after_the_delay(self):
+        self.store.save("testwiki", "Q10", "A.wav", outcomes.NO_ENTRY)
+        self.assertTrue(self.store.is_settled("testwiki", "Q10", "A.wav"))
+        with mock.patch("time.time", return_value=time.time() + 31 * DAY):
+            self.assertFalse(self.store.is_settled("testwiki", "Q10", "A.wav"))
+
+    def test_outcome_is_kept_per_wiki_and_file(self):
+        self.store.save("testwiki", "Q10", "A.wav", outcomes.ADDED)
+        self.assertFalse(self.store.is_settled("otherwiki", "Q10", "A.wav"))
+        # The file of the record has been replaced on Lingua Libre
+        self.assertFalse(self.store.is_settled("testwiki", "Q10", "B.wav"))
+
+    def test_latest_outcome_wins(self):
+        self.store.save("testwiki", "Q10", "A.wav", outcomes.ADDED)
+        self.store.save("testwiki", "Q10", "A.wav", outcomes.NO_ENTRY)
+        with mock.patch("time.time", return_value=time.time() + 31 * DAY):
+            self.assertFalse(self.store.is_settled("testwiki", "Q10", "A.wav"))
+
+
+class PendingTest(unittest.TestCase):
+
+    def test_settled_records_are_skipped_and_counted(self):
+        wiki = FakeWiki()
+        wiki.outcomes = outcomes.OutcomeStore(":memory:")
+        self.addCleanup(wiki.outcomes.close)
+        records = [make_record("Q10"), make_record("Q11")]
+
+        self.assertTrue(wiki.report(records[0], outcomes.ADDED))
+        self.assertEqual(wiki.pending(records), [records[1]])
+        self.assertEqual(wiki.skipped, 1)
+
+    def test_dry_run_outcomes_are_not_saved(self):
+        wiki = FakeWiki()
+        wiki.api.dry_run = True
+        wiki.outcomes = outcomes.OutcomeStore(":memory:")
+        self.addCleanup(wiki.outcomes.close)
+        record = make_record("Q10")
+
+        wiki.report(record, outcomes.ADDED)
+        self.assertEqual(wiki.pending([record]), [record])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+import unittest
+from unittest import mock
+
+import pywiki
+import ratelimit
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, text: str, headers: dict = None) -> None:
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+
+class LimitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = pywiki.Pywiki("Bot@test", "password", "https://test.example.org/w/api.php", "user", False)
+
+    def test_limit_sends_no_request(self):
+        with mock.patch.object(self.api, "login") as login:
+            self.assertEqual(self.api.limit, 500)
+            self.assertEqual(self.api.batch_size, 50)
+        login.assert_not_called()
+
+    def test_check_rights_logs_in_once(self):
+        def login():
+            self.api.high_limits = True
+
+        with mock.patch.object(self.api, "login", side_effect=login) as login_mock:
+            self.api.check_rights()
+            self.api.check_rights()
+        login_mock.assert_called_once()
+        self.assertEqual(self.api.batch_size, 500)
+
+
+class RequestTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(ratelimit._limiters, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.api = pywiki.Pywiki("Bot@test", "password", "https://test.example.org/w/api.php", "user", False)
+        self.api.session = mock.Mock()
+
+    def test_too_many_requests_waits_then_goes_on_more_slowly(self):
+        self.api.session.post.side_effect = [FakeResponse(429, "", {"Retry-After": "20"}),
+                                             FakeResponse(200, '{"query": {}}')]
+        with mock.patch("time.sleep") as sleep:
+            self.assertEqual(self.api.request({"action": "query"}), {"query": {}})
+
+        self.assertEqual(self.api.session.post.call_count, 2)
+        # Waited for as long as asked before the second request
+        self.assertGreaterEqual(sleep.call_args[0][0], 19)
+        self.assertLess(self.api.limiter.read.rate, ratelimit.DEFAULT_READ_RATE)
+
+    def test_writes_have_their_own_bucket(self):
+        self.api.session.post.side_effect = [FakeResponse(429, "", {"Retry-After": "20"}),
+                                             FakeResponse(200, '{"edit": {}}')]
+        with mock.patch("time.sleep"):
+            self.api.request({"action": "edit"})
+
+        self.assertEqual(self.api.limiter.read.rate, ratelimit.DEFAULT_READ_RATE)
+        self.assertLess(self.api.limiter.write.rate, ratelimit.DEFAULT_WRITE_RATE)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+import unittest
+from unittest import mock
+
+import ratelimit
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch("time.monotonic", return_value=100.0)
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_wait(self):
+        bucket = ratelimit.TokenBucket(2)
+        self.assertEqual([bucket.reserve(), bucket.reserve()], [0.0, 0.0])
+        self.assertEqual(bucket.reserve(), 0.5)
+
+    def test_tokens_refill_with_time(self):
+        bucket = ratelimit.TokenBucket(2)
+        for _ in range(2):
+            bucket.reserve()
+        self.clock.return_value = 101.0
+        self.assertEqual([bucket.reserve(), bucket.reserve()], [0.0, 0.0])
+
+    def test_refill_is_capped(self):
+        bucket = ratelimit.TokenBucket(2)
+        self.clock.return_value = 200.0
+        self.assertEqual([bucket.reserve(), bucket.reserve()], [0.0, 0.0])
+        self.assertEqual(bucket.reserve(), 0.5)
+
+    def test_slow_down_pauses_and_halves_the_rate(self):
+        bucket = ratelimit.TokenBucket(2)
+        bucket.slow_down(30)
+        self.assertEqual(bucket.rate, 1)
+        self.assertEqual(bucket.reserve(), 30)
+
+    def test_speed_up_recovers_the_configured_rate(self):
+        bucket = ratelimit.TokenBucket(2)
+        bucket.slow_down()
+        for _ in range(100):
+            bucket.speed_up()
+        self.assertEqual(bucket.rate, 2)
+
+    def test_rate_has_a_floor(self):
+        bucket = ratelimit.TokenBucket(1)
+        for _ in range(20):
+            bucket.slow_down()
+        self.assertEqual(bucket.rate, ratelimit.MIN_RATE)
+
+
+if __name__ == "__main__":
+    unittest.main()
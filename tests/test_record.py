@@ -0,0 +1,48 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+import unittest
+
+from record import Record, intern
+
+
+def make_record() -> Record:
+    return Record("Q10", "A.wav", "page", "Q90", "Q20", None, None, None, "Q1", None, "Q15")
+
+
+class RecordTest(unittest.TestCase):
+
+    def test_slots_only(self):
+        record = make_record()
+        self.assertFalse(hasattr(record, "__dict__"))
+        with self.assertRaises(AttributeError):
+            record.unknown = "value"
+
+    def test_links_are_read_from_the_fields(self):
+        record = make_record()
+        self.assertEqual(dict(record.links),
+                         {"wikidata": "Q20", "lexeme": None, "wikipedia": None, "wiktionary": None})
+        self.assertEqual(dict(record.language), {"qid": "Q1", "learning": None, "level": "Q15"})
+
+    def test_links_write_to_the_fields(self):
+        record = make_record()
+        # As done when the item of the record is a redirect on Wikidata
+        record.links["wikidata"] = "Q21"
+        self.assertEqual(record.wikidata_id, "Q21")
+        self.assertEqual(record.links["wikidata"], "Q21")
+
+    def test_unknown_key(self):
+        with self.assertRaises(KeyError):
+            make_record().links["commons"] = "value"
+
+    def test_equality(self):
+        self.assertEqual(make_record(), make_record())
+
+    def test_intern(self):
+        self.assertIs(intern("".join(["Q", "150"])), intern("Q150"))
+        self.assertIsNone(intern(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+import json
+import unittest
+from typing import Iterator, List, Union
+from unittest import mock
+
+import requests
+
+import sparql
+
+BINDINGS = [{"record": {"type": "literal", "value": f"Q{i}"}} for i in range(5)]
+BODY = json.dumps({"head": {"vars": ["record"]}, "results": {"bindings": BINDINGS}})
+TIMEOUT_ERROR = "\njava.util.concurrent.ExecutionException: java.util.concurrent.TimeoutException\n\tat ..."
+
+
+class FakeResponse:
+    """
+    Response sending the given pieces of body, an exception standing for a connection lost at this point.
+    """
+
+    def __init__(self, chunks: List[Union[str, Exception]], status_code: int = 200) -> None:
+        self.chunks = chunks
+        self.status_code = status_code
+        self.encoding = "utf-8"
+        self.headers = {"Retry-After": "0"}
+        self.text = "".join(chunk for chunk in chunks if isinstance(chunk, str))
+
+    def iter_content(self, chunk_size: int) -> Iterator[bytes]:
+        for chunk in self.chunks:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk.encode("utf-8")
+
+    def __enter__(self) -> "FakeResponse":
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+
+def stream(*responses: FakeResponse, raise_on_timeout: bool = False) -> List[dict]:
+    with mock.patch("sparql._post_streamed", side_effect=responses), mock.patch("time.sleep"):
+        return list(sparql.stream_request("https://query.example.org/sparql", "query", raise_on_timeout))
+
+
+class ParseBindingsTest(unittest.TestCase):
+
+    def test_complete_response(self):
+        chunks = [BODY[i:i + 7] for i in range(0, len(BODY), 7)]
+        self.assertEqual(list(sparql.parse_bindings(chunks)), BINDINGS)
+
+    def test_truncated_response_raises(self):
+        with self.assertRaises(sparql.TruncatedResponseException):
+            list(sparql.parse_bindings([BODY[:len(BODY) // 2]]))
+
+
+class StreamRequestTest(unittest.TestCase):
+
+    def test_timeout_after_some_results(self):
+        response = FakeResponse([BODY[:len(BODY) // 2], TIMEOUT_ERROR])
+        with self.assertRaises(sparql.QueryTimeoutException):
+            stream(response, raise_on_timeout=True)
+
+    def test_cut_off_response_is_requested_again(self):
+        cut_off = FakeResponse([BODY[:len(BODY) // 2]])
+        self.assertEqual(stream(cut_off, FakeResponse([BODY])), BINDINGS)
+
+    def test_connection_lost_is_requested_again(self):
+        lost = FakeResponse([BODY[:len(BODY) // 2], requests.exceptions.ChunkedEncodingError()])
+        self.assertEqual(stream(lost, FakeResponse([BODY])), BINDINGS)
+
+    def test_results_in_another_order_are_not_skipped(self):
+        cut_off = FakeResponse([BODY[:len(BODY) // 2]])
+        reordered = [BINDINGS[3], BINDINGS[0], BINDINGS[4], BINDINGS[2], BINDINGS[1]]
+        body = json.dumps({"head": {"vars": ["record"]}, "results": {"bindings": reordered}})
+        results = stream(cut_off, FakeResponse([body]))
+        self.assertEqual(sorted(result["record"]["value"] for result in results), [f"Q{i}" for i in range(5)])
+
+    def test_rate_limited_query_is_sent_again(self):
+        self.assertEqual(stream(FakeResponse(["Too Many Requests"], 429), FakeResponse([BODY])), BINDINGS)
+
+    def test_malformed_query_raises(self):
+        response = FakeResponse(["MalformedQueryException: bad\n"], 400)
+        with self.assertRaises(sparql.ResponseException):
+            stream(response, FakeResponse([BODY]))
+
+    def test_response_always_cut_off_raises(self):
+        responses = [FakeResponse([BODY[:len(BODY) // 2]]) for _ in range(sparql.MAX_STREAM_TRIES)]
+        with self.assertRaises(sparql.TruncatedResponseException):
+            stream(*responses)
+
+
+if __name__ == "__main__":
+    unittest.main()
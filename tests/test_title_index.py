@@ -0,0 +1,87 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+import os
+import tempfile
+import unittest
+from typing import List
+from unittest import mock
+
+import cache
+import title_index
+
+
+class FakeApi:
+    """
+    Answer the requests of the index as MediaWiki would, the given pages having been created since its last update.
+    """
+
+    def __init__(self, created: List[str]) -> None:
+        self.created = created
+        self.requests = []
+
+    def request(self, data: dict) -> dict:
+        self.requests.append(data)
+        if data.get("list") == "recentchanges":
+            return {"query": {"recentchanges": [{"type": "new", "ns": 0, "title": title} for title in self.created]}}
+        if data.get("list") == "allpages":
+            return {"query": {"allpages": [{"title": "chat"}, {"title": "chien"}]}}
+        return {"query": {"statistics": {"pages": 2}}}
+
+
+class BloomFilterTest(unittest.TestCase):
+
+    def test_added_items_are_found(self):
+        bloom = title_index.BloomFilter.for_capacity(1000, 0.01)
+        for i in range(1000):
+            bloom.add(f"title {i}")
+        self.assertTrue(all(f"title {i}" in bloom for i in range(1000)))
+        false_positives = sum(f"other {i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class TitleIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch("cache.CACHE_DIRECTORY", directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def build(self) -> None:
+        # As the refresh mode does, the list of all the titles being unavailable
+        api = FakeApi([])
+        api.session = mock.Mock(**{"get.side_effect": OSError("no dump")})
+        title_index.TitleIndex(api, "testwiktionary").refresh()
+
+    def test_without_index_all_pages_may_exist(self):
+        api = FakeApi(["chat"])
+        index = title_index.TitleIndex(api, "testwiktionary")
+        index.update()
+        self.assertEqual(api.requests, [])
+        self.assertTrue(index.may_exist("anything"))
+
+    def test_created_page_may_exist_after_update(self):
+        self.build()
+        index = title_index.TitleIndex(FakeApi(["souris"]), "testwiktionary")
+        index.update()
+        self.assertTrue(index.may_exist("chien"))
+        self.assertTrue(index.may_exist("souris"))
+        self.assertFalse(index.may_exist("éléphant"))
+
+    def test_saved_only_when_titles_are_added(self):
+        self.build()
+        path = cache.get_path(title_index.TitleIndex(None, "testwiktionary").cache_name)
+        os.utime(path, (0, 0))
+
+        title_index.TitleIndex(FakeApi([]), "testwiktionary").update()
+        self.assertEqual(os.path.getmtime(path), 0)
+
+        title_index.TitleIndex(FakeApi(["souris"]), "testwiktionary").update()
+        self.assertNotEqual(os.path.getmtime(path), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+import unittest
+from unittest import mock
+
+import lili
+import metrics
+from record import Record
+from tests.test_wiktionary import FakeApi, FakeWiktionary
+from wikis.wikidata import Lexeme, Wikidata
+
+
+def make_record(record_id: str, language_qid: str = "Q1", wikidata_id: str = None, lexeme_id: str = None) -> Record:
+    return Record(record_id, f"{record_id}.wav", "page", None, wikidata_id, lexeme_id, None, None, language_qid,
+                  None, None)
+
+
+class AcceptedTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_wikidata_refuses_records_without_item(self):
+        wiki = Wikidata("Bot@test", "password", False)
+        records = [make_record("Q10", wikidata_id="Q20"), make_record("Q11"), make_record("Q12", lexeme_id="L1-F1")]
+
+        self.assertEqual(wiki.accepted(records), records[:1])
+        self.assertEqual(wiki.refused, 2)
+        self.assertEqual(metrics.summary()["counters"]["records_refused_total"],
+                         [{"labels": {"wiki": "wikidatawiki"}, "value": 2}])
+
+    def test_lexeme_refuses_records_without_form(self):
+        wiki = Lexeme("Bot@test", "password", False)
+        records = [make_record("Q10", wikidata_id="Q20"), make_record("Q11", lexeme_id="L1-F1")]
+
+        self.assertEqual(wiki.accepted(records), records[1:])
+        self.assertEqual(wiki.refused, 1)
+
+    def test_wiktionary_refuses_languages_without_code_once_prepared(self):
+        wiki = FakeWiktionary(FakeApi("", []))
+        wiki.refused = 0
+        wiki.languages = None
+        records = [make_record("Q10", "Q1"), make_record("Q11", "Q2")]
+
+        # Nothing is known about the languages before prepare()
+        self.assertEqual(wiki.accepted(records), records)
+        wiki.languages = {"Q1"}
+        self.assertEqual(wiki.accepted(records), records[:1])
+        self.assertEqual(wiki.refused, 1)
+
+    def test_refused_records_are_not_fetched(self):
+        wiki = mock.Mock(dbname="testwiki")
+        wiki.accepted.return_value = []
+        wiki.pending.side_effect = lambda records: records
+        wiki.group.side_effect = lambda records: [[record] for record in records]
+
+        lili.execute_window(wiki, [make_record("Q10")])
+        wiki.pending.assert_called_once_with([])
+        wiki.prefetch.assert_called_once_with([])
+        wiki.execute_group.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,235 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+import unittest
+from typing import List, Optional, Tuple
+from unittest import mock
+
+import language_map
+import location_map
+import outcomes
+from record import Record
+from wikis.wiktionaries.frwiktionary import FrWiktionary
+from wikis.wiktionaries.orwiktionary import OrWiktionary
+from wikis.wiktionary import Wiktionary, get_changed_section, get_heading_offsets, has_uncertain_headings
+
+TIMESTAMP = "2021-01-01T00:00:00Z"
+
+
+class FakeApi:
+    """
+    Answer the requests of a wiktionary as MediaWiki would, the page being split in the given sections.
+    """
+
+    def __init__(self, text: str, headings: List[str]) -> None:
+        self.text = text
+        # Offsets of the headings which MediaWiki counts, found by their text
+        self.offsets = [len(text[:text.index(heading)].encode("utf-8")) for heading in headings]
+        self.requests = []
+        self.dry_run = False
+        self.edit_result = {"edit": {"result": "Success"}}
+
+    def get_csrf_token(self) -> str:
+        return "token"
+
+    def request(self, data: dict) -> dict:
+        self.requests.append(data)
+        if data["action"] == "query":
+            return {"query": {"pages": [{"title": data["titles"], "images": [],
+                                         "revisions": [{"content": self.text, "timestamp": TIMESTAMP}]}]}}
+        if data["action"] == "parse":
+            return {"parse": {"sections": [{"index": str(number), "byteoffset": offset}
+                                           for number, offset in enumerate(self.offsets, 1)]}}
+        return self.edit_result
+
+
+class FakeTitles:
+    def may_exist(self, title: str) -> bool:
+        return True
+
+
+class FakeStore:
+    def __init__(self) -> None:
+        self.saved = []
+
+    def save(self, dbname: str, record_id: str, filename: str, outcome: str) -> None:
+        self.saved.append((record_id, filename, outcome))
+
+
+class FakeCommons:
+    def __init__(self, names: dict) -> None:
+        self.names = names
+
+    def resolve(self, filenames) -> None:
+        pass
+
+    def current_name(self, filename: str) -> Optional[str]:
+        return self.names.get(filename, filename)
+
+
+def setup_wiki(wiki: Wiktionary, api: FakeApi) -> Wiktionary:
+    # Without logging in
+    wiki.api = api
+    wiki.summary = "test"
+    wiki.language_domain = "test"
+    wiki.prefetched = {}
+    wiki.titles = FakeTitles()
+    wiki.outcomes = FakeStore()
+    wiki.edit_conflicts = 0
+    return wiki
+
+
+def make_record(record_id: str, filename: str, transcription: str = "page") -> Record:
+    return Record(record_id, filename, transcription, None, None, None, None, None, "Q1", None, None)
+
+
+class FakeWiktionary(Wiktionary):
+    dbname = "testwiktionary"
+
+    def __init__(self, api: FakeApi) -> None:
+        setup_wiki(self, api)
+
+    def _apply(self, record: Record, text: str) -> Tuple[Optional[str], str]:
+        return text, outcomes.ADDED
+
+
+class SaveEntryTest(unittest.TestCase):
+
+    def save(self, text: str, new_text: str, headings: List[str]) -> FakeApi:
+        api = FakeApi(text, headings)
+        FakeWiktionary(api).save_entry("page", text, new_text, TIMESTAMP)
+        return api
+
+    def assert_full_text(self, api: FakeApi, new_text: str) -> None:
+        edit = api.requests[-1]
+        self.assertNotIn("section", edit)
+        self.assertEqual(edit["text"], new_text)
+
+    def test_plain_page_sends_section_without_check(self):
+        text = "== A ==\na\n\n== B ==\nb\n\n== C ==\nc"
+        api = self.save(text, text + "\nc2", ["== A", "== B", "== C"])
+        self.assertEqual([data["action"] for data in api.requests], ["edit"])
+        self.assertEqual(api.requests[0]["section"], 3)
+
+    def test_template_page_sends_section_without_check(self):
+        text = "== A ==\n{{t|{{u}}}}\n\n== B ==\n{{t|\nb}}"
+        api = self.save(text, text + "\nb2", ["== A", "== B"])
+        self.assertEqual([data["action"] for data in api.requests], ["edit"])
+        self.assertEqual(api.requests[0]["section"], 2)
+
+    def test_ref_page_sends_section_once_checked(self):
+        text = "== A ==\na<ref>r</ref>\n\n== B ==\nb"
+        api = self.save(text, text + "\nb2", ["== A", "== B"])
+        self.assertEqual([data["action"] for data in api.requests], ["parse", "edit"])
+        self.assertEqual(api.requests[1]["section"], 2)
+
+    def test_heading_hidden_in_ref(self):
+        text = "== A ==\na<ref>\n== hidden ==\n</ref>\n\n== B ==\nb\n\n== C ==\nc"
+        # The headings of the wikitext put C in the 4th section, while it is the 3rd one for MediaWiki
+        self.assertEqual(get_changed_section(text, text + "\nc2")[0], 4)
+        api = self.save(text, text + "\nc2", ["== A", "== B", "== C"])
+        self.assert_full_text(api, text + "\nc2")
+
+    def test_heading_hidden_in_gallery(self):
+        text = "== A ==\n<gallery>\n== hidden ==\n</gallery>\n\n== B ==\nb"
+        api = self.save(text, text.replace("\nb", "\nb2"), ["== A", "== B"])
+        self.assert_full_text(api, text.replace("\nb", "\nb2"))
+
+    def test_heading_hidden_in_nested_template(self):
+        text = "== A ==\n{{t|{{u}}\n== X ==\n}}\n\n== B ==\nb"
+        api = self.save(text, text + "\nb2", ["== A", "== B"])
+        self.assert_full_text(api, text + "\nb2")
+
+    def test_heading_hidden_in_section_extent(self):
+        # The hidden heading ends the section A in the wikitext, but not for MediaWiki
+        text = "== A ==\na\n<poem>\n== hidden ==\n</poem>\nrest of A\n\n== B ==\nb"
+        api = self.save(text, text.replace("\na\n", "\na2\n"), ["== A", "== B"])
+        self.assert_full_text(api, text.replace("\na\n", "\na2\n"))
+
+
+class ExecuteGroupTest(unittest.TestCase):
+
+    def execute(self, edit_result: dict) -> FakeWiktionary:
+        api = FakeApi("== A ==\na", ["== A"])
+        api.edit_result = edit_result
+        wiki = FakeWiktionary(api)
+        self.results = wiki.execute_group([make_record("Q10", "Same.wav"), make_record("Q11", "Same.wav")])
+        return wiki
+
+    def test_duplicate_file_is_present_once_saved(self):
+        wiki = self.execute({"edit": {"result": "Success"}})
+        self.assertEqual(self.results, [True, False])
+        self.assertEqual(wiki.outcomes.saved, [("Q10", "Same.wav", outcomes.ADDED),
+                                               ("Q11", "Same.wav", outcomes.ALREADY_PRESENT)])
+
+    def test_duplicate_file_is_left_pending_if_not_saved(self):
+        wiki = self.execute({"error": {"code": "abusefilter-disallowed"}})
+        self.assertEqual(self.results, [False, False])
+        self.assertEqual(wiki.outcomes.saved, [])
+
+
+class OrWiktionaryTest(unittest.TestCase):
+
+    def make_wiki(self, names: dict) -> OrWiktionary:
+        wiki = setup_wiki(OrWiktionary.__new__(OrWiktionary), FakeApi("== ଓଡ଼ିଆ ==\n'''page'''", ["== ଓଡ଼ିଆ"]))
+        wiki.commons = FakeCommons(names)
+        wiki.language_code_map = {"Q1": "or"}
+        wiki.language_label_map = {"Q1": "ଓଡ଼ିଆ"}
+        return wiki
+
+    def test_renamed_file_keeps_the_record_unchanged(self):
+        wiki = self.make_wiki({"Old.wav": "New.wav"})
+        record = make_record("Q10", "Old.wav")
+
+        self.assertEqual(wiki.execute_group([record]), [True])
+        # Shared with the other wikis, and looked for under this name in the outcomes
+        self.assertEqual(record.file, "Old.wav")
+        self.assertEqual(wiki.outcomes.saved, [("Q10", "Old.wav", outcomes.ADDED)])
+        self.assertIn("New.wav", wiki.api.requests[-1]["text"])
+
+    def test_deleted_file(self):
+        wiki = self.make_wiki({"Old.wav": None})
+        record = make_record("Q10", "Old.wav")
+
+        self.assertEqual(wiki.execute_group([record]), [False])
+        self.assertEqual(wiki.outcomes.saved, [("Q10", "Old.wav", outcomes.NO_FILE)])
+
+
+class FrWiktionaryTest(unittest.TestCase):
+
+    def test_places_of_previous_windows_are_kept(self):
+        wiki = setup_wiki(FrWiktionary.__new__(FrWiktionary), FakeApi("", []))
+        places = location_map.LocationMap({"Q90": "Q142", "Q456": "Q142"},
+                                          {"Q90": {"fr": "Paris"}, "Q142": {"fr": "France"}, "Q456": {"fr": "Lyon"}},
+                                          ["fr"])
+        languages = language_map.LanguageMap({"Q1": "fr"}, {}, [])
+        first, second = make_record("Q10", "A.wav"), make_record("Q11", "B.wav")
+        first.speaker_residence, second.speaker_residence = "Q90", "Q456"
+
+        with mock.patch("location_map._location_map", places), mock.patch("language_map.get", return_value=languages):
+            wiki.prepare([first])
+            previous = wiki.location_map
+            # With --concurrent, the next window is prepared while the first one is being executed
+            wiki.prepare([second])
+
+        self.assertEqual(previous, {"Q90": "Paris (France)", "Q456": "Lyon (France)"})
+        self.assertEqual(wiki.location_map, {"Q90": "Paris (France)", "Q456": "Lyon (France)"})
+
+
+class HeadingsTest(unittest.TestCase):
+
+    def test_offsets_are_in_bytes(self):
+        text = "é\n== A ==\nà\n== B ==\n"
+        self.assertEqual(get_heading_offsets(text), [3, 14])
+
+    def test_uncertain_headings(self):
+        self.assertFalse(has_uncertain_headings("== A ==\na <!-- <ref> -->"))
+        self.assertFalse(has_uncertain_headings("== A ==\n{{t|x=y\n|{{{1}}}}}\n<span>a</span>"))
+        self.assertTrue(has_uncertain_headings("== A ==\n{{t|\n== X ==\n}}"))
+        self.assertTrue(has_uncertain_headings("== A ==\n<REF name=a>r</ref>"))
+        self.assertTrue(has_uncertain_headings("== A ==\n<!--\n== X ==\n-->a<pre>\n</pre>"))
+
+
+if __name__ == "__main__":
+    unittest.main()
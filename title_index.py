@@ -0,0 +1,267 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+# License: GNU GPL v2+
+
+import base64
+import datetime
+import gzip
+import hashlib
+import math
+import time
+from typing import Iterable, Iterator, Optional
+
+import requests
+
+import cache
+import mirror
+
+# The recent changes are kept 30 days by MediaWiki: past that, the index cannot be caught up
+CACHE_TTL = 25 * 24 * 3600
+# Dumps older than that are not worth catching up, the recent changes may not go back far enough
+MAX_DUMP_AGE = 20 * 24 * 3600
+# The titles are listed at the beginning of a dump run, a few days before the file is published
+DUMP_MARGIN = 3 * 24 * 3600
+DUMP_URL = mirror.url("https://dumps.wikimedia.org/{dbname}/latest/{dbname}-latest-all-titles-in-ns0.gz")
+
+# Proportion of the missing pages still looked for on the wiki
+FALSE_POSITIVE_RATE = 0.01
+# Minimum number of seconds between two catch-ups with the recent changes
+REFRESH_INTERVAL = 60
+
+
+def normalize_title(title: str) -> str:
+    """
+    Normalize a title the way MediaWiki does on the wiktionaries, where the first letter is case-sensitive.
+    @param title: the title of a page, with spaces or underscores
+    @return:
+    """
+    return title.replace("_", " ").strip()
+
+
+def format_timestamp(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class BloomFilter:
+    """
+    A set of strings which takes about 10 bits per string, at the cost of a few false positives.
+    """
+
+    def __init__(self, size: int, hash_count: int, bits: Optional[bytearray] = None) -> None:
+        """
+        Constructor.
+        @param size: the number of bits of the filter
+        @param hash_count: the number of bits set for each string
+        @param bits: the bits of a filter previously built; None to start with an empty one
+        """
+        self.size = size
+        self.hash_count = hash_count
+        self.bits = bits if bits is not None else bytearray((size + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, false_positive_rate: float) -> "BloomFilter":
+        """
+        @param capacity: the number of strings the filter will hold
+        @param false_positive_rate: the expected proportion of false positives once the filter is full
+        @return: an empty filter of the optimal size
+        """
+        capacity = max(capacity, 1000)
+        size = math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)
+        hash_count = max(1, round(size / capacity * math.log(2)))
+        return cls(size, hash_count)
+
+    def __positions(self, item: str) -> Iterator[int]:
+        # Double hashing: the positions are derived from the two halves of a single digest
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (first + i * second) % self.size
+
+    def add(self, item: str) -> None:
+        for position in self.__positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.__positions(item))
+
+
+class TitleIndex:
+    """
+    Index of the titles of the pages in the main namespace of a wiki, so that the records
+    having no entry there can be left out without any request.
+
+    It is built by the refresh mode from the list of all the titles published with each dump
+    (or from a crawl of list=allpages when that list is too old), stored in the cache directory,
+    and then kept current with the page creations, moves and restorations read from the recent changes.
+    Until it is built, all the pages may exist.
+    """
+
+    def __init__(self, api, dbname: str) -> None:
+        """
+        Constructor.
+        @param api: the Pywiki instance of the wiki
+        @param dbname: the database name of the wiki (e.g. 'frwiktionary')
+        """
+        self.api = api
+        self.dbname = dbname
+        self.cache_name = f"title_index_{dbname}.json"
+        self.filter: Optional[BloomFilter] = None
+        # Timestamp from which the recent changes have not been read yet
+        self.since = None
+        self.checked_at = 0
+
+    def may_exist(self, title: str) -> bool:
+        """
+        @param title: the title of a page in the main namespace
+        @return: False if the page certainly does not exist; True otherwise
+        """
+        if self.filter is None:
+            return True
+        return normalize_title(title) in self.filter
+
+    def update(self) -> None:
+        """
+        Load the index, if it has been built, then add to it the pages created since its last update.
+        """
+        if time.time() - self.checked_at < REFRESH_INTERVAL:
+            return
+
+        if self.filter is None:
+            data = cache.load(self.cache_name, CACHE_TTL)
+            if data is None:
+                self.checked_at = time.time()
+                return
+            self.filter = BloomFilter(data["size"], data["hash_count"], bytearray(base64.b64decode(data["bits"])))
+            self.since = data["since"]
+
+        added = self.__catch_up()
+        self.checked_at = time.time()
+
+        # Read again from the same point by the next run otherwise, which is cheaper than rewriting the index
+        if added > 0:
+            self.__save()
+
+    def refresh(self) -> None:
+        """
+        Build the index again from the latest list of all the titles, which takes a while on the largest wikis.
+        """
+        self.__build()
+        self.__catch_up()
+        self.checked_at = time.time()
+        self.__save()
+
+    def __save(self) -> None:
+        cache.save(self.cache_name, {
+            "size": self.filter.size,
+            "hash_count": self.filter.hash_count,
+            "bits": base64.b64encode(self.filter.bits).decode("ascii"),
+            "since": self.since,
+        })
+
+    def __build(self) -> None:
+        print(f"{self.dbname}: building the index of the titles")
+        response = self.api.request(
+            {
+                "action": "query",
+                "format": "json",
+                "meta": "siteinfo",
+                "siprop": "statistics",
+            }
+        )
+        # All the pages of the wiki, which is more than enough for the main namespace
+        capacity = response["query"]["statistics"]["pages"]
+        self.filter = BloomFilter.for_capacity(capacity, FALSE_POSITIVE_RATE)
+
+        try:
+            self.__add_titles_from_dump()
+        except (requests.exceptions.RequestException, OSError, EOFError, ValueError) as e:
+            print(f"{self.dbname}: list of all the titles unusable ({e!r}), crawling them instead")
+            self.filter = BloomFilter.for_capacity(capacity, FALSE_POSITIVE_RATE)
+            self.__add_titles_from_allpages()
+
+    def __add_titles_from_dump(self) -> None:
+        response = self.api.session.get(DUMP_URL.format(dbname=self.dbname), stream=True, timeout=60)
+        response.raise_for_status()
+
+        published = datetime.datetime.strptime(
+            response.headers["Last-Modified"], "%a, %d %b %Y %H:%M:%S %Z"
+        ).replace(tzinfo=datetime.timezone.utc).timestamp()
+        if time.time() - published > MAX_DUMP_AGE:
+            response.close()
+            raise ValueError(f"dump published on {format_timestamp(published)}")
+
+        response.raw.decode_content = True
+        with gzip.open(response.raw, "rt", encoding="utf-8") as titles:
+            # The first line is the name of the column
+            next(titles, None)
+            self.__add_titles(titles)
+        self.since = format_timestamp(published - DUMP_MARGIN)
+
+    def __add_titles_from_allpages(self) -> None:
+        # The pages created during the crawl are caught up afterwards
+        self.since = format_timestamp(time.time())
+        continuation = {}
+        while True:
+            response = self.api.request(
+                {
+                    "action": "query",
+                    "format": "json",
+                    "formatversion": "2",
+                    "list": "allpages",
+                    "apnamespace": "0",
+                    "aplimit": "max",
+                    **continuation,
+                }
+            )
+            self.__add_titles(page["title"] for page in response["query"]["allpages"])
+
+            if "continue" not in response:
+                break
+            continuation = response["continue"]
+
+    def __catch_up(self) -> int:
+        """
+        Add to the index the pages created since its last update.
+        @return: the number of titles added
+        """
+        until = format_timestamp(time.time())
+        added = 0
+        continuation = {}
+        while True:
+            response = self.api.request(
+                {
+                    "action": "query",
+                    "format": "json",
+                    "formatversion": "2",
+                    "list": "recentchanges",
+                    "rcstart": self.since,
+                    "rcend": until,
+                    "rcdir": "newer",
+                    "rctype": "new|log",
+                    "rcprop": "title|loginfo",
+                    "rclimit": "max",
+                    **continuation,
+                }
+            )
+            for change in response["query"]["recentchanges"]:
+                if change["type"] == "new" and change["ns"] == 0:
+                    title = change["title"]
+                elif change.get("logtype") == "move" and change["logparams"].get("target_ns") == 0:
+                    title = change["logparams"]["target_title"]
+                elif change.get("logaction") == "restore" and change["ns"] == 0:
+                    title = change["title"]
+                else:
+                    continue
+                self.filter.add(normalize_title(title))
+                added += 1
+
+            if "continue" not in response:
+                break
+            continuation = response["continue"]
+        self.since = until
+        return added
+
+    def __add_titles(self, titles: Iterable[str]) -> None:
+        for title in titles:
+            self.filter.add(normalize_title(title))
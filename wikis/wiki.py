@@ -3,9 +3,15 @@
 # License: GNU GPL v2+
 
 import abc
-from typing import List
+import asyncio
+from typing import Awaitable, Iterable, List, Optional
 
+import asyncpywiki
+import metrics
+import mirror
+import outcomes
 import pywiki
+from outcomes import OutcomeStore
 from record import Record
 
 
@@ -16,6 +22,8 @@ class Wiki(abc.ABC):
     It MUST be inherited from by a subclass that will implement wiki-specific operations
     (such as Wiktionary for the Wiktionaries).
     """
+    # Name of the wiki, as used in the command line (e.g. 'frwiktionary')
+    dbname = None
 
     def __init__(self, username: str, password: str, wiki_family: str, language_domain: str, dry_run: bool) -> None:
         """
@@ -25,12 +33,96 @@ class Wiki(abc.ABC):
         @param wiki_family: The "family" of the wiki. This is the domain name of the wiki (e.g. 'wiktionary')
         @param language_domain: The "language" of the wiki (e.g. 'fr', 'en', etc.)
         """
-        self.api = pywiki.Pywiki(username, password, f"https://{language_domain}.{wiki_family}.org/w/api.php", "user", dry_run)
+        self.api = pywiki.Pywiki(username, password, mirror.url(f"https://{language_domain}.{wiki_family}.org/w/api.php"),
+                                 "user", dry_run)
+        # Same account, for the reads which can be sent at the same time
+        self.async_api = asyncpywiki.AsyncPywiki(username, password, self.api.api_endpoint, "user", dry_run)
         self.language_domain = language_domain
+        # Where the outcome of each execution is remembered, if anywhere
+        self.outcomes: Optional[OutcomeStore] = None
+        self.skipped = 0
+        # Number of records not executed, this wiki being unable to accept them
+        self.refused = 0
+        # Number of edits which conflicted with someone else's, and had to be done again
+        self.edit_conflicts = 0
 
     def prepare(self, records: List[Record]) -> List[Record]:
         return records
 
+    def refresh(self) -> None:
+        """
+        Fetch again the data about this wiki which are kept in cache between two runs.
+        """
+
+    def accepts(self, record: Record) -> bool:
+        """
+        Tell, without sending any request, whether the given record can be added to this wiki.
+        Called once the record has been prepared.
+        @param record: the record to check
+        @return: False if the record cannot be added in any case; True otherwise
+        """
+        return True
+
+    def accepted(self, records: List[Record]) -> List[Record]:
+        """
+        Filter out the records which this wiki cannot accept, before anything is fetched for them.
+        @param records: the records to execute
+        @return: the records which may be added to this wiki
+        """
+        accepted = [record for record in records if self.accepts(record)]
+        self.refused += len(records) - len(accepted)
+        metrics.count("records_refused_total", len(records) - len(accepted), wiki=self.dbname)
+        return accepted
+
+    def pending(self, records: List[Record]) -> List[Record]:
+        """
+        Filter out the records whose outcome on this wiki is already known.
+        @param records: the records to execute
+        @return: the records which still need to be executed
+        """
+        if self.outcomes is None:
+            return records
+
+        pending = [record for record in records
+                   if not self.outcomes.is_settled(self.dbname, record.id, record.file)]
+        self.skipped += len(records) - len(pending)
+        metrics.count("records_skipped_total", len(records) - len(pending), wiki=self.dbname)
+        return pending
+
+    def report(self, record: Record, outcome: str) -> bool:
+        """
+        Remember the outcome of the execution of the given record.
+        @param record: the executed record
+        @param outcome: what happened to the record, one of the constants of the outcomes module
+        @return: True if the record has been added; False otherwise
+        """
+        metrics.count("records_total", wiki=self.dbname, outcome=outcome)
+        if self.outcomes is not None and not self.api.dry_run:
+            self.outcomes.save(self.dbname, record.id, record.file, outcome)
+        return outcome == outcomes.ADDED
+
+    def prefetch(self, records: List[Record]) -> None:
+        """
+        Fetch ahead, in as few requests as possible, the data that execute() will need
+        for the given records. Called before executing each window of records.
+        @param records: the records that are about to be executed
+        """
+
+    def gather(self, coroutines: Iterable[Awaitable]) -> list:
+        """
+        Run the given coroutines, which send their requests through self.async_api, at the same time.
+        @param coroutines: the coroutines to run
+        @return: their results, in the same order
+        """
+        coroutines = list(coroutines)
+        if not coroutines:
+            return []
+        return asyncio.run(self.__gather(coroutines))
+
+    async def __gather(self, coroutines: List[Awaitable]) -> list:
+        async with self.async_api.connect():
+            return list(await asyncio.gather(*coroutines))
+
     @abc.abstractmethod
     def execute(self, record: Record) -> bool:
         """
@@ -39,3 +131,19 @@ class Wiki(abc.ABC):
         @return: True if the record has been added; False otherwise
         """
         return False
+
+    def group(self, records: List[Record]) -> List[List[Record]]:
+        """
+        Group the records which are added on the same page, to be executed together.
+        @param records: the records to execute
+        @return: the groups of records, in the order of the records
+        """
+        return [[record] for record in records]
+
+    def execute_group(self, records: List[Record]) -> List[bool]:
+        """
+        Add the given records, grouped by group(), on the relevant page of the project.
+        @param records: the records to add
+        @return: for each record, True if it has been added; False otherwise
+        """
+        return [self.execute(record) for record in records]
@@ -4,19 +4,20 @@
 import re
 import uuid
 from abc import ABC, abstractmethod
-from typing import List, Dict
+from typing import List, Dict, Optional, Set
 
+import metrics
+import outcomes
 from pywiki import NoSuchEntityException
 from record import Record
 from wikis.wiki import Wiki
 
-MAX_NUMBER_OF_IDS_PER_REQUEST = 50
-
 PRONUNCIATION_PROPERTY = "P443"
 LANG_PROPERTY = "P407"
 REFURL_PROPERTY = "P854"
 SUMMARY = "Add an audio pronunciation file from Lingua Libre"
 BRACKET_REGEX = re.compile(r" \([^(]+\)$")
+LEXEME_FORM_REGEX = re.compile(r"^L\d+-F\d+$")
 
 
 def remove_brackets(title):
@@ -24,6 +25,8 @@ def remove_brackets(title):
 
 
 class Wikibase(Wiki, ABC):
+    # Ids matching this pattern can be requested in bulk with wbgetentities
+    entity_id_pattern = re.compile(r"^Q\d+$")
 
     def __init__(self, username: str, password: str, dry_run: bool) -> None:
         """
@@ -32,29 +35,43 @@ class Wikibase(Wiki, ABC):
         @param password: Password to log into the account
         """
         super().__init__(username, password, "wikidata", "www", dry_run)
+        # Files already used in a pronunciation claim of each entity; None if the entity does not exist
+        self.claims: Dict[str, Optional[Set[str]]] = {}
+
+    # Records without any entity, once prepare() has looked for them, cannot be added
+    def accepts(self, record: Record) -> bool:
+        return self._get_entity_id(record) is not None
 
     def execute(self, record: Record) -> bool:
         entity_id = self._get_entity_id(record)
 
         if entity_id is None:
-            return False
+            return self.report(record, outcomes.NO_ENTITY)
 
         if not self._is_entity_id_valid(entity_id):
-            return False
+            return self.report(record, outcomes.UNSUPPORTED)
 
         try:
-            if self.__is_already_present(entity_id, record.file):
-                print(f'{record.id}: already on Wikidata')
-                return False
+            with metrics.timer("execute_phase_seconds", wiki=self.dbname, phase="fetch"):
+                present = self.__is_already_present(entity_id, record.file)
         except NoSuchEntityException:
             print(f'{record.id}: no such entity')
-            return False
+            return self.report(record, outcomes.NO_ENTITY)
+
+        if present:
+            print(f'{record.id}: already on Wikidata')
+            return self.report(record, outcomes.ALREADY_PRESENT)
 
-        result = self.__do_edit(record)
+        with metrics.timer("execute_phase_seconds", wiki=self.dbname, phase="save"):
+            result = self.__do_edit(record)
+
+        if result and self.claims.get(entity_id) is not None:
+            self.claims[entity_id].add(record.file)
 
         if result:
             print(f"{record.id}: added to Wikidata - "
                   f"https://www.wikidata.org/wiki/{self._format_link_for_summary(entity_id)}")
+            return self.report(record, outcomes.ADDED)
 
         return result
 
@@ -84,6 +101,48 @@ class Wikibase(Wiki, ABC):
         @return: a formatted representation of the link
         """
 
+    def _prefetch_claims(self, records: List[Record]) -> None:
+        """
+        Fetch the pronunciation claims of the entities of all the given records,
+        as many entities per request as the account is allowed to.
+        @param records: the records whose entities are fetched
+        """
+        entity_ids = sorted({
+            self._get_entity_id(record) for record in records
+            if self._get_entity_id(record) is not None
+            and self.entity_id_pattern.match(self._get_entity_id(record))
+        })
+
+        # The batches are sent at the same time, within the read rate of the wiki
+        self.gather(
+            self.__fetch_claims(entity_ids[i:i + self.api.batch_size])
+            for i in range(0, len(entity_ids), self.api.batch_size)
+        )
+
+    async def __fetch_claims(self, entity_ids: List[str]) -> None:
+        try:
+            response = await self.async_api.request(
+                {
+                    "action": "wbgetentities",
+                    "format": "json",
+                    "ids": "|".join(entity_ids),
+                    "props": "claims",
+                }
+            )
+        except NoSuchEntityException:
+            # Those entities will be checked one by one in execute()
+            return
+
+        for entity_id, entity in response.get("entities", {}).items():
+            if "missing" in entity:
+                self.claims[entity_id] = None
+                continue
+
+            claims = entity.get("claims", {}).get(PRONUNCIATION_PROPERTY, [])
+            self.claims[entity_id] = {
+                claim["mainsnak"]["datavalue"]["value"] for claim in claims if "datavalue" in claim["mainsnak"]
+            }
+
     def __is_already_present(self, entity_id: str, filename: str) -> bool:
         """
         Checks if the given file is already on the page of the given entity.
@@ -91,6 +150,11 @@ class Wikibase(Wiki, ABC):
         @param filename: the name of the file to check
         @return: True if the file is already on the page; False otherwise
         """
+        if entity_id in self.claims:
+            if self.claims[entity_id] is None:
+                raise NoSuchEntityException()
+            return filename in self.claims[entity_id]
+
         response = self.api.request(
             {
                 "action": "wbgetclaims",
@@ -150,10 +214,12 @@ class Wikibase(Wiki, ABC):
 
 
 class Wikidata(Wikibase):
+    dbname = "wikidatawiki"
 
     def prepare(self, records: List[Record]) -> List[Record]:
         self.__resolve_redirects(records)
         self.__add_qid_from_sitelinks(records)
+        self._prefetch_claims(records)
         return records
 
     def __resolve_redirects(self, records: List[Record]) -> None:
@@ -163,9 +229,9 @@ class Wikidata(Wikibase):
         while qids:
             redirects = {
                 **redirects,
-                **self.__search_redirects(qids[:MAX_NUMBER_OF_IDS_PER_REQUEST])
+                **self.__search_redirects(qids[:self.api.batch_size])
             }
-            qids = qids[MAX_NUMBER_OF_IDS_PER_REQUEST:]
+            qids = qids[self.api.batch_size:]
 
         for record in records:
             if record.links["wikidata"] is None:
@@ -211,9 +277,9 @@ class Wikidata(Wikibase):
             while len(links[lang]) > 0:
                 connections = {
                     **connections,
-                    **self.__get_ids_from_titles(lang + "wiki", links[lang][:MAX_NUMBER_OF_IDS_PER_REQUEST], lang),
+                    **self.__get_ids_from_titles(lang + "wiki", links[lang][:self.api.batch_size], lang),
                 }
-                links[lang] = links[lang][MAX_NUMBER_OF_IDS_PER_REQUEST:]
+                links[lang] = links[lang][self.api.batch_size:]
         for record in records:
             if record.links["wikidata"] is not None or record.links["wikipedia"] is None:
                 continue
@@ -222,7 +288,7 @@ class Wikidata(Wikibase):
 
     def __get_ids_from_titles(self, dbname: str, titles, lang):
         """
-        Try to find the corresponding Wikidata ids of titles (50 max),
+        Try to find the corresponding Wikidata ids of titles (50 max, 500 with apihighlimits),
         given the wiki they belong and their language code
         @param dbname:
         @param titles:
@@ -270,7 +336,8 @@ class Wikidata(Wikibase):
 
     def _build_qualifiers(self, record: Record) -> str:
         return (
-                LANG_PROPERTY
+                '"'
+                + LANG_PROPERTY
                 + '":[{"snaktype":"value","property":"'
                 + LANG_PROPERTY
                 + '","datavalue":{"type":"wikibase-entityid","value":{"id":"'
@@ -283,12 +350,18 @@ class Wikidata(Wikibase):
 
 
 class Lexeme(Wikibase):
+    dbname = "lexemes"
+    entity_id_pattern = LEXEME_FORM_REGEX
+
+    def prepare(self, records: List[Record]) -> List[Record]:
+        self._prefetch_claims(records)
+        return records
 
     def _get_entity_id(self, record: Record) -> str:
         return record.links["lexeme"]
 
     def _is_entity_id_valid(self, entity_id: str) -> bool:
-        if not re.match(r"^L\d+-F\d+$", entity_id):
+        if not LEXEME_FORM_REGEX.match(entity_id):
             print(f'{entity_id} is not a valid lexeme form id')
             return False
 
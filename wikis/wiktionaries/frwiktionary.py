@@ -3,15 +3,14 @@
 # License: GNU GPL v2+
 
 import re
-from typing import List
+from typing import List, Optional, Tuple
 
-import wikitextparser as wtp
-
-import sparql
-from sparql import SPARQL_ENDPOINT
+import language_map
+import location_map
+import outcomes
 
 from record import Record
-from wikis.wiktionary import Wiktionary, replace_apostrophe, safe_append_text, get_locations_from_records
+from wikis.wiktionary import Wiktionary, find_section, replace_apostrophe, safe_append_text
 
 SUMMARY = "Ajout d'un fichier audio de prononciation depuis [[Lingua Libre]]"
 
@@ -30,15 +29,8 @@ FOLLOWING_SECTIONS = [
     "{{s|réf}}",
 ]
 
-LANGUAGE_QUERY = "SELECT ?item ?code WHERE { ?item wdt:P305 ?code. }"
-LOCATION_QUERY = """
-SELECT ?location ?locationLabel ?countryLabel
-WHERE {
-  ?location wdt:P17 ?country.
-  SERVICE wikibase:label { bd:serviceParam wikibase:language "fr,en" . }
-  VALUES ?location { wd:$1 }
-}
-"""
+# Languages of the labels of the places, by order of preference
+LOCATION_LANGUAGES = ("fr", "en")
 
 BOTTOM_REGEX = re.compile(
     r"(?:\s*(?:\[\[(?:Category|Catégorie):[^]]+]]|{{clé de tri\|[^}]+}})?)*$",
@@ -47,6 +39,7 @@ BOTTOM_REGEX = re.compile(
 
 
 class FrWiktionary(Wiktionary):
+    dbname = "frwiktionary"
 
     def __init__(self, username: str, password: str, dry_run: bool) -> None:
         """
@@ -55,6 +48,7 @@ class FrWiktionary(Wiktionary):
         @param password: Password to log into the account
         """
         super().__init__(username, password, "fr", SUMMARY, dry_run)
+        location_map.require_labels(LOCATION_LANGUAGES)
 
     """
     Public methods
@@ -65,51 +59,45 @@ class FrWiktionary(Wiktionary):
     # - Get the labels of the speaker's location in French
     def prepare(self, records: List[Record]) -> List[Record]:
         # Get BCP 47 language code map
-        self.language_code_map = {}
-        raw_language_code_map = sparql.request(SPARQL_ENDPOINT, LANGUAGE_QUERY)
-
-        for line in raw_language_code_map:
-            self.language_code_map[
-                sparql.format_value(line, "item")
-            ] = sparql.format_value(line, "code")
-
-        raw_location_map = get_locations_from_records(LOCATION_QUERY, records)
-
-        self.location_map = {}
-        for line in raw_location_map:
-            country = sparql.format_value(line, "countryLabel")
-            location = sparql.format_value(line, "locationLabel")
+        self.language_code_map = language_map.get().codes
+        # Only the records of these languages can have a language section on this wiki
+        self.languages = set(self.language_code_map)
+
+        locations = location_map.resolve([record for record in records if self.accepts(record)])
+
+        # Built apart, then swapped in at once: with --concurrent, the records of the previous windows
+        # are still being executed with it, and all the places resolved so far are in the new one
+        labels = {}
+        for location_qid, country_qid in locations.items():
+            country = locations.label(country_qid, LOCATION_LANGUAGES)
+            location = locations.label(location_qid, LOCATION_LANGUAGES)
             if country == location:
-                self.location_map[sparql.format_value(line, "location")] = country
+                labels[location_qid] = country
             else:
-                self.location_map[sparql.format_value(line, "location")] = f"{location} ({country})"
+                labels[location_qid] = f"{location} ({country})"
+        self.location_map = labels
 
         return records
 
-    # Try to use the given record on the French Wiktionary
-    def execute(self, record: Record) -> bool:
-        # Normalize the record using frwiktionary's titles conventions
-        transcription = replace_apostrophe(record.transcription)
+    # Normalize the record using frwiktionary's titles conventions
+    def entry_title(self, record: Record) -> str:
+        return replace_apostrophe(record.transcription)
 
-        # Fetch the content of the page having the transcription for title
-        is_already_present, wikicode, basetimestamp = self.get_entry(transcription, record.file)
+    # Add the given record to the content of its entry on the French Wiktionary
+    def _apply(self, record: Record, text: str) -> Tuple[Optional[str], str]:
+        transcription = self.entry_title(record)
 
-        # Whether there is no entry for this record on frwiktionary
-        if not wikicode:
-            return False
-
-        # Whether the record is already inside the entry
-        if is_already_present:
-            print(f'{record.id}//{transcription}: already on frwiktionary')
-            return False
-
-        # Try to extract the section of the language of the record
-        language_section = self.__get_language_section(wikicode, record.language["qid"])
+        # Try to locate the section of the language of the record
+        span = self.__find_language_section(text, record.language["qid"])
 
         # Whether there is no section for the current language
-        if language_section is None:
+        if span is None:
             print(f'{record.id}//{transcription}: language section not found')
-            return False
+            return None, outcomes.NO_SECTION
+
+        # Only this section is parsed
+        start, end = span
+        language_section = self._parse(text[start:end])
 
         # Try to extract the pronunciation subsection
         pronunciation_section = self.__get_pronunciation_section(language_section)
@@ -143,40 +131,19 @@ class FrWiktionary(Wiktionary):
             language_level
         )
 
-        # Save the result
-        result = False
-        try:
-            result = self.do_edit(transcription, wikicode, basetimestamp)
-        except Exception as e:
-            if "editconflict" in str(e):
-                self.execute(record)
-            else:
-                raise e
-        if result:
-            print(
-                f'{record.id}//{transcription}: added to frwiktionary - https://fr.wiktionary.org/wiki/{transcription}')
-
-        return result
+        # Put the edited section back into the page
+        return text[:start] + self._serialize(language_section) + text[end:], outcomes.ADDED
 
-    # Try to extract the language section
-    def __get_language_section(self, wikicode, language_qid):
+    # Try to locate the language section
+    def __find_language_section(self, text, language_qid):
         # Check if the record's language has a BCP 47 code, stop here if not
         if language_qid not in self.language_code_map:
             return None
 
         lang = self.language_code_map[language_qid]
 
-        # Travel across each sections titles to find the one we want
-        for section in wikicode.sections:
-            if section.title is None:
-                continue
-
-            if section.title.replace(" ", "").lower() == "{{langue|" + lang + "}}":
-                return section
-
-                # If we arrive here, it means that there is no section for
-                # the record's language
-        return None
+        # Scan the section titles to find the one we want
+        return find_section(text, lambda title: title.replace(" ", "").lower() == "{{langue|" + lang + "}}")
 
     # Try to extract the pronunciation subsection
     def __get_pronunciation_section(self, wikicode):
@@ -213,7 +180,7 @@ class FrWiktionary(Wiktionary):
 
     # Add the audio template to the pronunciation section
     def __append_file(self, wikicode, filename, language_qid, location_qid, language_level):
-        section_content = wtp.parse(wikicode.sections[1].contents)
+        section_content = self._parse(wikicode.sections[1].contents)
 
         location = ""
         if location_qid in self.location_map:
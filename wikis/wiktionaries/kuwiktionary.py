@@ -8,15 +8,14 @@
 # page contenant déjà une section « pron » : gûz (Q379244)
 
 import re
-from typing import List
+from typing import List, Optional, Tuple
 
-import wikitextparser as wtp
-
-import sparql
-from sparql import SPARQL_ENDPOINT
+import language_map
+import location_map
+import outcomes
 
 from record import Record
-from wikis.wiktionary import Wiktionary, safe_append_text, get_locations_from_records, get_pronunciation_section
+from wikis.wiktionary import Wiktionary, find_section, safe_append_text, get_pronunciation_section
 
 PRONUNCIATION_SECTION_NAME = "bilêvkirin"
 
@@ -26,18 +25,12 @@ SUMMARY = "Dengê bilêvkirinê ji Lingua Libre lê hat zêdekirin"
 EMPTY_PRONUNCIATION_SECTION = "=== Bilêvkirin ===\n$1"
 PRONUNCIATION_LINE = "\n* {{deng|$2|$1|Deng|dever=$3}}\n"
 
-LANGUAGE_QUERY = "SELECT ?item ?code WHERE { ?item wdt:P305 ?code. }"
-LOCATION_QUERY = """
-SELECT ?location ?locationLabel ?countryLabel
-WHERE {
-  ?location wdt:P17 ?country.
-  SERVICE wikibase:label { bd:serviceParam wikibase:language "ku,en" . }
-  VALUES ?location { wd:$1 }
-}
-"""
+# Languages of the labels of the places, by order of preference
+LOCATION_LANGUAGES = ("ku", "en")
 
 
 class KuWiktionary(Wiktionary):
+    dbname = "kuwiktionary"
 
     def __init__(self, username: str, password: str, dry_run: bool) -> None:
         """
@@ -46,6 +39,7 @@ class KuWiktionary(Wiktionary):
         @param password: Password to log into the account
         """
         super().__init__(username, password, "ku", SUMMARY, dry_run)
+        location_map.require_labels(LOCATION_LANGUAGES)
 
     """
     Public methods
@@ -57,51 +51,41 @@ class KuWiktionary(Wiktionary):
     def prepare(self, records: List[Record]) -> List[Record]:
 
         # Get BCP 47 language code map
-        self.language_code_map = {}
-        raw_language_code_map = sparql.request(SPARQL_ENDPOINT, LANGUAGE_QUERY)
-
-        for line in raw_language_code_map:
-            self.language_code_map[
-                sparql.format_value(line, "item")
-            ] = sparql.format_value(line, "code")
-
-        raw_location_map = get_locations_from_records(LOCATION_QUERY, records)
-
-        self.location_map = {}
-        self.location_map_with_country = {}
-        for line in raw_location_map:
-            country = sparql.format_value(line, "countryLabel")
-            location = sparql.format_value(line, "locationLabel")
-            self.location_map[sparql.format_value(line, "location")] = location
-            self.location_map_with_country[sparql.format_value(line, "location")] = country
+        self.language_code_map = language_map.get().codes
+        # Only the records of these languages can have a language section on this wiki
+        self.languages = set(self.language_code_map)
+
+        locations = location_map.resolve([record for record in records if self.accepts(record)])
+
+        # Swapped in at once, as in FrWiktionary.prepare
+        labels = {}
+        labels_with_country = {}
+        for location_qid, country_qid in locations.items():
+            country = locations.label(country_qid, LOCATION_LANGUAGES)
+            location = locations.label(location_qid, LOCATION_LANGUAGES)
+            labels[location_qid] = location
+            labels_with_country[location_qid] = country
             if country != location:
-                self.location_map_with_country[sparql.format_value(line, "location")] += f" ({location})"
+                labels_with_country[location_qid] += f" ({location})"
+        self.location_map, self.location_map_with_country = labels, labels_with_country
 
         return records
 
-    # Try to use the given record on the Kurdish Wiktionary
-    def execute(self, record: Record) -> bool:
+    # Add the given record to the content of its entry on the Kurdish Wiktionary
+    def _apply(self, record: Record, text: str) -> Tuple[Optional[str], str]:
         transcription = record.transcription
 
-        # Fetch the content of the page having the transcription for title
-        (is_already_present, wikicode, basetimestamp) = self.get_entry(transcription, record.file)
-
-        # Whether there is no entry for this record on kuwiktionary
-        if not wikicode:
-            return False
-
-        # Whether the record is already inside the entry
-        if is_already_present:
-            print(f'{record.id}//{transcription}: already on kuwiktionary')
-            return False
-
-        # Try to extract the section of the language of the record
-        language_section = self.__get_language_section(wikicode, record.language["qid"])
+        # Try to locate the section of the language of the record
+        span = self.__find_language_section(text, record.language["qid"])
 
         # Whether there is no section for the current language
-        if language_section is None:
+        if span is None:
             print(f'{record.id}//{transcription}: language section not found')
-            return False
+            return None, outcomes.NO_SECTION
+
+        # Only this section is parsed
+        start, end = span
+        language_section = self._parse(text[start:end])
 
         # Try to extract the pronunciation subsection
         pronunciation_section = get_pronunciation_section(language_section, PRONUNCIATION_SECTION_NAME)
@@ -123,42 +107,19 @@ class KuWiktionary(Wiktionary):
             location
         )
 
-        # Save the result
-        result = False
-        try:
-            result = self.do_edit(transcription, wikicode, basetimestamp)
-        except Exception as e:
-            # If we got an editconflict, just restart from the beginning
-            if "editconflict" in str(e):
-                self.execute(record)
-            else:
-                raise e
-
-        if result:
-            print(
-                f'{record.id}//{transcription}: added to kuwiktionary - https://ku.wiktionary.org/wiki/{transcription}')
-
-        return result
-
-    # Try to extract the language section
-    def __get_language_section(self, wikicode, language_qid):
+        # Put the edited section back into the page
+        return text[:start] + self._serialize(language_section) + text[end:], outcomes.ADDED
+
+    # Try to locate the language section
+    def __find_language_section(self, text, language_qid):
         # Check if the record's language has a BCP 47 code, stop here if not
         if language_qid not in self.language_code_map:
             return None
 
         lang = self.language_code_map[language_qid]
 
-        # Travel across each sections titles to find the one we want
-        for section in wikicode.sections:
-            if section.title is None:
-                continue
-
-            if section.title.replace(" ", "").lower() == "{{ziman|" + lang + "}}":
-                return section
-
-        # If we arrive here, it means that there is no section for
-        # the record's language
-        return None
+        # Scan the section titles to find the one we want
+        return find_section(text, lambda title: title.replace(" ", "").lower() == "{{ziman|" + lang + "}}")
 
     # Create a pronunciation subsection
     def __create_pronunciation_section(self, wikicode):
@@ -179,7 +140,7 @@ class KuWiktionary(Wiktionary):
 
         # Add a new line before the pronunciation section only
         # if there is no other section
-        section_content = wtp.parse(wikicode.sections[1].contents)
+        section_content = self._parse(wikicode.sections[1].contents)
         new_section = EMPTY_PRONUNCIATION_SECTION
         if len(section_content.sections) < 2:
             new_section = new_section.replace("=== Bilêvkirin", "\n=== Bilêvkirin")
@@ -193,7 +154,7 @@ class KuWiktionary(Wiktionary):
 
     # Add the audio template to the pronunciation section
     def __append_file(self, wikicode, filename, language_qid, location_qid):
-        section_content = wtp.parse(wikicode.sections[1].contents)
+        section_content = self._parse(wikicode.sections[1].contents)
 
         location = ""
         if (language_qid == "Q36368" and  # Kurdish language on Wikidata
@@ -3,12 +3,13 @@
 # License: GNU GPL v2+
 
 import re
+from typing import Optional, Tuple
 
-import wikitextparser as wtp
-
-import sparql
-from sparql import SPARQL_ENDPOINT
-from wikis.wiktionary import Wiktionary, replace_apostrophe, get_locations_from_records
+import language_map
+import location_map
+import outcomes
+from record import Record
+from wikis.wiktionary import Wiktionary, replace_apostrophe
 
 SUMMARY = "Ajust d'un fichèr audiò de prononciacion de Lingua Libre estant"
 
@@ -27,21 +28,10 @@ FOLLOWING_SECTIONS = [
     "{{s|referéncias}}",
 ]
 
-LANGUAGE_QUERY = """
-SELECT ?item ?code ?itemLabel
-WHERE {
-    ?item wdt:P305 ?code.
-      SERVICE wikibase:label { bd:serviceParam wikibase:language "oc, en" . }
-}
-"""
-LOCATION_QUERY = """
-SELECT ?location ?locationLabel ?countryLabel
-WHERE {
-  ?location wdt:P17 ?country.
-  SERVICE wikibase:label { bd:serviceParam wikibase:language "oc, en" . }
-  VALUES ?location { wd:$1 }
-}
-"""
+# Languages of the labels of the languages, by order of preference
+LABEL_LANGUAGES = ("oc", "en")
+# Languages of the labels of the places, by order of preference
+LOCATION_LANGUAGES = ("oc", "en")
 
 BOTTOM_REGEX = re.compile(
     r"(?:\s*(?:\[\[(?:Category|Categoria):[^]]+]]|{{clé de tri\|[^}]+}})?)*$",
@@ -50,6 +40,7 @@ BOTTOM_REGEX = re.compile(
 
 
 class OcWiktionary(Wiktionary):
+    dbname = "ocwiktionary"
 
     def __init__(self, username: str, password: str, dry_run: bool) -> None:
         """
@@ -58,6 +49,8 @@ class OcWiktionary(Wiktionary):
         @param password: Password to log into the account
         """
         super().__init__(username, password, "oc", SUMMARY, dry_run)
+        location_map.require_labels(LOCATION_LANGUAGES)
+        language_map.require_labels(LABEL_LANGUAGES)
 
     """
     Public methods
@@ -68,49 +61,27 @@ class OcWiktionary(Wiktionary):
     # - Get the labels of the speaker's location in French
     def prepare(self, records):
         # Get BCP 47 language code map
-        self.language_code_map = {}
-        self.language_label_map = {}
-        raw_language_code_map = sparql.request(SPARQL_ENDPOINT, LANGUAGE_QUERY)
-
-        for line in raw_language_code_map:
-            self.language_code_map[
-                sparql.format_value(line, "item")
-            ] = sparql.format_value(line, "code")
-            self.language_label_map[
-                sparql.format_value(line, "item")
-            ] = sparql.format_value(line, "itemLabel")
-
-        raw_location_map = get_locations_from_records(LOCATION_QUERY, records)
-
-        self.location_map = {}
-        for line in raw_location_map:
-            country = sparql.format_value(line, "countryLabel")
-            location = sparql.format_value(line, "locationLabel")
-            self.location_map[sparql.format_value(line, "location")] = country
-            if country != location:
-                self.location_map[sparql.format_value(line, "location")] += f" ({location})"
-
-        return records
+        languages = language_map.get()
+        self.language_code_map = languages.codes
+        self.language_label_map = {qid: languages.label(qid, LABEL_LANGUAGES) for qid in languages.codes}
+        # Only the records of these languages can have a language section on this wiki
+        self.languages = set(self.language_code_map)
 
-    def execute(self, record):
-        transcription = replace_apostrophe(record.transcription)
+        self.locations = location_map.resolve([record for record in records if self.accepts(record)])
 
-        # Fetch the content of the page having the transcription for title
-        (is_already_present, wikicode, basetimestamp) = self.get_entry(transcription, record.file)
-
-        # Whether there is no entry for this record on ocwiktionary
-        if not wikicode:
-            return False
+        return records
 
-        # Whether the record is already inside the entry
-        if is_already_present:
-            print(f'{record.id}: already on ocwiktionary')
-            return False
+    # Normalize the record using ocwiktionary's titles conventions
+    def entry_title(self, record):
+        return replace_apostrophe(record.transcription)
 
+    # Add the given record to the content of its entry on the Occitan Wiktionary,
+    # which is edited with regular expressions, without parsing it
+    def _apply(self, record: Record, wikicode: str) -> Tuple[Optional[str], str]:
         # Check if the record's language has a BCP 47 code, stop here if not
         if record.language["qid"] not in self.language_code_map:
             print(f'{record.id}: language code not found')
-            return False
+            return None, outcomes.UNSUPPORTED
 
         lang = self.language_code_map[record.language["qid"]]
 
@@ -126,7 +97,7 @@ class OcWiktionary(Wiktionary):
             # Whether there is no section for the current language
         if "{=" + lang + "=}" not in wikicode:
             print(f'{record.id}: language section not found')
-            return False
+            return None, outcomes.NO_SECTION
 
         motif = ""
         stringlg = "{=" + lang + "=}"
@@ -156,14 +127,11 @@ class OcWiktionary(Wiktionary):
 
         loccode = ""
         if learning_or_residence:
+            country_qid = self.locations.country(learning_or_residence)
 
-            self.location_map = {}
-            raw_location_map = sparql.request(SPARQL_ENDPOINT,
-                                              LOCATION_QUERY.replace("$1", f" wd:{learning_or_residence}"))
-
-            if len(raw_location_map) > 0:
-                country = sparql.format_value(raw_location_map[0], "countryLabel")
-                location = sparql.format_value(raw_location_map[0], "locationLabel")
+            if country_qid is not None:
+                country = self.locations.label(country_qid, LOCATION_LANGUAGES)
+                location = self.locations.label(learning_or_residence, LOCATION_LANGUAGES)
 
                 if country:
                     loccode = country
@@ -191,16 +159,4 @@ class OcWiktionary(Wiktionary):
             str(wikicode),
         )
 
-        # Save the result
-        result = False
-        try:
-            result = self.do_edit(transcription, wtp.parse(wikicode), basetimestamp)
-        except Exception as e:
-            if "editconflict" in str(e):
-                self.execute(record)
-            else:
-                raise e
-        if result:
-            print(f'{record.id}: added to ocwiktionary - https://oc.wiktionary.org/wiki/{transcription}')
-
-        return result
+        return wikicode, outcomes.ADDED
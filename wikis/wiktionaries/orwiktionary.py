@@ -3,17 +3,15 @@
 # License: GNU GPL v2+
 
 import re
-from typing import List
+from typing import List, Optional, Tuple
 
-import wikitextparser as wtp
-
-import sparql
-from sparql import SPARQL_ENDPOINT
+import commons
+import language_map
+import outcomes
 
 from record import Record
 
-import pywiki
-from wikis.wiktionary import Wiktionary, safe_append_text
+from wikis.wiktionary import Wiktionary, find_section, safe_append_text
 
 SUMMARY = "ଲିଙ୍ଗୁଆ ଲିବ୍ରେରୁ ଏକ ଉଚ୍ଚାରଣ ଅଡ଼ିଓ ଯୋଡ଼ିଲି"
 
@@ -28,13 +26,8 @@ FOLLOWING_SECTIONS = [
     "===ଅର୍ଥ===",
 ]
 
-LANGUAGE_QUERY = """
-SELECT ?item ?code ?itemLabel
-WHERE {
-    ?item wdt:P305 ?code.
-      SERVICE wikibase:label { bd:serviceParam wikibase:language "or, en" . }
-}
-"""
+# Languages of the labels of the languages, by order of preference
+LABEL_LANGUAGES = ("or", "en")
 
 BOTTOM_REGEX = re.compile(
     r"(?:\s*(?:\[\[(?:Category|ଶ୍ରେଣୀ):[^\]]+\]\])?)*$",
@@ -43,6 +36,7 @@ BOTTOM_REGEX = re.compile(
 
 
 class OrWiktionary(Wiktionary):
+    dbname = "orwiktionary"
 
     def __init__(self, username: str, password: str, dry_run: bool) -> None:
         """
@@ -56,8 +50,8 @@ class OrWiktionary(Wiktionary):
             Password to log into the account.
         """
         super().__init__(username, password, "or", SUMMARY, dry_run)
-        self.username = username
-        self.password = password
+        language_map.require_labels(LABEL_LANGUAGES)
+        self.commons = commons.get(username, password)
 
     """
     Public methods
@@ -67,110 +61,53 @@ class OrWiktionary(Wiktionary):
     # - Fetch the needed language code map (Qid -> BCP 47, used by orwiktionary)
     def prepare(self, records: List[Record]) -> List[Record]:
         # Get BCP 47 language code map
-        self.language_code_map = {}
-        self.language_label_map = {}
-        raw_language_code_map = sparql.request(SPARQL_ENDPOINT, LANGUAGE_QUERY)
-
-        for line in raw_language_code_map:
-            self.language_code_map[
-                sparql.format_value(line, "item")
-            ] = sparql.format_value(line, "code")
-            self.language_label_map[
-                sparql.format_value(line, "item")
-            ] = sparql.format_value(line, "itemLabel")
+        languages = language_map.get()
+        self.language_code_map = languages.codes
+        self.language_label_map = {qid: languages.label(qid, LABEL_LANGUAGES) for qid in languages.codes}
+        # Only the records of these languages can have a language section on this wiki
+        self.languages = set(self.language_code_map)
 
         return records
 
-    # Check if the file always exists on Wikimedia Commons
-    # under its original filename (the one know by Lingua Libre
+    # Check at once whether the files still exist on Wikimedia Commons
+    # under their original filename (the one know by Lingua Libre
     # wikibase). It may be different because several files have
     # been renamed in the past
-    def new_filename_on_Commons(self, filename: str) -> str:
-        commons_api = pywiki.Pywiki(self.username, self.password, f"https://commons.wikimedia.org/w/api.php", "user", False)
-        response = commons_api.request(
-            {
-                "action": "query",
-                "format": "json",
-                "formatversion": "2",
-                "letitle": "File:" + filename,
-                "list": "logevents",
-                "letype": "move",
-            }
-        )
+    def prefetch(self, records: List[Record]) -> None:
+        self.commons.resolve(record.file for record in records)
+        super().prefetch(records)
 
-        if not response["query"]["logevents"]:
-            return None
-        
-        page = response["query"]["logevents"][0]
-        #print(f"new_filename_on_commons: {page}")
-        if "params" not in page:
-            #print(f"Pas de 'params' dans {response}")
-            return None
+    # The file is added under its current name on Commons, while the outcome
+    # of the record is still kept under the name known by Lingua Libre
+    def file_name(self, record: Record) -> str:
+        return self.commons.current_name(record.file) or record.file
 
-        filename = page["params"]["target_title"]
-        if filename.startswith("File:"):
-            filename = filename[5:]
-        return filename
-        
-        return None
-    
-    def exists_on_commons(self, filename: str) -> bool:            
-        commons_api = pywiki.Pywiki(self.username, self.password, f"https://commons.wikimedia.org/w/api.php", "user", False)
-        response = commons_api.request(
-            {
-                "action": "query",
-                "format": "json",
-                "formatversion": "2",
-                "titles": "File:" + filename,
-            }
-        )
+    # Check if the file of the given record still exists on Commons, possibly under a new name
+    def _check(self, record: Record) -> Optional[str]:
+        print(f"Treating {record.transcription}")
 
-        page = response["query"]["pages"][0]
-        #print(f"{page}")
-
-        # If no pages have been found on Wikimedia Commons for the given title
-        if "missing" in page:
-            return False
-        
-        return True
-
-    # Try to use the given record on the Odia Wiktionary
-    def execute(self, record: Record) -> bool:
-        transcription = record.transcription
-        print(f"Treating {transcription}")
-
-        new_name = self.new_filename_on_Commons(record.file)
-        if new_name:
-            record.file = new_name
-        
-        # Check if file exists on Commons
-        if not self.exists_on_commons(record.file):
+        if self.commons.current_name(record.file) is None:
             print(f"{record.file} does not exists anymore on Wikimedia Commons. Maybe moved!")
-            return False
-
-        # Fetch the content of the page having the transcription for title
-        (is_already_present, wikicode, basetimestamp) = self.get_entry(
-            transcription, record.file
-        )
-
-        # Whether there is no entry for this record on orwiktionary
-        if not wikicode:
-            return False
+            return outcomes.NO_FILE
+        return None
 
-        # Whether the record is already inside the entry
-        if is_already_present:
-            print(f"{record.id}: already on orwiktionary")
-            return False
+    # Add the given record to the content of its entry on the Odia Wiktionary
+    def _apply(self, record: Record, text: str) -> Tuple[Optional[str], str]:
+        transcription = record.transcription
 
-        # Try to extract the section of the language of the record
-        language_section = self.__get_language_section(
-            wikicode, record.language["qid"]
+        # Try to locate the section of the language of the record
+        span = self.__find_language_section(
+            text, record.language["qid"]
         )
 
         # Whether there is no section for the current language
-        if language_section is None:
+        if span is None:
             print(f"{record.id}//{transcription}: language section not found")
-            return False
+            return None, outcomes.NO_SECTION
+
+        # Only this section is parsed
+        start, end = span
+        language_section = self._parse(text[start:end])
 
         # Try to extract the pronunciation subsection
         pronunciation_section = self.get_pronunciation_section(language_section)
@@ -182,55 +119,32 @@ class OrWiktionary(Wiktionary):
         # Add the pronunciation file to the pronunciation section
         self.__append_file(
             pronunciation_section,
-            record.file,
+            self.file_name(record),
             record.language["qid"],
         )
 
-        # Save the result
-        result = False
-        try:
-            result = self.do_edit(transcription, wikicode, basetimestamp)
-        except Exception as e:
-            # If we got an editconflict, just restart from the beginning
-            if "editconflict" in str(e):
-                self.execute(record)
-            else:
-                raise e
-
-        if result:
-            print(
-                record.id
-                + ": added to orwiktionary - https://or.wiktionary.org/wiki/"
-                + transcription
-            )
-
-        return result
+        # Put the edited section back into the page
+        return text[:start] + self._serialize(language_section) + text[end:], outcomes.ADDED
 
     """
     Private methods
     """
 
-    # Try to extract the language section
-    def __get_language_section(self, wikicode, language_qid):
+    # Try to locate the language section
+    def __find_language_section(self, text, language_qid):
         # Check if the record's language has a BCP 47 code, stop here if not
         if language_qid not in self.language_code_map:
             return None
 
-        lang = self.language_code_map[language_qid]
         langLabel = self.language_label_map[language_qid]
 
-        # Travel across each sections titles to find the one we want
-        for section in wikicode.sections:
-            if section.title is None:
-                continue
-
-            # Examples:
-            # * water -> == [[ଇଂରାଜୀ ଭାଷା|ଇଂରାଜୀ]] ==
-            # (keep ଇଂରାଜୀ ଭାଷା because this is the Wikidata label)
-            # * ଓଡ଼ିଆ -> ==ଓଡ଼ିଆ==
-            # * ନାଜର୍ -> == [[ଓଡ଼ିଆ]] ==
-
-            clean_title = section.title
+        # Examples:
+        # * water -> == [[ଇଂରାଜୀ ଭାଷା|ଇଂରାଜୀ]] ==
+        # (keep ଇଂରାଜୀ ଭାଷା because this is the Wikidata label)
+        # * ଓଡ଼ିଆ -> ==ଓଡ଼ିଆ==
+        # * ନାଜର୍ -> == [[ଓଡ଼ିଆ]] ==
+        def is_language_title(title):
+            clean_title = title
             pos1 = clean_title.find("|")
             if pos1 != -1:
                 pos2 = clean_title.find("]]")
@@ -238,12 +152,10 @@ class OrWiktionary(Wiktionary):
             clean_title = clean_title.replace(" ", "") \
                 .replace("[[", "") \
                 .replace("]]", "")
-            if clean_title == langLabel:
-                return section
+            return clean_title == langLabel
 
-        # If we arrive here, it means that there is no section for
-        # the record's language
-        return None
+        # Scan the section titles to find the one we want
+        return find_section(text, is_language_title)
 
     # Try to extract the pronunciation subsection
     def get_pronunciation_section(self, wikicode):
@@ -281,7 +193,7 @@ class OrWiktionary(Wiktionary):
 
     # Add the audio template to the pronunciation section
     def __append_file(self, wikicode, filename, language_qid):
-        section_content = wtp.parse(wikicode.sections[1].contents)
+        section_content = self._parse(wikicode.sections[1].contents)
 
         pronunciation_line = PRONUNCIATION_LINE.replace("$1", filename).replace("$2", self.language_code_map[
             language_qid])
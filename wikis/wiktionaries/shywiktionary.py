@@ -3,15 +3,14 @@
 # License: GNU GPL v2+
 
 import re
-from typing import List
+from typing import List, Optional, Tuple
 
-import wikitextparser as wtp
-
-import sparql
-from sparql import SPARQL_ENDPOINT
+import language_map
+import location_map
+import outcomes
 
 from record import Record
-from wikis.wiktionary import Wiktionary, replace_apostrophe, safe_append_text, get_locations_from_records, \
+from wikis.wiktionary import Wiktionary, find_section, replace_apostrophe, safe_append_text, \
     get_pronunciation_section
 
 SUMMARY = "Arnay afaylu s weslay s ɣer Lingua Libre"
@@ -27,21 +26,8 @@ FOLLOWING_SECTIONS = [
     "====Cuf====",
 ]
 
-LANGUAGE_QUERY = """
-SELECT ?item ?code ?itemLabel
-WHERE {
-    ?item wdt:P305 ?code.
-      SERVICE wikibase:label { bd:serviceParam wikibase:language "shy, fr" . }
-}
-"""
-LOCATION_QUERY = """
-SELECT ?location ?locationLabel ?countryLabel
-WHERE {
-  ?location wdt:P17 ?country.
-  SERVICE wikibase:label { bd:serviceParam wikibase:language "shy, shy-latn, fr" . }
-  VALUES ?location { wd:$1 }
-}
-"""
+# Languages of the labels of the places, by order of preference
+LOCATION_LANGUAGES = ("shy", "shy-latn", "fr")
 
 BOTTOM_REGEX = re.compile(
     r"(?:\s*(?:\[\[(?:Category|Taggayt):[^]]+]])?)*$",
@@ -50,6 +36,7 @@ BOTTOM_REGEX = re.compile(
 
 
 class ShyWiktionary(Wiktionary):
+    dbname = "shywiktionary"
 
     def __init__(self, username: str, password: str, dry_run: bool) -> None:
         """
@@ -58,6 +45,7 @@ class ShyWiktionary(Wiktionary):
         @param password: Password to log into the account
         """
         super().__init__(username, password, "shy", SUMMARY, dry_run)
+        location_map.require_labels(LOCATION_LANGUAGES)
 
     """
     Public methods
@@ -68,58 +56,54 @@ class ShyWiktionary(Wiktionary):
     # - Get the labels of the speaker's location in Shawiya
     def prepare(self, records: List[Record]) -> List[Record]:
         # Get BCP 47 language code map
-        self.language_code_map = {}
-        raw_language_code_map = sparql.request(SPARQL_ENDPOINT, LANGUAGE_QUERY)
-
-        for line in raw_language_code_map:
-            self.language_code_map[
-                sparql.format_value(line, "item")
-            ] = sparql.format_value(line, "code")
-
-        raw_location_map = get_locations_from_records(LOCATION_QUERY, records)
-
-        self.location_map = {}
-        for line in raw_location_map:
-            country = sparql.format_value(line, "countryLabel")
-            location = sparql.format_value(line, "locationLabel")
-            self.location_map[sparql.format_value(line, "location")] = country
+        self.language_code_map = language_map.get().codes
+        # Only the records of these languages can have a language section on this wiki
+        self.languages = set(self.language_code_map)
+
+        locations = location_map.resolve([record for record in records if self.accepts(record)])
+
+        # Swapped in at once, as in FrWiktionary.prepare
+        labels = {}
+        for location_qid, country_qid in locations.items():
+            country = locations.label(country_qid, LOCATION_LANGUAGES)
+            location = locations.label(location_qid, LOCATION_LANGUAGES)
+            labels[location_qid] = country
             if country != location:
-                self.location_map[sparql.format_value(line, "location")] += f" ({location})"
+                labels[location_qid] += f" ({location})"
+        self.location_map = labels
 
         return records
 
-    def execute(self, record) -> bool:
+    def entry_title(self, record: Record) -> str:
         """
-        Try to use the given record on the Shawiya Wiktionary
+        Normalize the record using shywiktionary's titles conventions
         @param record:
         @return:
         """
-        # Normalize the record using shywiktionary's titles conventions
-        transcription = replace_apostrophe(record.transcription)
-
-        # Fetch the content of the page having the transcription for title
-        (is_already_present, wikicode, basetimestamp) = self.get_entry(
-            transcription, record.file
-        )
-
-        # Whether there is no entry for this record on shywiktionary
-        if not wikicode:
-            return False
+        return replace_apostrophe(record.transcription)
 
-        # Whether the record is already inside the entry
-        if is_already_present:
-            print(f"{record.id}//{transcription}: already on shywiktionary")
-            return False
+    def _apply(self, record: Record, text: str) -> Tuple[Optional[str], str]:
+        """
+        Add the given record to the content of its entry on the Shawiya Wiktionary
+        @param record:
+        @param text:
+        @return:
+        """
+        transcription = self.entry_title(record)
 
-        # Try to extract the section of the language of the record
-        language_section = self.__get_language_section(
-            wikicode, record.language["qid"]
+        # Try to locate the section of the language of the record
+        span = self.__find_language_section(
+            text, record.language["qid"]
         )
 
         # Whether there is no section for the current language
-        if language_section is None:
+        if span is None:
             print(f'{record.id}//{transcription}: language section not found')
-            return False
+            return None, outcomes.NO_SECTION
+
+        # Only this section is parsed
+        start, end = span
+        language_section = self._parse(text[start:end])
 
         # Try to extract the pronunciation subsection
         pronunciation_section = get_pronunciation_section(language_section, "{{s|alaɣi}}")
@@ -138,26 +122,13 @@ class ShyWiktionary(Wiktionary):
             location,
         )
 
-        # Save the result
-        result = False
-        try:
-            result = self.do_edit(transcription, wikicode, basetimestamp)
-        except Exception as e:
-            if "editconflict" in str(e):
-                self.execute(record)
-            else:
-                raise e
-        if result:
-            print(
-                f'{record.id}//{transcription}: added to shywiktionary - https://shy.wiktionary.org/wiki/{transcription}'
-            )
-
-        return result
-
-    def __get_language_section(self, wikicode, language_qid):
+        # Put the edited section back into the page
+        return text[:start] + self._serialize(language_section) + text[end:], outcomes.ADDED
+
+    def __find_language_section(self, text, language_qid):
         """
-        Try to extract the language section
-        @param wikicode:
+        Try to locate the language section
+        @param text:
         @param language_qid:
         @return:
         """
@@ -167,17 +138,8 @@ class ShyWiktionary(Wiktionary):
 
         lang = self.language_code_map[language_qid]
 
-        # Travel across each sections titles to find the one we want
-        for section in wikicode.sections:
-            if section.title is None:
-                continue
-
-            if section.title.replace(" ", "").lower() == "{{langue|" + lang + "}}":
-                return section
-
-                # If we arrive here, it means that there is no section for
-                # the record's language
-        return None
+        # Scan the section titles to find the one we want
+        return find_section(text, lambda title: title.replace(" ", "").lower() == "{{langue|" + lang + "}}")
 
     def __create_pronunciation_section(self, wikicode):
         """
@@ -213,7 +175,7 @@ class ShyWiktionary(Wiktionary):
         @param language_qid:
         @param location_qid:
         """
-        section_content = wtp.parse(wikicode.sections[1].contents)
+        section_content = self._parse(wikicode.sections[1].contents)
 
         location = ""
         if location_qid in self.location_map:
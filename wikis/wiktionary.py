@@ -5,18 +5,43 @@
 # License: GNU GPL v2+
 
 import abc
+import random
 import re
-from typing import Tuple, Optional, List, Set
+import time
+from typing import Callable, Tuple, Optional, List, Set
 
 import wikitextparser as wtp
 
-import sparql
-from sparql import SPARQL_ENDPOINT
-
+import metrics
+import outcomes
+import profiling
+import title_index
+from pywiki import EditConflictException
 from record import Record
 from wikis.wiki import Wiki
 
 SANITIZE_REGEX = re.compile(r"== +\n")
+# Section headings, found the same way as wikitextparser does, once the comments are masked
+HEADING_REGEX = re.compile(r"^\0*(={1,6})([^\r\n]+?)\1[ \t\0]*$", re.MULTILINE)
+COMMENT_REGEX = re.compile(r"<!--.*?(?:-->|\Z)", re.DOTALL)
+# Tags whose content MediaWiki never splits in sections: a heading inside them
+# changes the numbers and the extent of the sections
+HIDING_TAGS_REGEX = re.compile(
+    r"<(?:ref|references|gallery|poem|pre|nowiki|math|chem|score|syntaxhighlight|source|timeline|hiero|imagemap"
+    r"|includeonly|noinclude|onlyinclude)\b",
+    re.IGNORECASE,
+)
+# Boundaries of the templates, and lines which may be headings inside them
+TEMPLATE_LINES_REGEX = re.compile(r"{{|}}|^\0*=", re.MULTILINE)
+# Whitespace stripped by MediaWiki at the end of the text of an edit (PHP's rtrim)
+TRAILING_WHITESPACE = " \t\n\r\0\x0b"
+# Number of times an entry is fetched and edited again when someone else edits it at the same time
+MAX_EDIT_ATTEMPTS = 4
+# Number of seconds waited before the second attempt, doubled before each of the next ones
+EDIT_CONFLICT_DELAY = 2
+# Outcome of a record whose file is added by another record of its group: already present
+# once the edit has been saved, still pending otherwise (never stored as such)
+ADDED_BY_GROUP = "added by another record"
 
 
 def replace_apostrophe(text: str) -> str:
@@ -43,15 +68,113 @@ def safe_append_text(content, text, pattern: re.Pattern):
     return content[:index] + text + content[index:]
 
 
-def get_locations_from_records(query: str, records: List[Record]) -> Set[str]:
-    locations = set()
-    for record in records:
-        if record.language["learning"] is not None:
-            locations.add(record.language["learning"])
-        if record.speaker_residence is not None:
-            locations.add(record.speaker_residence)
+def normalize_file_name(filename: str) -> str:
+    """
+    Normalize a file name the way MediaWiki does for its titles.
+    @param filename: the name of the file, without namespace
+    @return:
+    """
+    filename = filename.replace("_", " ").strip()
+    return filename[:1].upper() + filename[1:]
+
+
+def mask_comments(text: str) -> str:
+    return COMMENT_REGEX.sub(lambda comment: "\0" * len(comment.group()), text)
+
+
+def find_section(text: str, title_matches: Callable[[str], bool]) -> Optional[Tuple[int, int]]:
+    """
+    Locate the first section whose title matches, without parsing the page,
+    so that only this section needs to be parsed.
+    @param text: the wikitext of the page
+    @param title_matches: whether a section title, as between its equal signs, is the one looked for
+    @return: the start and end offsets of the section, subsections included; None if there is none
+    """
+    shadow = mask_comments(text)
+
+    start = level = None
+    for heading in HEADING_REGEX.finditer(shadow):
+        if start is None:
+            if title_matches(text[heading.start(2):heading.end(2)]):
+                start, level = heading.start(), len(heading.group(1))
+        elif len(heading.group(1)) <= level:
+            return start, heading.start()
+
+    return (start, len(text)) if start is not None else None
+
+
+def common_prefix_length(text: str, other: str) -> int:
+    # Compare whole chunks first, the pages being mostly left untouched
+    length = 0
+    chunk = 4096
+    while chunk:
+        while length + chunk <= min(len(text), len(other)) \
+                and text[length:length + chunk] == other[length:length + chunk]:
+            length += chunk
+        chunk //= 2
+    return length
+
+
+def get_changed_section(text: str, new_text: str) -> Optional[Tuple[int, int, int]]:
+    """
+    Find the smallest section which contains all the differences between two versions of a page.
+    @param text: the wikitext of the page
+    @param new_text: the edited wikitext of the page
+    @return: the number of the section, and its start and end offsets in the first version;
+     None if the differences are not inside a single section.
+     The sections are those of the headings of the wikitext, which are only the sections of MediaWiki
+     if there is no markup hiding some of them (see has_uncertain_headings)
+    """
+    # Length of the common prefix, and offset of the common suffix in the first version
+    prefix = common_prefix_length(text, new_text)
+    suffix = len(text) - common_prefix_length(text[prefix:][::-1], new_text[prefix:][::-1])
+
+    headings = [(heading.start(), len(heading.group(1))) for heading in HEADING_REGEX.finditer(mask_comments(text))]
+    changed = None
+    for number, (start, level) in enumerate(headings, 1):
+        # The heading itself must be left untouched
+        if start >= prefix:
+            break
+        end = next((other for other, other_level in headings[number:] if other_level <= level), len(text))
+        if end >= suffix and text.startswith("=", start):
+            changed = number, start, end
+
+    return changed
+
+
+def has_uncertain_headings(text: str) -> bool:
+    """
+    @param text: the wikitext of a page
+    @return: whether MediaWiki may split the page in other sections than its headings do
+    """
+    shadow = mask_comments(text)
+    if HIDING_TAGS_REGEX.search(shadow) is not None:
+        return True
 
-    return sparql.request(SPARQL_ENDPOINT, query.replace("$1", " wd:".join(locations)))
+    # Most entries use templates, but hardly any of them has a heading in its parameters
+    depth = 0
+    for token in TEMPLATE_LINES_REGEX.finditer(shadow):
+        if token.group() == "{{":
+            depth += 1
+        elif token.group() == "}}":
+            depth = max(depth - 1, 0)
+        elif depth > 0:
+            return True
+    return False
+
+
+def get_heading_offsets(text: str) -> List[int]:
+    """
+    @param text: the wikitext of a page
+    @return: the offset in bytes of each heading, as given by MediaWiki for each section of the page
+    """
+    offsets = []
+    position = size = 0
+    for heading in HEADING_REGEX.finditer(mask_comments(text)):
+        size += len(text[position:heading.start(1)].encode("utf-8"))
+        position = heading.start(1)
+        offsets.append(size)
+    return offsets
 
 
 def get_pronunciation_section(wikicode: wtp.WikiText, section_title: str) -> Optional[wtp.Section]:
@@ -83,10 +206,116 @@ class Wiktionary(Wiki, abc.ABC):
         """
         super().__init__(username, password, "wiktionary", language_domain, dry_run)
         self.summary = summary
+        self.prefetched = {}
+        self.titles = title_index.TitleIndex(self.api, self.dbname)
+        # Languages of the records which can be added to this wiki, known once prepare() has been called
+        self.languages: Optional[Set[str]] = None
+
+    def accepts(self, record: Record) -> bool:
+        return self.languages is None or record.language["qid"] in self.languages
+
+    def refresh(self) -> None:
+        self.titles.refresh()
+
+    def entry_title(self, record: Record) -> str:
+        """
+        @return: the title of the entry of the given record on this wiki
+        """
+        return record.transcription
+
+    def file_name(self, record: Record) -> str:
+        """
+        @return: the name of the file of the given record, as added to this wiki;
+         the record itself is shared by all the wikis, and keeps the name known by Lingua Libre
+        """
+        return record.file
+
+    # Fetch the contents and timestamp of the entries of the given records,
+    # 50 titles per request (500 with apihighlimits), so that get_entry
+    # can read them from memory instead of sending one request per record.
+    def prefetch(self, records: List[Record]) -> None:
+        self.titles.update()
+
+        files = {}
+        for record in records:
+            # Such titles cannot be sent in a multi-value parameter
+            if "|" in self.entry_title(record):
+                continue
+            # Nor is it worth asking for the pages which do not exist
+            if not self.titles.may_exist(self.entry_title(record)):
+                continue
+            files.setdefault(self.entry_title(record), set()).add(normalize_file_name(self.file_name(record)))
+
+        self.prefetched = {}
+        batches = []
+        titles = []
+        batch_files = set()
+        for title in files:
+            if titles and (len(titles) == self.api.batch_size
+                           or len(batch_files | files[title]) > self.api.batch_size):
+                batches.append((titles, batch_files))
+                titles = []
+                batch_files = set()
+            titles.append(title)
+            batch_files |= files[title]
+        if titles:
+            batches.append((titles, batch_files))
+
+        # The batches are sent at the same time, within the read rate of the wiki
+        self.gather(self.__prefetch_batch(titles, batch_files) for titles, batch_files in batches)
+
+    async def __prefetch_batch(self, titles: List[str], files: Set[str]) -> None:
+        pages = {}
+        normalized = {}
+        continuation = {}
+        while True:
+            response = await self.async_api.request(
+                {
+                    "action": "query",
+                    "format": "json",
+                    "formatversion": "2",
+                    "prop": "images|revisions",
+                    "rvprop": "content|timestamp",
+                    "titles": "|".join(titles),
+                    "imimages": "|".join(f"File:{filename}" for filename in sorted(files)),
+                    "imlimit": "max",
+                    **continuation,
+                }
+            )
+
+            for item in response["query"].get("normalized", []):
+                normalized[item["to"]] = item["from"]
+
+            # Pages may be spread over several responses, merge their parts
+            for page in response["query"]["pages"]:
+                entry = pages.setdefault(normalized.get(page["title"], page["title"]), {"images": set()})
+                if "missing" in page or "invalid" in page:
+                    entry["missing"] = True
+                for image in page.get("images", []):
+                    entry["images"].add(image["title"].split(":", 1)[1])
+                if "revisions" in page:
+                    entry["revision"] = page["revisions"][0]
+
+            if "continue" not in response:
+                break
+            continuation = response["continue"]
+
+        for title, entry in pages.items():
+            if "missing" in entry:
+                self.prefetched[title] = None
+            elif "revision" in entry:
+                self.prefetched[title] = (files, entry["images"], entry["revision"])
+
+    def __fetch_entry(self, pagename: str, filenames: Set[str]) -> Tuple[Set[str], Optional[str], int]:
+        # A prefetched entry is used once: after an edit, the page must be fetched again
+        if pagename in self.prefetched:
+            if self.prefetched[pagename] is None:
+                return set(), None, 0
+            checked_files, images, revision = self.prefetched[pagename]
+            if filenames <= checked_files:
+                del self.prefetched[pagename]
+                return filenames & images, revision["content"], revision["timestamp"]
 
-    # Fetch the contents of the given Wiktionary entry,
-    # and check by the way whether the file is already in it.
-    def get_entry(self, pagename: str, filename: str) -> Tuple[bool, Optional[wtp.WikiText], int]:
         response = self.api.request(
             {
                 "action": "query",
@@ -95,7 +324,8 @@ class Wiktionary(Wiki, abc.ABC):
                 "prop": "images|revisions",
                 "rvprop": "content|timestamp",
                 "titles": pagename,
-                "imimages": f"File:{filename}",
+                "imimages": "|".join(f"File:{filename}" for filename in sorted(filenames)),
+                "imlimit": "max",
             }
         )
 
@@ -103,36 +333,235 @@ class Wiktionary(Wiki, abc.ABC):
 
         # If no pages have been found on this wiki for the given title
         if "missing" in page:
-            return False, None, 0
+            return set(), None, 0
 
-        # If there is the 'images' key, this means that the API has found
-        # the file at least once in the page, see [[:mw:API:Images]]
-        is_already_present = "images" in page
+        # The 'images' key lists the files that the API has found
+        # at least once in the page, see [[:mw:API:Images]]
+        images = {image["title"].split(":", 1)[1] for image in page.get("images", [])}
 
         # Extract the needed infos from the response and return them
-        wikicode = page["revisions"][0]["content"]
-        basetimestamp = page["revisions"][0]["timestamp"]
+        return filenames & images, page["revisions"][0]["content"], page["revisions"][0]["timestamp"]
+
+    # Fetch the contents of the given Wiktionary entry,
+    # and check by the way which of the given files are already in it.
+    # The contents are not parsed: only the section which is edited is worth it.
+    def get_entry(self, pagename: str, filenames: Set[str]) -> Tuple[Set[str], Optional[str], int]:
+        # Most records have no entry on the wiki, which the title index tells without any request
+        if not self.titles.may_exist(pagename):
+            return set(), None, 0
+
+        present, wikicode, basetimestamp = self.__fetch_entry(pagename, filenames)
+
+        if wikicode is None:
+            return set(), None, 0
 
         # Sanitize the wikicode to avoid edge cases later on
         wikicode = SANITIZE_REGEX.sub('==\n', wikicode)
 
-        return is_already_present, wtp.parse(wikicode), basetimestamp
+        return present, wikicode, basetimestamp
 
-    # Edit the page
-    def do_edit(self, page_name: str, wikicode, basetimestamp) -> bool:
-        result = self.api.request(
-            {
-                "action": "edit",
-                "format": "json",
-                "formatversion": "2",
-                "title": page_name,
-                "summary": self.summary,
-                "basetimestamp": basetimestamp,
-                "text": str(wikicode),
-                "token": self.api.get_csrf_token(),
-                "nocreate": 1,
-                "bot": 1,
-            }
-        )
+    def group(self, records: List[Record]) -> List[List[Record]]:
+        """
+        Group the records having the same entry, so that each entry is fetched and edited once.
+        """
+        groups = {}
+        for record in records:
+            groups.setdefault(self.entry_title(record), []).append(record)
+        return list(groups.values())
+
+    def execute(self, record: Record) -> bool:
+        return self.execute_group([record])[0]
+
+    def execute_group(self, records: List[Record]) -> List[bool]:
+        """
+        Add the given records, which have the same entry, to this entry with a single edit.
+        @param records: the records to add
+        @return: for each record, True if it has been added; False otherwise
+        """
+        title = self.entry_title(records[0])
+        with metrics.timer("execute_phase_seconds", wiki=self.dbname, phase="check"):
+            checked = [self._check(record) for record in records]
+        filenames = {normalize_file_name(self.file_name(record))
+                     for record, outcome in zip(records, checked) if outcome is None}
+
+        result = False
+        for attempt in range(MAX_EDIT_ATTEMPTS):
+            if attempt > 0:
+                # Someone else is editing the page: leave them some time, then start again from their revision
+                delay = EDIT_CONFLICT_DELAY * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                metrics.count("edit_conflict_wait_seconds_total", delay, wiki=self.dbname)
+                time.sleep(delay)
+                self.prefetched.pop(title, None)
+
+            record_outcomes, text, new_text, basetimestamp = self.__apply_group(title, records, checked, filenames)
+            if outcomes.ADDED not in record_outcomes:
+                break
+
+            try:
+                with metrics.timer("execute_phase_seconds", wiki=self.dbname, phase="save"):
+                    result = self.save_entry(title, text, new_text, basetimestamp)
+                break
+            except EditConflictException:
+                self.edit_conflicts += 1
+                metrics.count("edit_conflicts_total", wiki=self.dbname)
+                print(f'{title}: edit conflict on {self.dbname} ({attempt + 1}/{MAX_EDIT_ATTEMPTS})')
+        else:
+            # The records added are left pending, to be tried again on the next run
+            metrics.count("edit_conflicts_given_up_total", wiki=self.dbname)
+            print(f'{title}: still in conflict on {self.dbname}, given up')
+
+        results = []
+        for record, outcome in zip(records, record_outcomes):
+            if outcome in (outcomes.ADDED, ADDED_BY_GROUP) and not result:
+                results.append(False)
+                continue
+            if outcome == ADDED_BY_GROUP:
+                print(f'{record.id}//{title}: already on {self.dbname}')
+                outcome = outcomes.ALREADY_PRESENT
+            if outcome == outcomes.ADDED:
+                print(f'{record.id}//{title}: added to {self.dbname} - '
+                      f'https://{self.language_domain}.wiktionary.org/wiki/{title}')
+            results.append(self.report(record, outcome))
+        return results
+
+    def __apply_group(self, title: str, records: List[Record], checked: List[Optional[str]],
+                      filenames: Set[str]) -> Tuple[List[Optional[str]], Optional[str], Optional[str], int]:
+        """
+        Add the given records to the latest revision of their entry.
+        @param title: the title of the entry
+        @param records: the records to add
+        @param checked: the outcome of each record found before the entry is fetched, if any
+        @param filenames: the normalized names of the files of the records to look for in the entry
+        @return: the outcome of each record (ADDED_BY_GROUP for a file added by another record),
+        the text of the revision, its new text and its timestamp
+        """
+        record_outcomes = list(checked)
+
+        # Fetch the content of the page having the transcription for title
+        with metrics.timer("execute_phase_seconds", wiki=self.dbname, phase="fetch"):
+            present, text, basetimestamp = self.get_entry(title, filenames) if filenames else (set(), None, 0)
+
+        # Add the records one after the other to the content of the page
+        new_text = text
+        # Files added by this edit, which are only on the page once it has been saved
+        added = set()
+        for i, record in enumerate(records):
+            if record_outcomes[i] is not None:
+                continue
+
+            # Whether there is no entry for this record on the wiki
+            if not text:
+                record_outcomes[i] = outcomes.NO_ENTRY
+                continue
+
+            # Whether the record is already inside the entry, or added by another record
+            filename = normalize_file_name(self.file_name(record))
+            if filename in added:
+                record_outcomes[i] = ADDED_BY_GROUP
+                continue
+            if filename in present:
+                print(f'{record.id}//{title}: already on {self.dbname}')
+                record_outcomes[i] = outcomes.ALREADY_PRESENT
+                continue
+
+            # Parse and edit the entry
+            with metrics.timer("execute_phase_seconds", wiki=self.dbname, phase="apply"), \
+                    profiling.page(self.dbname, title, new_text):
+                applied, record_outcomes[i] = self._apply(record, new_text)
+            if applied is not None:
+                # As MediaWiki would do if the records were saved one by one
+                new_text = applied.rstrip(TRAILING_WHITESPACE)
+                added.add(filename)
+
+        return record_outcomes, text, new_text, basetimestamp
+
+    def _check(self, record: Record) -> Optional[str]:
+        """
+        Check whether the given record can be added to this wiki, before its entry is fetched.
+        @param record: the record to check
+        @return: the outcome of the record if it cannot be added; None otherwise
+        """
+        return None
+
+    # Parse wikitext, timed apart from the rest of the edition by the profiling mode
+    def _parse(self, text: str) -> wtp.WikiText:
+        with profiling.phase("parse"):
+            return wtp.parse(text)
+
+    # Turn parsed wikitext back into text, timed apart as well
+    def _serialize(self, wikicode: wtp.WikiText) -> str:
+        with profiling.phase("serialize"):
+            return str(wikicode)
+
+    @abc.abstractmethod
+    def _apply(self, record: Record, text: str) -> Tuple[Optional[str], str]:
+        """
+        Add the given record to the content of its entry.
+        @param record: the record to add
+        @param text: the content of the entry
+        @return: the new content of the entry, or None if the record cannot be added;
+         along with the outcome of the record
+        """
+        pass
+
+    # Edit the page, or only one of its sections if a section number is given
+    def do_edit(self, page_name: str, wikicode, basetimestamp, section: Optional[int] = None) -> bool:
+        data = {
+            "action": "edit",
+            "format": "json",
+            "formatversion": "2",
+            "title": page_name,
+            "summary": self.summary,
+            "basetimestamp": basetimestamp,
+            "text": str(wikicode),
+            "token": self.api.get_csrf_token(),
+            "nocreate": 1,
+            "bot": 1,
+        }
+        if section is not None:
+            data["section"] = section
+
+        result = self.api.request(data)
 
         return "edit" in result
+
+    # Save the new content of the page, sending only the section which has changed
+    # whenever the result is the same as sending the whole page
+    def save_entry(self, page_name: str, text: str, new_text: str, basetimestamp) -> bool:
+        changed = get_changed_section(text, new_text)
+        if changed is not None:
+            number, start, end = changed
+            section = new_text[start:end + len(new_text) - len(text)]
+
+            # MediaWiki strips the trailing whitespace of the section, then separates it
+            # from the next one with a blank line
+            if (end == len(text) or section.rstrip(TRAILING_WHITESPACE) + "\n\n" == section) \
+                    and self.__has_same_sections(page_name, text):
+                return self.do_edit(page_name, section, basetimestamp, number)
+
+        return self.do_edit(page_name, new_text, basetimestamp)
+
+    def __has_same_sections(self, page_name: str, text: str) -> bool:
+        """
+        Check that MediaWiki splits the page in the same sections as its headings do,
+        so that a section number sent in an edit designates the same text.
+        @param page_name: the title of the page
+        @param text: the wikitext of the page
+        @return: True if the sections are the same; False otherwise, or if it cannot be told
+        """
+        if not has_uncertain_headings(text):
+            return True
+
+        response = self.api.request({
+            "action": "parse",
+            "format": "json",
+            "formatversion": "2",
+            "page": page_name,
+            "prop": "sections",
+        })
+        if "parse" not in response:
+            return False
+
+        # The sections coming from templates cannot be edited, and are not numbered
+        offsets = [section["byteoffset"] for section in response["parse"]["sections"] if section["index"].isdigit()]
+        return offsets == get_heading_offsets(text)